@@ -0,0 +1,78 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-medical-records")
+@click.option("--doctype", help="Document Type to rebuild, all the tracked ones by default")
+@click.option("--from-date", help="Only rebuild documents dated on or after (YYYY-MM-DD)")
+@click.option("--to-date", help="Only rebuild documents dated on or before (YYYY-MM-DD)")
+@click.option("--batch-size", type=int, default=500, help="Documents read and written at a time")
+@click.option(
+	"--workers",
+	type=int,
+	default=1,
+	help="Split each Document Type into this many chunks rebuilt by background jobs",
+)
+@pass_context
+def rebuild_medical_records(
+	context, doctype=None, from_date=None, to_date=None, batch_size=500, workers=1
+):
+	"Rebuild the Patient Medical Records of the documents tracked in Patient History Settings"
+	import frappe
+
+	from healthcare.healthcare.medical_record_rebuild import (
+		enqueue_medical_record_rebuild,
+		get_medical_record_doctypes,
+	)
+	from healthcare.healthcare.medical_record_rebuild import rebuild_medical_records as rebuild
+
+	def echo_progress(stats):
+		click.echo(
+			"{doctype}: {documents} documents, {created} created, {updated} updated, "
+			"{throughput} documents/s".format(**stats)
+		)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if workers > 1:
+			job_ids = enqueue_medical_record_rebuild(doctype, from_date, to_date, workers, batch_size)
+			frappe.db.commit()
+			click.secho(f"Queued {len(job_ids)} jobs on the long queue", fg="green")
+			return
+
+		for dt in get_medical_record_doctypes(doctype):
+			stats = rebuild(dt, from_date, to_date, batch_size=batch_size, progress=echo_progress)
+			click.secho(
+				"Rebuilt medical records of {doctype} in {elapsed}s, {deleted} deleted, "
+				"{throughput} documents/s".format(**stats),
+				fg="green",
+			)
+	finally:
+		frappe.destroy()
+
+
+@click.command("rebuild-patient-activity")
+@click.option("--patient", help="Patient to recount, all patients by default")
+@pass_context
+def rebuild_patient_activity(context, patient=None):
+	"Count the Patient Medical Records of each patient and day again from scratch"
+	import frappe
+
+	from healthcare.healthcare.doctype.patient_activity_count.patient_activity_count import (
+		rebuild_patient_activity_counts,
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		rebuild_patient_activity_counts(patient)
+		frappe.db.commit()
+		click.secho("Patient activity counts rebuilt", fg="green")
+	finally:
+		frappe.destroy()
+
+
+commands = [rebuild_medical_records, rebuild_patient_activity]
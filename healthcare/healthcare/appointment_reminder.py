@@ -0,0 +1,243 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.core.doctype.sms_settings.sms_settings import (
+	create_sms_log,
+	get_headers,
+	send_request,
+	validate_receiver_nos,
+)
+from frappe.utils import get_time
+
+REMINDER_BATCH_SIZE = 500
+REMINDER_MAX_WORKERS = 4
+# messages per second handed to the gateway
+REMINDER_RATE_LIMIT = 10
+REMINDER_MAX_RETRIES = 3
+REMINDER_BACKOFF = 1
+# consecutive failures after which the gateway is considered down for this run
+REMINDER_MAX_FAILURES = 10
+
+
+class SMSSettingsGateway:
+	"""Sends SMS through the gateway configured in SMS Settings, `send` is safe to call from
+	worker threads as the settings are read upfront and logs are written by the caller"""
+
+	def __init__(self):
+		settings = frappe.get_doc("SMS Settings")
+		if not settings.sms_gateway_url:
+			frappe.throw(_("Please Update SMS Settings"))
+
+		self.url = settings.sms_gateway_url
+		self.use_post = settings.use_post
+		self.headers = get_headers(settings)
+		self.use_json = self.headers.get("Content-Type") == "application/json"
+		self.receiver_parameter = settings.receiver_parameter
+		self.params = {d.parameter: d.value for d in settings.get("parameters") if not d.header}
+		self.message_parameter = settings.message_parameter
+
+	def send(self, number, message):
+		params = dict(self.params)
+		params[self.message_parameter] = message
+		params[self.receiver_parameter] = number
+		status = send_request(self.url, params, self.headers, self.use_post, self.use_json)
+		return 200 <= status < 300
+
+	def log(self, number, message):
+		create_sms_log({"message": message, "receiver_list": [number]}, [number])
+
+
+class StubSMSGateway:
+	"""Local gateway for tests, records sent messages in `outbox` and fails for `fail_numbers`"""
+
+	def __init__(self, fail_numbers=None):
+		self.outbox = []
+		self.fail_numbers = set(fail_numbers or [])
+		self.lock = threading.Lock()
+
+	def send(self, number, message):
+		if number in self.fail_numbers:
+			return False
+
+		with self.lock:
+			self.outbox.append((number, message))
+		return True
+
+	def log(self, number, message):
+		pass
+
+
+class RateLimiter:
+	"""Spaces out calls across threads to at most `rate` per second"""
+
+	def __init__(self, rate):
+		self.interval = 1 / rate if rate else 0
+		self.next_slot = time.monotonic()
+		self.lock = threading.Lock()
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.next_slot - now
+			self.next_slot = max(now, self.next_slot) + self.interval
+
+		if delay > 0:
+			time.sleep(delay)
+
+
+def get_sms_gateway():
+	return frappe.flags.sms_gateway or SMSSettingsGateway()
+
+
+def send_appointment_reminders():
+	"""
+	Send reminders for appointments due within the remind before window of Healthcare Settings,
+	runs every scheduler tick and handles at most REMINDER_BATCH_SIZE appointments per run
+	:return: dict with the number of reminders sent, failed and skipped for want of a mobile
+	"""
+	settings = frappe.db.get_value(
+		"Healthcare Settings",
+		None,
+		["send_appointment_reminder", "remind_before", "appointment_reminder_msg"],
+		as_dict=True,
+	)
+	if not settings.send_appointment_reminder:
+		return
+
+	appointments = claim_due_reminders(settings.remind_before)
+	if not appointments:
+		return
+
+	template = frappe.get_jenv().from_string(settings.appointment_reminder_msg or "")
+	mobiles = dict(
+		frappe.get_all(
+			"Patient",
+			filters={"name": ["in", list({appointment.patient for appointment in appointments})]},
+			fields=["name", "mobile"],
+			as_list=True,
+		)
+	)
+
+	messages, skipped = [], []
+	for appointment in appointments:
+		mobile = mobiles.get(appointment.patient)
+		numbers = validate_receiver_nos([mobile]) if mobile else []
+		if not numbers:
+			skipped.append(appointment.name)
+			continue
+
+		context = {"doc": appointment, "alert": appointment, "comments": None}
+		if appointment.get("_comments"):
+			context["comments"] = json.loads(appointment.get("_comments"))
+		messages.append((appointment.name, numbers[0], template.render(context)))
+
+	sent, failed = [], []
+	if messages:
+		try:
+			gateway = get_sms_gateway()
+		except Exception:
+			# an SMS gateway that is not set up fails the reminders, the skipped ones are
+			# still marked
+			frappe.log_error(frappe.get_traceback(), _("Appointment Reminder Failed"))
+			gateway = None
+			failed = [name for name, _number, _message in messages]
+
+		if gateway:
+			sent, failed = dispatch(gateway, messages)
+			for name, number, message in messages:
+				if name in sent:
+					gateway.log(number, message)
+
+	# failed reminders stay unmarked and are retried next run while still due
+	mark_reminded(list(sent) + skipped)
+
+	if failed:
+		frappe.log_error(
+			_("Appointment reminders could not be sent for {0}").format(", ".join(failed)),
+			_("Appointment Reminder Failed"),
+		)
+
+	return {"sent": len(sent), "failed": len(failed), "skipped": len(skipped)}
+
+
+def claim_due_reminders(remind_before):
+	now = datetime.datetime.now()
+	remind_before = get_time(remind_before)
+	reminder_dt = now + datetime.timedelta(
+		hours=remind_before.hour, minutes=remind_before.minute, seconds=remind_before.second
+	)
+
+	appointment = frappe.qb.DocType("Patient Appointment")
+	return (
+		frappe.qb.from_(appointment)
+		.select("*")
+		.where(appointment.appointment_datetime.between(now, reminder_dt))
+		.where(appointment.reminded == 0)
+		.where(appointment.status != "Cancelled")
+		.orderby(appointment.appointment_datetime)
+		.limit(REMINDER_BATCH_SIZE)
+		# overlapping runs skip the rows claimed by another worker
+		.for_update(skip_locked=True)
+	).run(as_dict=True)
+
+
+def dispatch(gateway, messages):
+	"""Send `messages` [(name, number, message)] through a bounded worker pool with retries,
+	gives up on the remaining messages once the gateway keeps failing"""
+	rate_limiter = RateLimiter(REMINDER_RATE_LIMIT)
+	state = frappe._dict(consecutive_failures=0)
+	lock = threading.Lock()
+	sent, failed = set(), []
+
+	def send(name, number, message):
+		for attempt in range(REMINDER_MAX_RETRIES):
+			if state.consecutive_failures >= REMINDER_MAX_FAILURES:
+				break
+
+			rate_limiter.wait()
+			try:
+				success = gateway.send(number, message)
+			except Exception:
+				success = False
+
+			with lock:
+				state.consecutive_failures = 0 if success else state.consecutive_failures + 1
+			if success:
+				return True
+
+			if attempt < REMINDER_MAX_RETRIES - 1:
+				time.sleep(REMINDER_BACKOFF * 2**attempt)
+
+		return False
+
+	with ThreadPoolExecutor(max_workers=REMINDER_MAX_WORKERS) as executor:
+		futures = {
+			executor.submit(send, name, number, message): name for name, number, message in messages
+		}
+		for future, name in futures.items():
+			if future.result():
+				sent.add(name)
+			else:
+				failed.append(name)
+
+	return sent, failed
+
+
+def mark_reminded(appointments):
+	if not appointments:
+		return
+
+	appointment = frappe.qb.DocType("Patient Appointment")
+	(
+		frappe.qb.update(appointment)
+		.set(appointment.reminded, 1)
+		.where(appointment.name.isin(appointments))
+	).run()
@@ -0,0 +1,293 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import json
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint, create_batch, flt, getdate
+
+from healthcare.healthcare.utils import (
+	ServicesToInvoiceContext,
+	get_appointments_to_invoice,
+	get_clinical_procedures_to_invoice,
+	get_encounters_to_invoice,
+	get_lab_tests_to_invoice,
+	get_therapy_sessions_to_invoice,
+)
+
+BULK_INVOICING_CHUNK_SIZE = 50
+
+# outpatient services picked up by the date they are rendered on
+BULK_INVOICING_DOCTYPES = {
+	"Patient Appointment": "appointment_date",
+	"Patient Encounter": "encounter_date",
+	"Lab Test": "date",
+	"Clinical Procedure": "start_date",
+	"Therapy Session": "start_date",
+}
+
+BULK_INVOICING_COLLECTORS = (
+	get_appointments_to_invoice,
+	get_encounters_to_invoice,
+	get_lab_tests_to_invoice,
+	get_clinical_procedures_to_invoice,
+	get_therapy_sessions_to_invoice,
+)
+
+
+class BulkInvoicingRun:
+	"""
+	Invoices the unbilled outpatient services of a company rendered between two dates, one
+	Sales Invoice per patient. Patients are walked in name order and committed in chunks,
+	the last patient of each committed chunk is checkpointed so that a failed run resumes
+	where it stopped.
+	"""
+
+	def __init__(self, company, from_date, to_date, submit=False, chunk_size=None):
+		self.company = company
+		self.from_date = getdate(from_date)
+		self.to_date = getdate(to_date)
+		self.submit = cint(submit)
+		self.chunk_size = cint(chunk_size) or BULK_INVOICING_CHUNK_SIZE
+		self.key = get_checkpoint_key(company, self.from_date, self.to_date)
+		self.checkpoint = get_checkpoint(self.key)
+		self.context = ServicesToInvoiceContext(company)
+
+	def run(self):
+		patients = self.get_patients()
+		self.checkpoint.update(
+			status="Running", total=self.checkpoint.patients + len(patients), submit=self.submit
+		)
+		self.save_checkpoint()
+
+		started = time.monotonic()
+		processed = 0
+		for chunk in create_batch(patients, self.chunk_size):
+			self.invoice_patients(list(chunk))
+
+			processed += len(chunk)
+			self.checkpoint.last_patient = chunk[-1]
+			self.checkpoint.patients += len(chunk)
+			self.checkpoint.throughput = flt(processed / max(time.monotonic() - started, 1e-3), 2)
+			self.save_checkpoint()
+			frappe.db.commit()
+			self.publish_progress()
+
+		self.checkpoint.status = "Completed"
+		self.save_checkpoint()
+		frappe.db.commit()
+		self.publish_progress()
+
+		frappe.logger("healthcare").info(
+			"Bulk invoicing for {0} from {1} to {2}: {3} invoices for {4} patients, {5} failed".format(
+				self.company,
+				self.from_date,
+				self.to_date,
+				self.checkpoint.invoices,
+				self.checkpoint.patients,
+				len(self.checkpoint.failed),
+			)
+		)
+		return self.checkpoint
+
+	def get_patients(self):
+		"""Patients with services to invoice in the date range, after the checkpointed patient"""
+		patients = set()
+		for doctype, date_field in BULK_INVOICING_DOCTYPES.items():
+			filters = self.get_filters(doctype, date_field)
+			if self.checkpoint.last_patient:
+				filters["patient"] = [">", self.checkpoint.last_patient]
+			patients.update(frappe.get_all(doctype, filters=filters, pluck="patient", distinct=True))
+
+		patients.discard(None)
+		return sorted(patients)
+
+	def get_filters(self, doctype, date_field):
+		filters = {
+			"company": self.company,
+			date_field: ["between", [self.from_date, self.to_date]],
+			"docstatus": ["!=", 2],
+		}
+		# prescriptions of invoiced encounters may still be unbilled
+		if doctype != "Patient Encounter":
+			filters["invoiced"] = 0
+		if doctype == "Patient Appointment":
+			filters["status"] = ["!=", "Cancelled"]
+		return filters
+
+	def invoice_patients(self, patients):
+		customers = dict(
+			frappe.get_all(
+				"Patient", filters={"name": ["in", patients]}, fields=["name", "customer"], as_list=True
+			)
+		)
+		references = self.get_references(patients)
+
+		for patient in patients:
+			if not customers.get(patient):
+				self.checkpoint.skipped += 1
+				continue
+
+			frappe.db.savepoint("bulk_invoicing")
+			try:
+				if self.invoice_patient(patient, customers[patient], references.get(patient, set())):
+					self.checkpoint.invoices += 1
+			except Exception:
+				frappe.db.rollback(save_point="bulk_invoicing")
+				frappe.log_error(
+					frappe.get_traceback(), _("Bulk Invoicing Failed for Patient {0}").format(patient)
+				)
+				self.checkpoint.failed.append(patient)
+
+	def get_references(self, patients):
+		"""(doctype, name) of the services of `patients` rendered in the date range, by patient"""
+		references = {}
+		encounters = {}
+		for doctype, date_field in BULK_INVOICING_DOCTYPES.items():
+			filters = self.get_filters(doctype, date_field)
+			filters["patient"] = ["in", patients]
+			for row in frappe.get_all(doctype, filters=filters, fields=["name", "patient"]):
+				references.setdefault(row.patient, set()).add((doctype, row.name))
+				if doctype == "Patient Encounter":
+					encounters[row.name] = row.patient
+
+		if encounters:
+			for prescription_dt in ("Lab Prescription", "Procedure Prescription"):
+				for row in frappe.get_all(
+					prescription_dt,
+					filters={
+						"parenttype": "Patient Encounter",
+						"parent": ["in", list(encounters)],
+						"invoiced": 0,
+					},
+					fields=["name", "parent"],
+				):
+					references[encounters[row.parent]].add((prescription_dt, row.name))
+
+		# services already on a draft invoice, from a previous run or entered by hand
+		names = [
+			name for patient_references in references.values() for _doctype, name in patient_references
+		]
+		if names:
+			invoice = frappe.qb.DocType("Sales Invoice")
+			invoice_item = frappe.qb.DocType("Sales Invoice Item")
+			drafted = set(
+				(
+					frappe.qb.from_(invoice_item)
+					.inner_join(invoice)
+					.on(invoice.name == invoice_item.parent)
+					.select(invoice_item.reference_dt, invoice_item.reference_dn)
+					.where(invoice.docstatus == 0)
+					.where(invoice_item.reference_dn.isin(names))
+				).run()
+			)
+			for patient_references in references.values():
+				patient_references -= drafted
+
+		return references
+
+	def invoice_patient(self, patient, customer, references):
+		if not references:
+			return
+
+		patient_doc = frappe._dict(name=patient)
+		items = [
+			item
+			for collector in BULK_INVOICING_COLLECTORS
+			for item in collector(patient_doc, self.company, self.context)
+			if (item["reference_type"], item["reference_name"]) in references
+		]
+		if not items:
+			return
+
+		sales_invoice = frappe.new_doc("Sales Invoice")
+		sales_invoice.patient = patient
+		sales_invoice.customer = customer
+		sales_invoice.company = self.company
+		sales_invoice.due_date = getdate()
+		sales_invoice.set_healthcare_services(
+			[
+				{
+					"item": item.get("service"),
+					"qty": item.get("qty"),
+					"rate": item.get("rate"),
+					"income_account": item.get("income_account"),
+					"dt": item["reference_type"],
+					"dn": item["reference_name"],
+					"description": item.get("description"),
+				}
+				for item in items
+			]
+		)
+		sales_invoice.flags.ignore_mandatory = True
+		sales_invoice.save(ignore_permissions=True)
+		if self.submit:
+			sales_invoice.submit()
+
+		return sales_invoice
+
+	def save_checkpoint(self):
+		frappe.db.set_global(self.key, json.dumps(self.checkpoint, default=str))
+
+	def publish_progress(self):
+		frappe.publish_realtime(
+			"healthcare_bulk_invoicing_progress",
+			{"key": self.key, **self.checkpoint},
+			user=frappe.session.user,
+		)
+
+
+def get_checkpoint_key(company, from_date, to_date):
+	return f"healthcare_bulk_invoicing::{company}::{getdate(from_date)}::{getdate(to_date)}"
+
+
+def get_checkpoint(key):
+	"""State of the run for `key`, a fresh one unless an earlier run is to be resumed"""
+	checkpoint = frappe.db.get_global(key)
+	checkpoint = frappe._dict(json.loads(checkpoint)) if checkpoint else frappe._dict()
+	if checkpoint.get("status") in (None, "Completed"):
+		checkpoint = frappe._dict(
+			status="Queued", last_patient=None, patients=0, total=0, invoices=0, skipped=0, failed=[]
+		)
+	return checkpoint
+
+
+def run_bulk_invoicing(company, from_date, to_date, submit=False, chunk_size=None):
+	return BulkInvoicingRun(company, from_date, to_date, submit, chunk_size).run()
+
+
+@frappe.whitelist()
+def enqueue_bulk_invoicing(company, from_date, to_date, submit=False):
+	"""
+	Queue the invoicing of the unbilled outpatient services of `company` rendered between
+	`from_date` and `to_date`, resumes the previous run for the same range if it failed
+	:param submit: Submit the invoices created, they are left as drafts otherwise
+	:return: the checkpoint of the run
+	"""
+	frappe.has_permission("Sales Invoice", "create", throw=True)
+	if cint(submit):
+		frappe.has_permission("Sales Invoice", "submit", throw=True)
+
+	key = get_checkpoint_key(company, from_date, to_date)
+	frappe.enqueue(
+		run_bulk_invoicing,
+		queue="long",
+		timeout=6000,
+		job_id=key,
+		deduplicate=True,
+		enqueue_after_commit=True,
+		company=company,
+		from_date=from_date,
+		to_date=to_date,
+		submit=submit,
+	)
+	return get_checkpoint(key)
+
+
+@frappe.whitelist()
+def get_bulk_invoicing_status(company, from_date, to_date):
+	frappe.has_permission("Sales Invoice", "read", throw=True)
+	checkpoint = frappe.db.get_global(get_checkpoint_key(company, from_date, to_date))
+	return json.loads(checkpoint) if checkpoint else None
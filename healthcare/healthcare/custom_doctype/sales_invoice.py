@@ -1,28 +1,39 @@
+import time
+
 import frappe
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
 
+from healthcare.healthcare.utils import get_item_price_rates
+
 
 class HealthcareSalesInvoice(SalesInvoice):
 	@frappe.whitelist()
 	def set_healthcare_services(self, checked_values):
-		from erpnext.stock.get_item_details import get_item_details
+		"""Append the checked healthcare services as items, referenced documents and item prices
+		are fetched once for all the services and missing values are set once at the end"""
+		timings = {}
+		started = time.perf_counter()
+
+		price_list_rates = self.get_healthcare_price_list_rates(
+			[checked_item["item"] for checked_item in checked_values if not checked_item["rate"]]
+		)
+		lab_tests = {}
+		lab_test_names = [
+			checked_item["dn"] for checked_item in checked_values if checked_item["dt"] == "Lab Test"
+		]
+		if lab_test_names:
+			lab_tests = {
+				lab_test.name: lab_test
+				for lab_test in frappe.get_all(
+					"Lab Test",
+					filters={"name": ["in", lab_test_names]},
+					fields=["name", "service_unit", "practitioner", "department"],
+				)
+			}
+		timings["fetch"] = time.perf_counter() - started
 
 		for checked_item in checked_values:
 			item_line = self.append("items", {})
-			price_list, price_list_currency = frappe.db.get_values(
-				"Price List", {"selling": 1}, ["name", "currency"]
-			)[0]
-			args = {
-				"doctype": "Sales Invoice",
-				"item_code": checked_item["item"],
-				"company": self.company,
-				"customer": frappe.db.get_value("Patient", self.patient, "customer"),
-				"selling_price_list": price_list,
-				"price_list_currency": price_list_currency,
-				"plc_conversion_rate": 1.0,
-				"conversion_rate": 1.0,
-			}
-			item_details = get_item_details(args)
 			item_line.item_code = checked_item["item"]
 			item_line.qty = 1
 			if checked_item["qty"]:
@@ -30,7 +41,7 @@ class HealthcareSalesInvoice(SalesInvoice):
 			if checked_item["rate"]:
 				item_line.rate = checked_item["rate"]
 			else:
-				item_line.rate = item_details.price_list_rate
+				item_line.rate = price_list_rates.get(checked_item["item"])
 			item_line.amount = float(item_line.rate) * float(item_line.qty)
 			if checked_item["income_account"]:
 				item_line.income_account = checked_item["income_account"]
@@ -41,9 +52,57 @@ class HealthcareSalesInvoice(SalesInvoice):
 			if checked_item["description"]:
 				item_line.description = checked_item["description"]
 			if checked_item["dt"] == "Lab Test":
-				lab_test = frappe.get_doc("Lab Test", checked_item["dn"])
+				lab_test = lab_tests.get(checked_item["dn"]) or frappe._dict()
 				item_line.service_unit = lab_test.service_unit
 				item_line.practitioner = lab_test.practitioner
 				item_line.medical_department = lab_test.department
+		timings["append"] = time.perf_counter() - started - timings["fetch"]
 
 		self.set_missing_values(for_validate=True)
+		timings["set_missing_values"] = (
+			time.perf_counter() - started - timings["fetch"] - timings["append"]
+		)
+
+		self.flags.healthcare_services_timings = timings
+		frappe.logger("healthcare").debug(
+			"set_healthcare_services: {0} items, {1}".format(
+				len(checked_values),
+				", ".join(f"{step} {duration:.3f}s" for step, duration in timings.items()),
+			)
+		)
+
+	def get_healthcare_price_list_rates(self, item_codes):
+		"""Selling price list rate of each of `item_codes` for the patient's customer"""
+		from erpnext.stock.get_item_details import get_item_details
+
+		item_codes = list(dict.fromkeys(item_codes))
+		if not item_codes:
+			return {}
+
+		price_list, price_list_currency = frappe.db.get_values(
+			"Price List", {"selling": 1}, ["name", "currency"]
+		)[0]
+		customer = frappe.db.get_value("Patient", self.patient, "customer")
+
+		# without prices for the customer the list rates of the price list apply, shared by all
+		price_list_rates = {}
+		if not frappe.db.exists("Item Price", {"price_list": price_list, "customer": customer}):
+			price_list_rates = get_item_price_rates(item_codes, price_list)
+
+		for item_code in item_codes:
+			if item_code in price_list_rates:
+				continue
+
+			args = {
+				"doctype": "Sales Invoice",
+				"item_code": item_code,
+				"company": self.company,
+				"customer": customer,
+				"selling_price_list": price_list,
+				"price_list_currency": price_list_currency,
+				"plc_conversion_rate": 1.0,
+				"conversion_rate": 1.0,
+			}
+			price_list_rates[item_code] = get_item_details(args).price_list_rate
+
+		return price_list_rates
@@ -1,5 +1,24 @@
 import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, nowdate
+
+from healthcare.healthcare.bulk_invoicing import get_checkpoint_key, run_bulk_invoicing
+from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment import (
+	create_appointment,
+	create_encounter,
+	create_healthcare_docs,
+	create_healthcare_service_items,
+	create_medical_department,
+)
+from healthcare.healthcare.doctype.patient_medical_record.test_patient_medical_record import (
+	create_lab_test,
+	create_lab_test_template,
+	create_procedure,
+)
+from healthcare.healthcare.utils import (
+	get_drugs_to_invoice_for_encounters,
+	set_invoiced_references,
+)
 
 test_records = frappe.get_test_records("Sales Invoice")
 
@@ -24,6 +43,211 @@ class TestSalesInvoice(FrappeTestCase):
 
 		invoice.set_healthcare_services(checked_values)
 		self.assertEqual(count + 1, len(invoice.items))
+		self.assertIn("set_missing_values", invoice.flags.healthcare_services_timings)
 
 		invoice.set_healthcare_services(checked_values)
 		self.assertEqual(count + 2, len(invoice.items))
+
+	def test_set_healthcare_services_with_mixed_services(self):
+		frappe.db.set_single_value(
+			"Healthcare Settings", {"automate_appointment_invoicing": 0, "enable_free_follow_ups": 0}
+		)
+		patient, practitioner = create_healthcare_docs()
+		appointment = create_appointment(patient, practitioner, nowdate())
+		template = create_lab_test_template(create_medical_department())
+		lab_test = create_lab_test(template.name, patient)
+		frappe.db.set_value("Lab Test", lab_test.name, "practitioner", practitioner)
+
+		item = create_healthcare_service_items()
+		price_list = frappe.db.get_values("Price List", {"selling": 1}, "name")[0][0]
+		if not frappe.db.exists("Item Price", {"item_code": item, "price_list": price_list}):
+			frappe.get_doc(
+				{
+					"doctype": "Item Price",
+					"item_code": item,
+					"price_list": price_list,
+					"price_list_rate": 150,
+				}
+			).insert()
+		item_rate = frappe.db.get_value(
+			"Item Price", {"item_code": item, "price_list": price_list}, "price_list_rate"
+		)
+
+		invoice = frappe.new_doc("Sales Invoice")
+		invoice.patient = patient
+		invoice.customer = frappe.db.get_value("Patient", patient, "customer") or "_Test Customer"
+		invoice.company = "_Test Company"
+		invoice.due_date = nowdate()
+		invoice.set_healthcare_services(
+			[
+				{
+					"item": item,
+					"qty": False,
+					"rate": 300,
+					"income_account": False,
+					"dt": "Patient Appointment",
+					"dn": appointment.name,
+					"description": False,
+				},
+				{
+					"item": template.item,
+					"qty": False,
+					"rate": 2000,
+					"income_account": False,
+					"dt": "Lab Test",
+					"dn": lab_test.name,
+					"description": "Blood Test",
+				},
+				# rate from the price list
+				{
+					"item": item,
+					"qty": 2,
+					"rate": False,
+					"income_account": False,
+					"dt": False,
+					"dn": False,
+					"description": False,
+				},
+			]
+		)
+
+		self.assertEqual(len(invoice.items), 3)
+		appointment_item, lab_test_item, item_line = invoice.items
+		self.assertEqual(
+			(appointment_item.reference_dt, appointment_item.reference_dn, appointment_item.rate),
+			("Patient Appointment", appointment.name, 300),
+		)
+		self.assertEqual(
+			(lab_test_item.reference_dn, lab_test_item.practitioner, lab_test_item.description),
+			(lab_test.name, practitioner, "Blood Test"),
+		)
+		self.assertEqual((item_line.qty, item_line.rate), (2, item_rate))
+		self.assertFalse(item_line.reference_dt)
+		self.assertEqual(
+			set(invoice.flags.healthcare_services_timings), {"fetch", "append", "set_missing_values"}
+		)
+
+	def test_bulk_invoicing(self):
+		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 0)
+		frappe.db.set_single_value("Healthcare Settings", "enable_free_follow_ups", 0)
+		patient, practitioner = create_healthcare_docs()
+		date = add_days(nowdate(), 7)
+		appointment = create_appointment(patient, practitioner, date)
+		out_of_range = create_appointment(patient, practitioner, add_days(date, 2))
+		frappe.db.set_global(get_checkpoint_key("_Test Company", date, date), None)
+
+		checkpoint = run_bulk_invoicing("_Test Company", date, date, submit=True)
+		self.assertEqual(checkpoint.status, "Completed")
+		self.assertEqual(checkpoint.invoices, 1)
+		self.assertFalse(checkpoint.failed)
+		self.assertEqual(frappe.db.get_value("Patient Appointment", appointment.name, "invoiced"), 1)
+		self.assertEqual(frappe.db.get_value("Patient Appointment", out_of_range.name, "invoiced"), 0)
+
+		# nothing left to invoice in the range
+		checkpoint = run_bulk_invoicing("_Test Company", date, date, submit=True)
+		self.assertEqual(checkpoint.invoices, 0)
+
+	def test_set_invoiced_references(self):
+		frappe.db.set_single_value(
+			"Healthcare Settings", {"automate_appointment_invoicing": 0, "enable_free_follow_ups": 0}
+		)
+		consumable_item = create_healthcare_service_items()
+		frappe.db.set_single_value(
+			"Healthcare Settings", "clinical_procedure_consumable_item", consumable_item
+		)
+		patient, practitioner = create_healthcare_docs()
+
+		appointment = create_appointment(patient, practitioner, nowdate())
+		encounter = create_encounter(appointment)
+		procedure_appointment = create_appointment(
+			patient, practitioner, add_days(nowdate(), 1), procedure_template=1
+		)
+		procedure = create_procedure(procedure_appointment)
+
+		# a lab test created for a prescription of the encounter
+		template = create_lab_test_template(create_medical_department())
+		prescription = frappe.get_doc(
+			{
+				"doctype": "Lab Prescription",
+				"parent": encounter.name,
+				"parenttype": "Patient Encounter",
+				"parentfield": "lab_test_prescription",
+				"lab_test_code": template.name,
+				"lab_test_created": 1,
+			}
+		)
+		prescription.db_insert()
+		lab_test = create_lab_test(template.name, patient)
+		frappe.db.set_value("Lab Test", lab_test.name, "prescription", prescription.name)
+
+		items = [
+			frappe._dict(reference_dt=dt, reference_dn=dn, item_code=item_code)
+			for dt, dn, item_code in (
+				("Patient Appointment", appointment.name, None),
+				("Patient Appointment", procedure_appointment.name, None),
+				("Clinical Procedure", procedure.name, consumable_item),
+				("Lab Prescription", prescription.name, template.item),
+			)
+		]
+		# two lines of an invoice can not bill the same document
+		self.assertRaises(
+			frappe.ValidationError, set_invoiced_references, [*items, items[0]], "on_submit"
+		)
+		self.assertEqual(frappe.db.get_value("Patient Appointment", appointment.name, "invoiced"), 0)
+
+		invoiced_fields = (
+			("Patient Appointment", appointment.name, "invoiced"),
+			("Patient Encounter", encounter.name, "invoiced"),
+			("Patient Appointment", procedure_appointment.name, "invoiced"),
+			("Clinical Procedure", procedure.name, "invoiced"),
+			("Clinical Procedure", procedure.name, "consumption_invoiced"),
+			("Lab Prescription", prescription.name, "invoiced"),
+			("Lab Test", lab_test.name, "invoiced"),
+		)
+
+		set_invoiced_references(items, "on_submit")
+		for doctype, name, fieldname in invoiced_fields:
+			self.assertEqual(frappe.db.get_value(doctype, name, fieldname), 1, (doctype, fieldname))
+
+		# the references can not be invoiced twice
+		self.assertRaises(frappe.ValidationError, set_invoiced_references, items, "on_submit")
+
+		set_invoiced_references(items, "on_cancel")
+		for doctype, name, fieldname in invoiced_fields:
+			self.assertEqual(frappe.db.get_value(doctype, name, fieldname), 0, (doctype, fieldname))
+
+	def test_drugs_to_invoice_for_invoiced_encounter(self):
+		frappe.db.set_single_value(
+			"Healthcare Settings", {"automate_appointment_invoicing": 0, "enable_free_follow_ups": 0}
+		)
+		patient, practitioner = create_healthcare_docs()
+		frappe.db.set_value("Patient", patient, "customer", "_Test Customer")
+		encounter = create_encounter(create_appointment(patient, practitioner, nowdate()))
+
+		prescription = frappe.get_doc(
+			{
+				"doctype": "Drug Prescription",
+				"parent": encounter.name,
+				"parenttype": "Patient Encounter",
+				"parentfield": "drug_prescription",
+				"drug_code": create_healthcare_service_items(),
+			}
+		)
+		prescription.db_insert()
+		# the consultation was billed already
+		frappe.db.set_value("Patient Encounter", encounter.name, "invoiced", 1)
+
+		invoices = get_drugs_to_invoice_for_encounters([encounter.name])["invoices"]
+		self.assertEqual(len(invoices), 1)
+		self.assertEqual(invoices[0]["encounters"], [encounter.name])
+
+		items = [frappe._dict(item) for item in invoices[0]["items"]]
+		self.assertEqual(
+			[(item.reference_dt, item.reference_dn) for item in items],
+			[("Drug Prescription", prescription.name)],
+		)
+
+		# billing the drugs neither fails on nor touches the invoiced encounter
+		set_invoiced_references(items, "on_submit")
+		set_invoiced_references(items, "on_cancel")
+		self.assertEqual(frappe.db.get_value("Patient Encounter", encounter.name, "invoiced"), 1)
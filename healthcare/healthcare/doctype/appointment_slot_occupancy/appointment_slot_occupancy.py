@@ -0,0 +1,217 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import datetime
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, create_batch, get_time, getdate, now, today
+
+from healthcare.healthcare.overlap_checker import get_booked_index
+
+
+class AppointmentSlotOccupancy(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_unique(
+		"Appointment Slot Occupancy",
+		["practitioner", "practitioner_schedule", "service_unit", "slot_date", "from_time"],
+		constraint_name="unique_practitioner_slot",
+	)
+	frappe.db.add_index("Appointment Slot Occupancy", ["practitioner", "slot_date"])
+	frappe.db.add_index("Appointment Slot Occupancy", ["service_unit", "slot_date"])
+
+
+def build_slot_occupancy(practitioners=None, from_date=None, to_date=None):
+	"""
+	Rebuild the slot occupancy of practitioners for the booking horizon,
+	runs daily and whenever practitioner schedules change
+	"""
+	from_date = getdate(from_date or today())
+	to_date = getdate(to_date or add_days(from_date, get_booking_horizon()))
+
+	# slots of past days are of no use for booking
+	frappe.db.delete("Appointment Slot Occupancy", {"slot_date": ["<", today()]})
+
+	if not practitioners:
+		practitioners = frappe.get_all(
+			"Practitioner Service Unit Schedule",
+			filters={"parenttype": "Healthcare Practitioner"},
+			pluck="parent",
+			distinct=True,
+		)
+
+	for batch in create_batch(practitioners, 100):
+		build_slot_occupancy_for_practitioners(list(batch), from_date, to_date)
+
+
+def build_slot_occupancy_for_practitioners(practitioners, from_date, to_date):
+	from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
+		get_booked_appointments,
+		get_schedule_data,
+		get_slot_appointments,
+		get_slot_capacity,
+	)
+
+	schedule_data = get_schedule_data(practitioners)
+	appointments = get_booked_appointments(from_date, to_date, list(schedule_data.service_units))
+
+	frappe.db.delete(
+		"Appointment Slot Occupancy",
+		{"practitioner": ["in", practitioners], "slot_date": ["between", [from_date, to_date]]},
+	)
+
+	timestamp, user = now(), frappe.session.user
+	values = []
+	for day in range((to_date - from_date).days + 1):
+		date = add_days(from_date, day)
+		weekday = date.strftime("%A")
+		for practitioner in practitioners:
+			for entry in schedule_data.entries.get(practitioner, []):
+				service_unit = schedule_data.service_units.get(entry.service_unit)
+				if not service_unit:
+					continue
+
+				booked = get_booked_index(
+					get_slot_appointments(appointments.get(date, []), practitioner, service_unit)
+				)
+				for time_slot in schedule_data.time_slots.get((entry.schedule, weekday), []):
+					start = datetime.datetime.combine(date, get_time(time_slot.from_time))
+					end = datetime.datetime.combine(date, get_time(time_slot.to_time))
+					values.append(
+						(
+							frappe.generate_hash(length=10),
+							timestamp,
+							timestamp,
+							user,
+							user,
+							practitioner,
+							entry.schedule,
+							entry.service_unit,
+							date,
+							time_slot.from_time,
+							time_slot.to_time,
+							get_slot_capacity(service_unit),
+							booked.count(start, end),
+						)
+					)
+
+	frappe.db.bulk_insert(
+		"Appointment Slot Occupancy",
+		fields=[
+			"name",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"practitioner",
+			"practitioner_schedule",
+			"service_unit",
+			"slot_date",
+			"from_time",
+			"to_time",
+			"capacity",
+			"booked",
+		],
+		values=values,
+		ignore_duplicates=True,
+	)
+
+
+def get_booking_horizon():
+	return (
+		frappe.db.get_single_value(
+			"Healthcare Settings", "number_of_days_appointments_can_be_booked_in_advance"
+		)
+		or 30
+	)
+
+
+def update_slot_occupancy(appointment):
+	"""Recount the slots of the service unit days touched by a booking, reschedule or cancellation"""
+	affected = set()
+	for doc in (appointment, appointment.get_doc_before_save()):
+		if doc and doc.service_unit and doc.appointment_date:
+			affected.add((doc.service_unit, getdate(doc.appointment_date)))
+
+	for service_unit, date in affected:
+		refresh_slot_occupancy(service_unit, date)
+
+
+def refresh_slot_occupancy(service_unit, date):
+	from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
+		get_booked_appointments,
+		get_slot_appointments,
+	)
+
+	date = getdate(date)
+	slots = frappe.get_all(
+		"Appointment Slot Occupancy",
+		filters={"service_unit": service_unit, "slot_date": date},
+		fields=["name", "practitioner", "from_time", "to_time", "booked"],
+	)
+	if not slots:
+		return
+
+	service_unit = frappe.db.get_value(
+		"Healthcare Service Unit",
+		service_unit,
+		["name", "overlap_appointments", "service_unit_capacity"],
+		as_dict=True,
+	)
+	appointments = get_booked_appointments(date, date, [service_unit.name]).get(date, [])
+
+	for slot in slots:
+		start = datetime.datetime.combine(date, get_time(slot.from_time))
+		end = datetime.datetime.combine(date, get_time(slot.to_time))
+		booked = get_booked_index(
+			get_slot_appointments(appointments, slot.practitioner, service_unit)
+		).count(start, end)
+		if booked != slot.booked:
+			frappe.db.set_value(
+				"Appointment Slot Occupancy", slot.name, "booked", booked, update_modified=False
+			)
+
+
+def enqueue_slot_occupancy_build(practitioners):
+	frappe.enqueue(
+		build_slot_occupancy,
+		practitioners=practitioners,
+		job_id="build_slot_occupancy::" + ",".join(sorted(practitioners)),
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+@frappe.whitelist()
+def get_slot_occupancy(practitioner, from_date, to_date=None, free_only=False):
+	"""
+	Get the precomputed slots of 'practitioner' between 'from_date' and 'to_date'
+	:param free_only: Only return slots with capacity left
+	:return: list of slots with capacity and booked count, ordered by date and time
+	"""
+	filters = {
+		"practitioner": practitioner,
+		"slot_date": ["between", [getdate(from_date), getdate(to_date or from_date)]],
+	}
+	slots = frappe.get_all(
+		"Appointment Slot Occupancy",
+		filters=filters,
+		fields=[
+			"practitioner_schedule",
+			"service_unit",
+			"slot_date",
+			"from_time",
+			"to_time",
+			"capacity",
+			"booked",
+		],
+		order_by="slot_date, from_time",
+	)
+
+	if frappe.utils.cint(free_only):
+		slots = [slot for slot in slots if slot.booked < slot.capacity]
+
+	return slots
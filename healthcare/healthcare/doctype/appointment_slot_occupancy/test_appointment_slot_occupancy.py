@@ -0,0 +1,67 @@
+# Copyright (c) 2026, healthcare and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate, nowdate
+
+from healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy import (
+	build_slot_occupancy,
+	get_slot_occupancy,
+)
+from healthcare.healthcare.doctype.patient_appointment.patient_appointment import update_status
+from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment import (
+	create_appointment,
+	create_healthcare_docs,
+	create_practitioner_schedule,
+	create_service_unit,
+)
+
+
+class TestAppointmentSlotOccupancy(FrappeTestCase):
+	def setUp(self):
+		frappe.db.sql("""delete from `tabPatient Appointment`""")
+		frappe.db.sql("""delete from `tabAppointment Slot Occupancy`""")
+
+	def test_slot_occupancy(self):
+		patient, practitioner = create_healthcare_docs()
+		service_unit = create_service_unit(id=2)
+		create_practitioner_schedule(practitioner, service_unit)
+		date = add_days(nowdate(), 1)
+
+		build_slot_occupancy([practitioner], nowdate(), add_days(nowdate(), 7))
+		slots = get_slot_occupancy(practitioner, date)
+		self.assertEqual(len(slots), 3)
+		self.assertTrue(all(slot.booked == 0 and slot.capacity == 1 for slot in slots))
+
+		# booking
+		appointment = create_appointment(patient, practitioner, date, service_unit=service_unit, save=0)
+		appointment.appointment_time = "09:00:00"
+		appointment.save(ignore_permissions=True)
+		self.assertEqual(get_booked_count(practitioner, date, "09:00:00"), 1)
+		self.assertEqual(len(get_slot_occupancy(practitioner, date, free_only=True)), 2)
+
+		# reschedule
+		appointment.appointment_time = "10:00:00"
+		appointment.save(ignore_permissions=True)
+		self.assertEqual(get_booked_count(practitioner, date, "09:00:00"), 0)
+		self.assertEqual(get_booked_count(practitioner, date, "10:00:00"), 1)
+
+		# cancel
+		update_status(appointment.name, "Cancelled")
+		self.assertEqual(get_booked_count(practitioner, date, "10:00:00"), 0)
+
+		# removing every schedule clears the slots
+		practitioner_doc = frappe.get_doc("Healthcare Practitioner", practitioner)
+		practitioner_doc.set("practitioner_schedules", [])
+		practitioner_doc.save(ignore_permissions=True)
+		build_slot_occupancy([practitioner], nowdate(), add_days(nowdate(), 7))
+		self.assertFalse(get_slot_occupancy(practitioner, date))
+
+
+def get_booked_count(practitioner, date, from_time):
+	return frappe.db.get_value(
+		"Appointment Slot Occupancy",
+		{"practitioner": practitioner, "slot_date": getdate(date), "from_time": from_time},
+		"booked",
+	)
@@ -9,27 +9,39 @@ from frappe.model.document import Document
 
 class DrugPrescription(Document):
 	def get_quantity(self):
-		quantity = 0
-		dosage = None
+		dosage_strength = None
 		period = None
 
 		if self.dosage:
 			dosage = frappe.get_doc("Prescription Dosage", self.dosage)
-			for item in dosage.dosage_strength:
-				quantity += item.strength
-			if self.period and self.interval:
-				period = frappe.get_doc("Prescription Duration", self.period)
-				if self.interval < period.get_days():
-					quantity = quantity * (period.get_days() / self.interval)
-
-		elif self.interval and self.interval_uom and self.period:
+			dosage_strength = sum(item.strength for item in dosage.dosage_strength)
+		if self.period:
 			period = frappe.get_doc("Prescription Duration", self.period)
-			interval_in = self.interval_uom
-			if interval_in == "Day" and self.interval < period.get_days():
-				quantity = period.get_days() / self.interval
-			elif interval_in == "Hour" and self.interval < period.get_hours():
-				quantity = period.get_hours() / self.interval
-		if quantity > 0:
-			return quantity
-		else:
-			return 1
+
+		return get_drug_quantity(self, dosage_strength, period)
+
+
+def get_drug_quantity(drug_line, dosage_strength=None, period=None):
+	"""
+	Quantity to dispense for a drug prescription line
+	:param dosage_strength: total strength of the line's Prescription Dosage
+	:param period: the line's Prescription Duration
+	"""
+	quantity = 0
+
+	if drug_line.dosage:
+		quantity += dosage_strength or 0
+		if period and drug_line.interval:
+			if drug_line.interval < period.get_days():
+				quantity = quantity * (period.get_days() / drug_line.interval)
+
+	elif drug_line.interval and drug_line.interval_uom and period:
+		interval_in = drug_line.interval_uom
+		if interval_in == "Day" and drug_line.interval < period.get_days():
+			quantity = period.get_days() / drug_line.interval
+		elif interval_in == "Hour" and drug_line.interval < period.get_hours():
+			quantity = period.get_hours() / drug_line.interval
+	if quantity > 0:
+		return quantity
+	else:
+		return 1
@@ -7,7 +7,8 @@ import json
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import getdate
+from frappe.query_builder.functions import Count
+from frappe.utils import getdate, now
 
 
 class FeeValidity(Document):
@@ -15,16 +16,279 @@ class FeeValidity(Document):
 		self.update_status()
 
 	def update_status(self):
-		if getdate(self.valid_till) < getdate():
-			self.status = "Expired"
-		elif self.visited == self.max_visits:
-			self.status = "Completed"
+		self.status = get_fee_validity_status(self)
+
+
+def get_fee_validity_status(fee_validity):
+	if getdate(fee_validity.valid_till) < getdate():
+		return "Expired"
+	elif fee_validity.visited == fee_validity.max_visits:
+		return "Completed"
+	else:
+		return "Active"
+
+
+class FeeValidityLedger:
+	"""
+	Fee validities of a patient with a practitioner and the appointments they cover, loaded once
+	so that booking, invoicing and rescheduling an appointment resolve free visits in memory,
+	changes are written back together by `commit`
+	"""
+
+	def __init__(self, patient, practitioner, appointment=None):
+		self.patient = patient
+		self.practitioner = practitioner
+		self.settings = frappe.db.get_value(
+			"Healthcare Settings",
+			None,
+			["enable_free_follow_ups", "max_visits", "valid_days"],
+			as_dict=True,
+		)
+		self.validities = {}
+		# appointment -> fee validity covering it as a free visit
+		self.references = {}
+		self.changed = set()
+		# visits added (removed when negative) and new dates by fee validity, written as deltas
+		self.visits = {}
+		self.rescheduled = set()
+		self.added_references = {}
+		self.removed_references = set()
+		if self.settings.enable_free_follow_ups:
+			self.load(appointment)
+
+	def load(self, appointment=None):
+		if not self.patient:
+			return
+
+		# validities invoiced with or covering the appointment are loaded even if the
+		# appointment moved to another practitioner
+		or_filters = {"practitioner": self.practitioner}
+		if appointment:
+			or_filters["patient_appointment"] = appointment
+		validities = frappe.get_all(
+			"Fee Validity",
+			filters={"patient": self.patient},
+			or_filters=or_filters,
+			fields=[
+				"name",
+				"practitioner",
+				"status",
+				"start_date",
+				"valid_till",
+				"visited",
+				"max_visits",
+				"patient_appointment",
+			],
+			order_by="creation desc",
+		)
+		self.validities = {validity.name: validity for validity in validities}
+
+		reference = frappe.qb.DocType("Fee Validity Reference")
+		condition = reference.parent.isin(list(self.validities) or [""])
+		if appointment:
+			condition |= reference.appointment == appointment
+		references = (
+			frappe.qb.from_(reference)
+			.select(reference.parent, reference.appointment)
+			.where(reference.parenttype == "Fee Validity")
+			.where(condition)
+		).run(as_dict=True)
+		self.references = {ref.appointment: ref.parent for ref in references}
+
+	def find(self, date, active_only=True):
+		"""Fee validity of the practitioner covering `date`"""
+		date = getdate(date)
+		for validity in self.validities.values():
+			if (
+				validity.practitioner == self.practitioner
+				and (validity.status == "Active" or not active_only)
+				and getdate(validity.start_date) <= date <= getdate(validity.valid_till)
+			):
+				return validity
+
+	def get_invoiced_validity(self, appointment):
+		"""Fee validity created by invoicing `appointment`"""
+		for validity in self.validities.values():
+			if validity.patient_appointment == appointment:
+				return validity
+
+	def get_free_visit_validity(self, appointment, date):
+		"""Active fee validity covering `date` in which `appointment` is a free visit"""
+		validity = self.validities.get(self.references.get(appointment))
+		if (
+			validity
+			and validity.practitioner == self.practitioner
+			and validity.status == "Active"
+			and getdate(validity.start_date) <= getdate(date) <= getdate(validity.valid_till)
+		):
+			return [frappe._dict(name=validity.name, valid_till=validity.valid_till)]
+		return []
+
+	def add_visit(self, validity, appointment):
+		validity.visited += 1
+		self.visits[validity.name] = self.visits.get(validity.name, 0) + 1
+		self.references[appointment] = validity.name
+		self.added_references[appointment] = validity.name
+		self.removed_references.discard(appointment)
+		self.update(validity)
+
+	def remove_visit(self, appointment):
+		"""Remove `appointment` from the validity it is a free visit in, returns the validity"""
+		if appointment not in self.references:
+			return
+
+		validity = self.validities.get(self.references.pop(appointment))
+		if appointment in self.added_references:
+			del self.added_references[appointment]
 		else:
-			self.status = "Active"
+			self.removed_references.add(appointment)
+
+		if validity and validity.visited > 0:
+			validity.visited -= 1
+			self.visits[validity.name] = self.visits.get(validity.name, 0) - 1
+			self.update(validity)
+		return validity
+
+	def reschedule(self, validity, start_date):
+		validity.start_date = getdate(start_date)
+		validity.valid_till = validity.start_date + datetime.timedelta(
+			days=int(self.settings.valid_days or 1)
+		)
+		self.rescheduled.add(validity.name)
+		self.update(validity)
+
+	def update(self, validity):
+		if validity.status != "Cancelled":
+			validity.status = get_fee_validity_status(validity)
+		self.changed.add(validity.name)
 
+	def register(self, fee_validity):
+		"""Track a newly inserted Fee Validity"""
+		self.validities = {
+			fee_validity.name: frappe._dict(
+				name=fee_validity.name,
+				practitioner=fee_validity.practitioner,
+				status=fee_validity.status,
+				start_date=fee_validity.start_date,
+				valid_till=fee_validity.valid_till,
+				visited=fee_validity.visited,
+				max_visits=fee_validity.max_visits,
+				patient_appointment=fee_validity.patient_appointment,
+			),
+			**self.validities,
+		}
+
+	def commit(self):
+		"""
+		Write back the changed validities and references. Visits are applied as increments and
+		the status is derived from the stored counts, so that appointments saved at the same time
+		against one validity do not overwrite each other's visits.
+		"""
+		for name in self.changed:
+			validity = self.validities[name]
+			rescheduled = name in self.rescheduled
+			frappe.db.sql(
+				"""
+				update `tabFee Validity`
+				set
+					visited = greatest(visited + %(visits)s, 0),
+					start_date = ifnull(%(start_date)s, start_date),
+					valid_till = ifnull(%(valid_till)s, valid_till),
+					status = case
+						when status = 'Cancelled' then status
+						when valid_till < %(today)s then 'Expired'
+						when visited = max_visits then 'Completed'
+						else 'Active'
+					end,
+					modified = %(modified)s,
+					modified_by = %(modified_by)s
+				where name = %(name)s
+				""",
+				{
+					"name": name,
+					"visits": self.visits.get(name, 0),
+					"start_date": validity.start_date if rescheduled else None,
+					"valid_till": validity.valid_till if rescheduled else None,
+					"today": getdate(),
+					"modified": now(),
+					"modified_by": frappe.session.user,
+				},
+			)
+
+		if self.removed_references:
+			frappe.db.delete(
+				"Fee Validity Reference", {"appointment": ["in", list(self.removed_references)]}
+			)
+
+		if self.added_references:
+			self.insert_references()
+
+		self.changed, self.added_references, self.removed_references = set(), {}, set()
+		self.visits, self.rescheduled = {}, set()
+
+	def insert_references(self):
+		parents = set(self.added_references.values())
+		idx = dict(
+			frappe.get_all(
+				"Fee Validity Reference",
+				filters={"parent": ["in", list(parents)], "parenttype": "Fee Validity"},
+				fields=["parent", "max(idx)"],
+				group_by="parent",
+				as_list=True,
+			)
+		)
 
-def create_fee_validity(appointment):
-	if patient_has_validity(appointment):
+		timestamp, user = now(), frappe.session.user
+		values = []
+		for appointment, parent in self.added_references.items():
+			idx[parent] = (idx.get(parent) or 0) + 1
+			values.append(
+				(
+					frappe.generate_hash(length=10),
+					timestamp,
+					timestamp,
+					user,
+					user,
+					parent,
+					"Fee Validity",
+					"ref_appointments",
+					idx[parent],
+					appointment,
+				)
+			)
+
+		frappe.db.bulk_insert(
+			"Fee Validity Reference",
+			fields=[
+				"name",
+				"creation",
+				"modified",
+				"owner",
+				"modified_by",
+				"parent",
+				"parenttype",
+				"parentfield",
+				"idx",
+				"appointment",
+			],
+			values=values,
+		)
+
+
+def get_fee_validity_ledger(appointment, practitioner=None):
+	"""Ledger of the patient and practitioner of `appointment`, kept on the appointment's flags
+	so that all fee validity lookups while saving it share one load"""
+	practitioner = practitioner or appointment.practitioner
+	ledgers = appointment.flags.setdefault("fee_validity_ledgers", {})
+	if practitioner not in ledgers:
+		name = None if appointment.get("__islocal") else appointment.name
+		ledgers[practitioner] = FeeValidityLedger(appointment.patient, practitioner, name)
+	return ledgers[practitioner]
+
+
+def create_fee_validity(appointment, ledger=None):
+	ledger = ledger or get_fee_validity_ledger(appointment)
+	if ledger.find(appointment.appointment_date):
 		return
 
 	fee_validity = frappe.new_doc("Fee Validity")
@@ -35,122 +299,74 @@ def create_fee_validity(appointment):
 	fee_validity.sales_invoice_ref = frappe.db.get_value(
 		"Sales Invoice Item", {"reference_dn": appointment.name}, "parent"
 	)
-	fee_validity.max_visits = frappe.db.get_single_value("Healthcare Settings", "max_visits") or 1
-	valid_days = frappe.db.get_single_value("Healthcare Settings", "valid_days") or 1
+	fee_validity.max_visits = ledger.settings.max_visits or 1
+	valid_days = ledger.settings.valid_days or 1
 	fee_validity.visited = 0
 	fee_validity.start_date = getdate(appointment.appointment_date)
 	fee_validity.valid_till = getdate(appointment.appointment_date) + datetime.timedelta(
 		days=int(valid_days)
 	)
 	fee_validity.save(ignore_permissions=True)
+	ledger.register(fee_validity)
 	return fee_validity
 
 
 def patient_has_validity(appointment):
-	validity_exists = frappe.db.exists(
-		"Fee Validity",
-		{
-			"practitioner": appointment.practitioner,
-			"patient": appointment.patient,
-			"status": "Active",
-			"valid_till": [">=", appointment.appointment_date],
-			"start_date": ["<=", appointment.appointment_date],
-		},
-	)
-
-	return validity_exists
+	return get_fee_validity_ledger(appointment).find(appointment.appointment_date)
 
 
 @frappe.whitelist()
 def check_fee_validity(appointment, date=None, practitioner=None):
-	if not frappe.db.get_single_value("Healthcare Settings", "enable_free_follow_ups"):
-		return
-
 	if isinstance(appointment, str):
 		appointment = json.loads(appointment)
 		appointment = frappe.get_doc(appointment)
 
-	date = getdate(date) if date else appointment.appointment_date
+	ledger = get_fee_validity_ledger(appointment, practitioner)
+	if not ledger.settings.enable_free_follow_ups:
+		return
 
-	filters = {
-		"practitioner": practitioner if practitioner else appointment.practitioner,
-		"patient": appointment.patient,
-		"valid_till": (">=", date),
-		"start_date": ("<=", date),
-	}
-	if appointment.status != "Cancelled":
-		filters["status"] = "Active"
-
-	validity = frappe.db.exists(
-		"Fee Validity",
-		filters,
-	)
+	date = getdate(date) if date else appointment.appointment_date
 
+	validity = ledger.find(date, active_only=appointment.status != "Cancelled")
 	if not validity:
 		# return valid fee validity when rescheduling appointment
 		if appointment.get("__islocal"):
 			return
-		else:
-			validity = get_fee_validity(appointment.get("name"), date) or None
-			if validity:
-				return validity
-		return
+		return ledger.get_free_visit_validity(appointment.name, date) or None
 
-	validity = frappe.get_doc("Fee Validity", validity)
 	return validity
 
 
 def manage_fee_validity(appointment):
-	free_follow_ups = frappe.db.get_single_value("Healthcare Settings", "enable_free_follow_ups")
+	ledger = get_fee_validity_ledger(appointment)
 	# Update fee validity dates when rescheduling an invoiced appointment
-	if free_follow_ups:
-		invoiced_fee_validity = frappe.db.exists(
-			"Fee Validity", {"patient_appointment": appointment.name}
-		)
+	if ledger.settings.enable_free_follow_ups:
+		invoiced_fee_validity = ledger.get_invoiced_validity(appointment.name)
 		if invoiced_fee_validity and appointment.invoiced:
-			start_date = frappe.db.get_value("Fee Validity", invoiced_fee_validity, "start_date")
-			if getdate(appointment.appointment_date) != start_date:
-				frappe.db.set_value(
-					"Fee Validity",
-					invoiced_fee_validity,
-					{
-						"start_date": appointment.appointment_date,
-						"valid_till": getdate(appointment.appointment_date)
-						+ datetime.timedelta(
-							days=int(frappe.db.get_single_value("Healthcare Settings", "valid_days") or 1)
-						),
-					},
-				)
+			if getdate(appointment.appointment_date) != getdate(invoiced_fee_validity.start_date):
+				ledger.reschedule(invoiced_fee_validity, appointment.appointment_date)
 
 	fee_validity = check_fee_validity(appointment)
 
+	if isinstance(fee_validity, list):
+		# appointment is already a free visit in the validity
+		fee_validity = ledger.validities.get(fee_validity[0].name)
+
 	if fee_validity:
-		exists = frappe.db.exists("Fee Validity Reference", {"appointment": appointment.name})
+		exists = appointment.name in ledger.references
 		if appointment.status == "Cancelled" and fee_validity.visited > 0:
-			fee_validity.visited -= 1
-			frappe.db.delete("Fee Validity Reference", {"appointment": appointment.name})
+			ledger.remove_visit(appointment.name)
 		elif fee_validity.status != "Active":
+			ledger.commit()
 			return
 		elif appointment.name != fee_validity.patient_appointment and not exists:
-			fee_validity.visited += 1
-			fee_validity.append("ref_appointments", {"appointment": appointment.name})
-		fee_validity.save(ignore_permissions=True)
+			ledger.add_visit(fee_validity, appointment.name)
 	else:
 		# remove appointment from fee validity reference when rescheduling an appointment to date not in fee validity
-		free_visit_validity = frappe.db.get_value(
-			"Fee Validity Reference", {"appointment": appointment.name}, "parent"
-		)
-		if free_visit_validity:
-			fee_validity = frappe.get_doc(
-				"Fee Validity",
-				free_visit_validity,
-			)
-			if fee_validity:
-				frappe.db.delete("Fee Validity Reference", {"appointment": appointment.name})
-				if fee_validity.visited > 0:
-					fee_validity.visited -= 1
-					fee_validity.save(ignore_permissions=True)
-		fee_validity = create_fee_validity(appointment)
+		ledger.remove_visit(appointment.name)
+		fee_validity = create_fee_validity(appointment, ledger)
+
+	ledger.commit()
 	return fee_validity
 
 
@@ -162,30 +378,48 @@ def get_fee_validity(appointment_name, date):
 	:params date: Schedule date
 	:return fee validity name and valid_till values of free visit appointments
 	"""
-	if appointment_name:
-		appointment_doc = frappe.get_doc("Patient Appointment", appointment_name)
-	fee_validity = frappe.qb.DocType("Fee Validity")
-	child = frappe.qb.DocType("Fee Validity Reference")
-
-	return (
-		frappe.qb.from_(fee_validity)
-		.inner_join(child)
-		.on(fee_validity.name == child.parent)
-		.select(fee_validity.name, fee_validity.valid_till)
-		.where(fee_validity.status == "Active")
-		.where(fee_validity.start_date <= date)
-		.where(fee_validity.valid_till >= date)
-		.where(fee_validity.patient == appointment_doc.patient)
-		.where(fee_validity.practitioner == appointment_doc.practitioner)
-		.where(child.appointment == appointment_name)
-	).run(as_dict=True)
+	appointment = frappe.db.get_value(
+		"Patient Appointment", appointment_name, ["patient", "practitioner"], as_dict=True
+	)
+	if not appointment:
+		return None
+
+	return FeeValidityLedger(
+		appointment.patient, appointment.practitioner, appointment_name
+	).get_free_visit_validity(appointment_name, date)
 
 
 def update_validity_status():
-	# update the status of fee validity daily
-	validities = frappe.db.get_all("Fee Validity", {"status": ["not in", ["Expired", "Cancelled"]]})
+	"""
+	Runs daily, expires fee validities past their validity and completes the ones
+	with all visits used
+	:return: number of fee validities updated per status
+	"""
+	fee_validity = frappe.qb.DocType("Fee Validity")
+	today = getdate()
+	updated = {}
+	for status, condition in (
+		("Expired", fee_validity.status.isin(["Active", "Completed"]) & (fee_validity.valid_till < today)),
+		(
+			"Completed",
+			(fee_validity.status == "Active")
+			& (fee_validity.valid_till >= today)
+			& (fee_validity.visited >= fee_validity.max_visits),
+		),
+	):
+		updated[status] = (
+			frappe.qb.from_(fee_validity).select(Count(fee_validity.name)).where(condition)
+		).run()[0][0]
+		if updated[status]:
+			(
+				frappe.qb.update(fee_validity)
+				.set(fee_validity.status, status)
+				.set(fee_validity.modified, now())
+				.where(condition)
+			).run()
+
+	return updated
+
 
-	for fee_validity in validities:
-		fee_validity_doc = frappe.get_doc("Fee Validity", fee_validity.name)
-		fee_validity_doc.update_status()
-		fee_validity_doc.save()
+def on_doctype_update():
+	frappe.db.add_index("Fee Validity", ["status", "valid_till"])
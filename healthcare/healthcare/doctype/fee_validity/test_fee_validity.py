@@ -82,3 +82,96 @@ class TestFeeValidity(FrappeTestCase):
 		# For first appointment cancel should cancel fee validity
 		update_status(appointment.name, "Cancelled")
 		self.assertEqual(frappe.db.get_value("Fee Validity", fee_validity, "status"), "Cancelled")
+
+	def test_fee_validity_reschedule(self):
+		item = create_healthcare_service_items()
+		healthcare_settings = frappe.get_single("Healthcare Settings")
+		healthcare_settings.enable_free_follow_ups = 1
+		healthcare_settings.max_visits = 2
+		healthcare_settings.valid_days = 7
+		healthcare_settings.automate_appointment_invoicing = 1
+		healthcare_settings.op_consulting_charge_item = item
+		healthcare_settings.save(ignore_permissions=True)
+		patient, practitioner = create_healthcare_docs()
+
+		appointment = create_appointment(patient, practitioner, nowdate())
+		fee_validity = frappe.db.get_value("Fee Validity", {"patient_appointment": appointment.name})
+
+		# free visit within the fee validity
+		appointment = create_appointment(patient, practitioner, add_days(nowdate(), 2))
+		self.assertEqual(frappe.db.get_value("Fee Validity", fee_validity, "visited"), 1)
+		self.assertTrue(
+			frappe.db.exists(
+				"Fee Validity Reference", {"parent": fee_validity, "appointment": appointment.name}
+			)
+		)
+
+		# rescheduling within the fee validity does not count another visit
+		appointment.appointment_date = add_days(nowdate(), 3)
+		appointment.save()
+		self.assertEqual(frappe.db.get_value("Fee Validity", fee_validity, "visited"), 1)
+
+		# rescheduling out of the fee validity releases the visit
+		appointment.appointment_date = add_days(nowdate(), 10)
+		appointment.save()
+		self.assertEqual(frappe.db.get_value("Fee Validity", fee_validity, "visited"), 0)
+		self.assertFalse(frappe.db.exists("Fee Validity Reference", {"appointment": appointment.name}))
+
+	def test_update_validity_status(self):
+		from healthcare.healthcare.doctype.fee_validity.fee_validity import update_validity_status
+
+		patient, practitioner = create_healthcare_docs()
+		validities = []
+		for start_date, visited in ((add_days(nowdate(), -10), 0), (nowdate(), 1), (nowdate(), 0)):
+			fee_validity = frappe.new_doc("Fee Validity")
+			fee_validity.patient = patient
+			fee_validity.practitioner = practitioner
+			fee_validity.max_visits = 2
+			fee_validity.visited = 0
+			fee_validity.start_date = start_date
+			fee_validity.valid_till = add_days(start_date, 7)
+			fee_validity.insert(ignore_permissions=True)
+			# as left behind by earlier days, before the daily job ran
+			frappe.db.set_value(
+				"Fee Validity", fee_validity.name, {"visited": visited * 2, "status": "Active"}
+			)
+			validities.append(fee_validity.name)
+
+		self.assertEqual(update_validity_status(), {"Expired": 1, "Completed": 1})
+		self.assertEqual(
+			[frappe.db.get_value("Fee Validity", name, "status") for name in validities],
+			["Expired", "Completed", "Active"],
+		)
+		self.assertEqual(update_validity_status(), {"Expired": 0, "Completed": 0})
+
+	def test_concurrent_visits(self):
+		from healthcare.healthcare.doctype.fee_validity.fee_validity import (
+			FeeValidityLedger,
+			get_fee_validity,
+		)
+
+		frappe.db.set_single_value(
+			"Healthcare Settings", {"enable_free_follow_ups": 1, "max_visits": 2, "valid_days": 7}
+		)
+		patient, practitioner = create_healthcare_docs()
+		fee_validity = frappe.new_doc("Fee Validity")
+		fee_validity.patient = patient
+		fee_validity.practitioner = practitioner
+		fee_validity.max_visits = 2
+		fee_validity.visited = 0
+		fee_validity.start_date = nowdate()
+		fee_validity.valid_till = add_days(nowdate(), 7)
+		fee_validity.insert(ignore_permissions=True)
+
+		# two appointments saved at the same time, both loaded before either is written
+		ledgers = [FeeValidityLedger(patient, practitioner) for _ in range(2)]
+		for idx, ledger in enumerate(ledgers):
+			ledger.add_visit(ledger.validities[fee_validity.name], f"_Test Appointment {idx}")
+		for ledger in ledgers:
+			ledger.commit()
+
+		self.assertEqual(
+			frappe.db.get_value("Fee Validity", fee_validity.name, ["visited", "status"]),
+			(2, "Completed"),
+		)
+		self.assertIsNone(get_fee_validity("_Test Unknown Appointment", nowdate()))
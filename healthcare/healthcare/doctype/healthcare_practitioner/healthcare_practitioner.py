@@ -14,6 +14,10 @@ from frappe.model.document import Document
 from frappe.model.naming import append_number_if_name_exists
 from frappe.utils import get_link_to_form
 
+from healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy import (
+	enqueue_slot_occupancy_build,
+)
+
 
 class HealthcarePractitioner(Document):
 	def onload(self):
@@ -70,6 +74,11 @@ class HealthcarePractitioner(Document):
 		if self.user_id:
 			frappe.permissions.add_user_permission("Healthcare Practitioner", self.name, self.user_id)
 
+		# with every schedule removed the rebuild clears the slots of the old ones
+		doc_before_save = self.get_doc_before_save()
+		if self.practitioner_schedules or (doc_before_save and doc_before_save.practitioner_schedules):
+			enqueue_slot_occupancy_build([self.name])
+
 	def set_full_name(self):
 		if self.last_name:
 			self.practitioner_name = " ".join(filter(None, [self.first_name, self.last_name]))
@@ -10,6 +10,11 @@ from frappe import _
 from frappe.core.doctype.sms_settings.sms_settings import send_sms
 from frappe.model.document import Document
 
+INCOME_ACCOUNT_CACHE_KEY = "healthcare_income_accounts"
+# seconds the site-wide lookups are kept, bounds how long writes that skip the doc hooks
+# clearing them leave stale values behind
+HEALTHCARE_CACHE_TTL = 60 * 60
+
 
 class HealthcareSettings(Document):
 	def validate(self):
@@ -78,6 +83,20 @@ def get_receivable_account(company):
 
 
 def get_income_account(practitioner, company):
+	"""
+	Get the income account to book the services of the practitioner to, cached for the site
+	until the practitioner, Healthcare Settings or the company change
+	"""
+	key = frappe.as_json([practitioner, company], indent=None)
+	income_account = get_cached_lookup(INCOME_ACCOUNT_CACHE_KEY, key)
+	if income_account is None:
+		income_account = resolve_income_account(practitioner, company) or ""
+		set_cached_lookup(INCOME_ACCOUNT_CACHE_KEY, key, income_account)
+
+	return income_account or None
+
+
+def resolve_income_account(practitioner, company):
 	# check income account in Healthcare Practitioner
 	if practitioner:
 		income_account = get_account("Healthcare Practitioner", None, practitioner, company)
@@ -93,6 +112,29 @@ def get_income_account(practitioner, company):
 	return frappe.get_cached_value("Company", company, "default_income_account")
 
 
+def clear_income_account_cache(doc=None, method=None):
+	"""Clear the cached income accounts when a practitioner, the settings or a company change"""
+	frappe.cache().delete_value(INCOME_ACCOUNT_CACHE_KEY)
+
+
+def get_cached_lookup(cache_key, key):
+	"""Get a value stored with set_cached_lookup, None when missing or expired"""
+	return frappe.cache().hget(cache_key, key)
+
+
+def set_cached_lookup(cache_key, key, value):
+	"""
+	Store a value in the site-wide cache hash `cache_key`, the hash expires HEALTHCARE_CACHE_TTL
+	seconds after its first entry and is cleared earlier by the doc hooks of its sources
+	"""
+	cache = frappe.cache()
+	cache.hset(cache_key, key, value)
+	redis_key = cache.make_key(cache_key)
+	# a hash without an expiry was just created
+	if cache.ttl(redis_key) == -1:
+		cache.expire(redis_key, HEALTHCARE_CACHE_TTL)
+
+
 def get_account(parent_type, parent_field, parent, company):
 	if parent_type:
 		return frappe.db.get_value(
@@ -3,8 +3,36 @@
 # See license.txt
 
 
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from healthcare.healthcare.doctype.healthcare_settings.healthcare_settings import (
+	HEALTHCARE_CACHE_TTL,
+	INCOME_ACCOUNT_CACHE_KEY,
+	clear_income_account_cache,
+	get_income_account,
+)
+
 
 class TestHealthcareSettings(FrappeTestCase):
-	pass
+	def test_income_account_cache(self):
+		clear_income_account_cache()
+		default_income_account = frappe.get_cached_value(
+			"Company", "_Test Company", "default_income_account"
+		)
+		self.assertEqual(get_income_account(None, "_Test Company"), default_income_account)
+		# direct writes to the accounts skip the hooks, the cached ones expire in any case
+		ttl = frappe.cache().ttl(frappe.cache().make_key(INCOME_ACCOUNT_CACHE_KEY))
+		self.assertTrue(0 < ttl <= HEALTHCARE_CACHE_TTL)
+
+		settings = frappe.get_single("Healthcare Settings")
+		settings.set("income_account", [])
+		settings.append("income_account", {"company": "_Test Company", "account": "Sales - _TC"})
+		settings.save()
+
+		# saving the settings clears the cached account
+		self.assertEqual(get_income_account(None, "_Test Company"), "Sales - _TC")
+
+		settings.set("income_account", [])
+		settings.save()
+		self.assertEqual(get_income_account(None, "_Test Company"), default_income_account)
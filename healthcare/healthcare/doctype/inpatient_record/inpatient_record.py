@@ -12,6 +12,7 @@ from frappe.model.document import Document
 from frappe.utils import get_datetime, get_link_to_form, getdate, now_datetime, today
 
 from healthcare.healthcare.doctype.nursing_task.nursing_task import NursingTask
+from healthcare.healthcare.inpatient_billing import InpatientBilling
 from healthcare.healthcare.utils import validate_nursing_tasks
 
 
@@ -249,55 +250,19 @@ def validate_inpatient_invoicing(inpatient_record):
 
 def get_pending_invoices(inpatient_record):
 	pending_invoices = {}
-	if inpatient_record.inpatient_occupancies:
-		service_unit_names = False
-		for inpatient_occupancy in inpatient_record.inpatient_occupancies:
-			if not inpatient_occupancy.invoiced:
-				if is_service_unit_billable(inpatient_occupancy.service_unit):
-					if service_unit_names:
-						service_unit_names += ", " + inpatient_occupancy.service_unit
-					else:
-						service_unit_names = inpatient_occupancy.service_unit
-		if service_unit_names:
-			pending_invoices["Inpatient Occupancy"] = service_unit_names
-
-	docs = ["Patient Appointment", "Patient Encounter", "Lab Test", "Clinical Procedure"]
-
-	for doc in docs:
-		doc_name_list = get_unbilled_inpatient_docs(doc, inpatient_record)
-		if doc_name_list:
-			pending_invoices = get_pending_doc(doc, doc_name_list, pending_invoices)
-
-	return pending_invoices
-
+	billing = InpatientBilling(inpatient_record)
+	occupancies = billing.get_unbilled_occupancies()
+	if occupancies:
+		pending_invoices["Inpatient Occupancy"] = ", ".join(
+			occupancy.service_unit for occupancy in occupancies
+		)
 
-def get_pending_doc(doc, doc_name_list, pending_invoices):
-	if doc_name_list:
-		doc_ids = False
-		for doc_name in doc_name_list:
-			doc_link = get_link_to_form(doc, doc_name.name)
-			if doc_ids:
-				doc_ids += ", " + doc_link
-			else:
-				doc_ids = doc_link
-		if doc_ids:
-			pending_invoices[doc] = doc_ids
+	for doc, doc_name_list in billing.get_unbilled_documents().items():
+		pending_invoices[doc] = ", ".join(get_link_to_form(doc, name) for name in doc_name_list)
 
 	return pending_invoices
 
 
-def get_unbilled_inpatient_docs(doc, inpatient_record):
-	return frappe.db.get_list(
-		doc,
-		filters={
-			"patient": inpatient_record.patient,
-			"inpatient_record": inpatient_record.name,
-			"docstatus": 1,
-			"invoiced": 0,
-		},
-	)
-
-
 def admit_patient(inpatient_record, service_unit, check_in, expected_discharge=None):
 	validate_nursing_tasks(inpatient_record)
 
@@ -355,19 +320,6 @@ def get_leave_from(doctype, txt, searchfield, start, page_len, filters):
 	)
 
 
-def is_service_unit_billable(service_unit):
-	service_unit_doc = frappe.qb.DocType("Healthcare Service Unit")
-	service_unit_type = frappe.qb.DocType("Healthcare Service Unit Type")
-	result = (
-		frappe.qb.from_(service_unit_doc)
-		.left_join(service_unit_type)
-		.on(service_unit_doc.service_unit_type == service_unit_type.name)
-		.select(service_unit_type.is_billable)
-		.where(service_unit_doc.name == service_unit)
-	).run(as_dict=1)
-	return result[0].get("is_billable", 0)
-
-
 @frappe.whitelist()
 def set_ip_order_cancelled(inpatient_record, reason, encounter=None):
 	inpatient_record = frappe.get_doc("Inpatient Record", inpatient_record)
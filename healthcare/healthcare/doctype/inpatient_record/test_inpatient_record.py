@@ -14,6 +14,7 @@ from healthcare.healthcare.doctype.inpatient_record.inpatient_record import (
 	schedule_discharge,
 )
 from healthcare.healthcare.doctype.lab_test.test_lab_test import create_patient_encounter
+from healthcare.healthcare.inpatient_billing import InpatientBilling
 from healthcare.healthcare.utils import get_encounters_to_invoice
 
 
@@ -110,6 +111,37 @@ class TestInpatientRecord(FrappeTestCase):
 		discharge_patient(ip_record)
 		setup_inpatient_settings(key="do_not_bill_inpatient_encounters", value=0)
 
+	def test_inpatient_billing(self):
+		frappe.db.sql("""delete from `tabInpatient Record`""")
+		patient = create_patient()
+		ip_record = create_inpatient(patient)
+		ip_record.expected_length_of_stay = 0
+		ip_record.save(ignore_permissions=True)
+
+		service_unit = get_healthcare_service_unit()
+		frappe.db.set_value(
+			"Healthcare Service Unit Type",
+			frappe.db.get_value("Healthcare Service Unit", service_unit, "service_unit_type"),
+			"is_billable",
+			1,
+		)
+		admit_patient(ip_record, service_unit, now_datetime())
+		schedule_discharge(frappe.as_json({"patient": patient}))
+
+		ip_record = frappe.get_doc("Inpatient Record", ip_record.name)
+		services = InpatientBilling(ip_record).get_unbilled_services()
+		self.assertEqual([occupancy.service_unit for occupancy in services.occupancies], [service_unit])
+		self.assertTrue(services.occupancies[0].left)
+
+		# nothing has been invoiced yet, so billing to date covers the whole stay
+		billing = InpatientBilling(ip_record, bill_to_date=True)
+		self.assertIsNone(billing.since)
+		self.assertEqual(len(billing.get_unbilled_occupancies()), 1)
+
+		mark_invoiced_inpatient_occupancy(ip_record)
+		self.assertFalse(InpatientBilling(ip_record).get_unbilled_occupancies())
+		discharge_patient(ip_record)
+
 	def test_validate_overlap_admission(self):
 		frappe.db.sql("""delete from `tabInpatient Record`""")
 		patient = create_patient()
@@ -328,20 +328,19 @@ def get_patient_detail(patient):
 
 def get_timeline_data(doctype, name):
 	"""
-	Return Patient's timeline data from medical records
+	Return Patient's timeline data from the daily counts of medical records
 	Also include the associated Customer timeline data
 	"""
 	patient_timeline_data = dict(
 		frappe.db.sql(
 			"""
 		SELECT
-			unix_timestamp(communication_date), count(*)
+			unix_timestamp(activity_date), record_count
 		FROM
-			`tabPatient Medical Record`
+			`tabPatient Activity Count`
 		WHERE
 			patient=%s
-			and `communication_date` > date_sub(curdate(), interval 1 year)
-		GROUP BY communication_date""",
+			and `activity_date` > date_sub(curdate(), interval 1 year)""",
 			name,
 		)
 	)
@@ -0,0 +1,94 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+
+class PatientActivityCount(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_unique(
+		"Patient Activity Count",
+		["patient", "activity_date"],
+		constraint_name="unique_patient_activity_date",
+	)
+
+
+def update_patient_activity(changes):
+	"""
+	Add to the daily counts of medical records of patients
+	:param changes: (patient, date, records) tuples, records negative for the ones removed
+	"""
+	counts = {}
+	for patient, activity_date, records in changes:
+		if patient and activity_date:
+			key = (patient, getdate(activity_date))
+			counts[key] = counts.get(key, 0) + records
+
+	counts = {key: records for key, records in counts.items() if records}
+	if not counts:
+		return
+
+	timestamp = now()
+	user = frappe.session.user
+	values = []
+	for (patient, activity_date), records in counts.items():
+		values += [frappe.generate_hash(length=10), timestamp, timestamp, user, user]
+		values += [patient, activity_date, records]
+
+	frappe.db.sql(
+		"""
+		insert into `tabPatient Activity Count`
+			(name, creation, modified, owner, modified_by, patient, activity_date, record_count)
+		values {0}
+		on duplicate key update
+			record_count = record_count + values(record_count), modified = values(modified)
+		""".format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(counts))),
+		values,
+	)
+
+	# days left without records are dropped, they would otherwise block deleting the patient
+	frappe.db.delete(
+		"Patient Activity Count",
+		{
+			"patient": ["in", list({patient for patient, _activity_date in counts})],
+			"record_count": ["<=", 0],
+		},
+	)
+
+
+def rebuild_patient_activity_counts(patient=None):
+	"""Count the medical records of each day again from scratch, for one patient or all"""
+	frappe.db.delete("Patient Activity Count", {"patient": patient} if patient else {})
+
+	patient_condition = "and patient = %(patient)s" if patient else ""
+	frappe.db.sql(
+		f"""
+		insert into `tabPatient Activity Count`
+			(name, creation, modified, owner, modified_by, patient, activity_date, record_count)
+		select
+			substring(md5(concat(patient, '::', communication_date)), 1, 10),
+			%(timestamp)s, %(timestamp)s, %(user)s, %(user)s,
+			patient, communication_date, count(*)
+		from `tabPatient Medical Record`
+		where patient is not null and communication_date is not null {patient_condition}
+		group by patient, communication_date
+		""",
+		{"patient": patient, "timestamp": now(), "user": frappe.session.user},
+	)
+
+
+@frappe.whitelist()
+def enqueue_patient_activity_rebuild():
+	frappe.only_for("System Manager")
+	frappe.enqueue(
+		rebuild_patient_activity_counts,
+		queue="long",
+		job_id="rebuild_patient_activity_counts",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
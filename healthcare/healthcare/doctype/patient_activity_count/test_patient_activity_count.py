@@ -0,0 +1,54 @@
+# Copyright (c) 2026, healthcare and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate, nowdate
+
+from healthcare.healthcare.doctype.patient.patient import get_timeline_data
+from healthcare.healthcare.doctype.patient_activity_count.patient_activity_count import (
+	rebuild_patient_activity_counts,
+)
+from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment import (
+	create_patient,
+)
+
+
+class TestPatientActivityCount(FrappeTestCase):
+	def test_patient_activity_count(self):
+		patient = create_patient()
+		records = [create_medical_record(patient, days) for days in (0, 0, -1)]
+		self.assertEqual(get_activity(patient), {getdate(): 2, getdate(add_days(nowdate(), -1)): 1})
+
+		records[0].communication_date = add_days(nowdate(), -1)
+		records[0].save()
+		frappe.delete_doc("Patient Medical Record", records[1].name, force=1)
+		self.assertEqual(get_activity(patient), {getdate(add_days(nowdate(), -1)): 2})
+
+		frappe.db.delete("Patient Activity Count", {"patient": patient})
+		rebuild_patient_activity_counts(patient)
+		self.assertEqual(get_activity(patient), {getdate(add_days(nowdate(), -1)): 2})
+		self.assertIn(2, get_timeline_data("Patient", patient).values())
+
+
+def create_medical_record(patient, days):
+	return frappe.get_doc(
+		{
+			"doctype": "Patient Medical Record",
+			"patient": patient,
+			"subject": "Test Patient Activity",
+			"communication_date": add_days(nowdate(), days),
+			"reference_doctype": "Patient Medical Record",
+		}
+	).insert(ignore_permissions=True)
+
+
+def get_activity(patient):
+	return dict(
+		frappe.get_all(
+			"Patient Activity Count",
+			filters={"patient": patient},
+			fields=["activity_date", "record_count"],
+			as_list=True,
+		)
+	)
@@ -4,7 +4,9 @@
 
 
 import datetime
+import hashlib
 import json
+from zoneinfo import ZoneInfo
 
 import frappe
 from erpnext.setup.doctype.employee.employee import is_holiday
@@ -12,11 +14,15 @@ from frappe import _
 from frappe.core.doctype.sms_settings.sms_settings import send_sms
 from frappe.model.document import Document
 from frappe.model.mapper import get_mapped_doc
-from frappe.utils import flt, get_link_to_form, get_time, getdate, format_date
+from frappe.query_builder.functions import Count
+from frappe.utils import cint, flt, get_datetime, get_link_to_form, get_time, getdate, format_date
+from frappe.utils.data import get_system_timezone
+from werkzeug.http import parse_date
+from werkzeug.wrappers import Response
 
 from healthcare.healthcare.doctype.fee_validity.fee_validity import (
 	check_fee_validity,
-	get_fee_validity,
+	get_fee_validity_ledger,
 	manage_fee_validity,
 )
 from healthcare.healthcare.doctype.healthcare_settings.healthcare_settings import (
@@ -29,9 +35,18 @@ from erpnext.www.book_appointment.index import (
 	convert_to_guest_timezone,
 )
 
+from healthcare.healthcare.overlap_checker import (
+	MAX_DURATION,
+	AppointmentOverlapChecker,
+	get_booked_index,
+)
 from healthcare.healthcare.utils import get_appointment_billing_item_and_rate
 
 
+APPOINTMENT_INVOICE_MAX_ATTEMPTS = 5
+APPOINTMENT_INVOICE_RETRY_BATCH_SIZE = 500
+
+
 class MaximumCapacityError(frappe.ValidationError):
 	pass
 
@@ -42,6 +57,8 @@ class OverlapError(frappe.ValidationError):
 
 class PatientAppointment(Document):
 	def validate(self):
+		# fee validities are loaded once per save, see get_fee_validity_ledger
+		self.flags.fee_validity_ledgers = {}
 		self.validate_overlaps()
 		self.validate_based_on_appointments_for()
 		self.validate_service_unit()
@@ -54,10 +71,14 @@ class PatientAppointment(Document):
 	def on_update(self):
 		invoice_appointment(self)
 		self.update_fee_validity()
+		self.update_slot_occupancy()
 
 	def after_insert(self):
 		self.update_prescription_details()
 		self.set_payment_details()
+		if self.flags.defer_notifications:
+			return
+
 		send_confirmation_msg(self)
 		self.insert_calendar_event()
 
@@ -85,33 +106,22 @@ class PatientAppointment(Document):
 		if self.based_on_checkin or not self.practitioner:
 			return
 
-		end_time = datetime.datetime.combine(
+		start_time = datetime.datetime.combine(
 			getdate(self.appointment_date), get_time(self.appointment_time)
-		) + datetime.timedelta(minutes=flt(self.duration))
+		)
+		end_time = start_time + datetime.timedelta(minutes=flt(self.duration))
 
+		# bulk bookings share one checker, see book_appointments
+		overlap_checker = (self.flags.overlap_checker or AppointmentOverlapChecker()).load(
+			self.appointment_date, practitioner=self.practitioner, patient=self.patient
+		)
 		# all appointments for both patient and practitioner overlapping the duration of this appointment
-		overlapping_appointments = frappe.db.sql(
-			"""
-			SELECT
-				name, practitioner, patient, appointment_time, duration, service_unit
-			FROM
-				`tabPatient Appointment`
-			WHERE
-				appointment_date=%(appointment_date)s AND name!=%(name)s AND status NOT IN ("Closed", "Cancelled") AND
-				(practitioner=%(practitioner)s OR patient=%(patient)s) AND
-				((appointment_time<%(appointment_time)s AND appointment_time + INTERVAL duration MINUTE>%(appointment_time)s) OR
-				(appointment_time>%(appointment_time)s AND appointment_time<%(end_time)s) OR
-				(appointment_time=%(appointment_time)s))
-			""",
-			{
-				"appointment_date": self.appointment_date,
-				"name": self.name,
-				"practitioner": self.practitioner,
-				"patient": self.patient,
-				"appointment_time": self.appointment_time,
-				"end_time": end_time.time(),
-			},
-			as_dict=True,
+		overlapping_appointments = overlap_checker.get_overlaps(
+			start_time,
+			end_time,
+			exclude=self.name,
+			practitioner=self.practitioner,
+			patient=self.patient,
 		)
 
 		if not overlapping_appointments:
@@ -122,13 +132,11 @@ class PatientAppointment(Document):
 				"Healthcare Service Unit", self.service_unit, ["overlap_appointments", "service_unit_capacity"]
 			)
 			if allow_overlap:
-				service_unit_appointments = list(
-					filter(
-						lambda appointment: appointment["service_unit"] == self.service_unit
-						and appointment["patient"] != self.patient,
-						overlapping_appointments,
-					)
-				)  # if same patient already booked, it should be an overlap
+				service_unit_appointments = {
+					appointment.name
+					for appointment in overlapping_appointments
+					if appointment.service_unit == self.service_unit and appointment.patient != self.patient
+				}  # if same patient already booked, it should be an overlap
 				if len(service_unit_appointments) >= (service_unit_capacity or 1):
 					frappe.throw(
 						_("Not allowed, {} cannot exceed maximum capacity {}").format(
@@ -140,7 +148,7 @@ class PatientAppointment(Document):
 					overlapping_appointments = [
 						appointment
 						for appointment in overlapping_appointments
-						if appointment not in service_unit_appointments
+						if appointment.name not in service_unit_appointments
 					]
 
 		if overlapping_appointments:
@@ -217,6 +225,9 @@ class PatientAppointment(Document):
 			self.appointment_date,
 			self.appointment_time or "00:00:00",
 		)
+		self.appointment_end_datetime = get_datetime(self.appointment_datetime) + datetime.timedelta(
+			minutes=flt(self.duration)
+		)
 
 	def set_payment_details(self):
 		if frappe.db.get_single_value("Healthcare Settings", "automate_appointment_invoicing"):
@@ -246,8 +257,8 @@ class PatientAppointment(Document):
 
 	def update_fee_validity(self):
 		if (
-			not frappe.db.get_single_value("Healthcare Settings", "enable_free_follow_ups")
-			or not self.practitioner
+			not self.practitioner
+			or not get_fee_validity_ledger(self).settings.enable_free_follow_ups
 		):
 			return
 
@@ -260,6 +271,13 @@ class PatientAppointment(Document):
 			)
 		self.flags.silent = False
 
+	def update_slot_occupancy(self):
+		from healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy import (
+			update_slot_occupancy,
+		)
+
+		update_slot_occupancy(self)
+
 	def insert_calendar_event(self):
 		if not self.practitioner:
 			return
@@ -349,6 +367,13 @@ class PatientAppointment(Document):
 				self.google_meet_link = event_doc.google_meet_link
 
 
+def on_doctype_update():
+	frappe.db.add_index("Patient Appointment", ["practitioner", "appointment_datetime"])
+	frappe.db.add_index("Patient Appointment", ["service_unit", "appointment_datetime"])
+	frappe.db.add_index("Patient Appointment", ["patient", "appointment_datetime"])
+	frappe.db.add_index("Patient Appointment", ["status", "appointment_date"])
+
+
 @frappe.whitelist()
 def check_payment_fields_reqd(patient):
 	automate_invoicing = frappe.db.get_single_value(
@@ -365,28 +390,150 @@ def check_payment_fields_reqd(patient):
 
 
 def invoice_appointment(appointment_doc):
-	automate_invoicing = frappe.db.get_single_value(
-		"Healthcare Settings", "automate_appointment_invoicing"
+	automate_invoicing, invoice_in_background = frappe.db.get_value(
+		"Healthcare Settings",
+		None,
+		["automate_appointment_invoicing", "invoice_appointments_in_background"],
 	)
 	appointment_invoiced = frappe.db.get_value(
 		"Patient Appointment", appointment_doc.name, "invoiced"
 	)
-	enable_free_follow_ups = frappe.db.get_single_value(
-		"Healthcare Settings", "enable_free_follow_ups"
-	)
-	if enable_free_follow_ups:
+	ledger = get_fee_validity_ledger(appointment_doc)
+	if ledger.settings.enable_free_follow_ups:
 		fee_validity = check_fee_validity(appointment_doc)
 
 		if fee_validity and fee_validity.status != "Active":
 			fee_validity = None
 		elif not fee_validity:
-			if get_fee_validity(appointment_doc.name, appointment_doc.appointment_date):
+			if ledger.get_free_visit_validity(appointment_doc.name, appointment_doc.appointment_date):
 				return
 	else:
 		fee_validity = None
 
 	if automate_invoicing and not appointment_invoiced and not fee_validity:
-		create_sales_invoice(appointment_doc)
+		if cint(invoice_in_background):
+			queue_appointment_invoice(appointment_doc)
+		else:
+			create_sales_invoice(appointment_doc)
+
+
+def queue_appointment_invoice(appointment_doc):
+	"""Record the intent to invoice the appointment and leave the invoice to a background job,
+	the billing details are already validated while the appointment is saved"""
+	if appointment_doc.invoice_status in ("Queued", "Invoiced"):
+		return
+
+	appointment_doc.db_set({"invoice_status": "Queued", "invoice_attempts": 0}, update_modified=False)
+	enqueue_appointment_invoice(appointment_doc.name)
+
+
+def enqueue_appointment_invoice(appointment):
+	frappe.enqueue(
+		process_appointment_invoice,
+		appointment=appointment,
+		job_id=get_appointment_invoice_job_id(appointment),
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def get_appointment_invoice_job_id(appointment):
+	return f"appointment_invoice::{appointment}"
+
+
+def process_appointment_invoice(appointment):
+	"""Create the Sales Invoice of a queued appointment, safe to run more than once for the
+	same appointment as it is skipped once invoiced"""
+	values = frappe.db.get_value(
+		"Patient Appointment", appointment, ["invoiced", "invoice_status", "status"], for_update=True
+	)
+	# deleted, or rolled back with the booking after the job was queued
+	if not values:
+		return
+
+	invoiced, invoice_status, status = values
+	if invoice_status != "Queued":
+		return
+
+	if status == "Cancelled":
+		frappe.db.set_value(
+			"Patient Appointment", appointment, "invoice_status", None, update_modified=False
+		)
+		return
+
+	if invoiced:
+		frappe.db.set_value(
+			"Patient Appointment", appointment, "invoice_status", "Invoiced", update_modified=False
+		)
+		return
+
+	# an earlier attempt may have submitted the invoice but failed to record it
+	sales_invoice = frappe.db.get_value(
+		"Sales Invoice Item",
+		{"reference_dt": "Patient Appointment", "reference_dn": appointment, "docstatus": 1},
+		"parent",
+	)
+	if sales_invoice:
+		frappe.db.set_value(
+			"Patient Appointment",
+			appointment,
+			{"invoiced": 1, "ref_sales_invoice": sales_invoice, "invoice_status": "Invoiced"},
+			update_modified=False,
+		)
+		return
+
+	try:
+		create_sales_invoice(frappe.get_doc("Patient Appointment", appointment))
+		frappe.db.set_value(
+			"Patient Appointment", appointment, "invoice_status", "Invoiced", update_modified=False
+		)
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(frappe.get_traceback(), _("Appointment Invoice Failed"))
+		attempts = cint(frappe.db.get_value("Patient Appointment", appointment, "invoice_attempts")) + 1
+		frappe.db.set_value(
+			"Patient Appointment",
+			appointment,
+			{
+				"invoice_attempts": attempts,
+				"invoice_status": "Failed" if attempts >= APPOINTMENT_INVOICE_MAX_ATTEMPTS else "Queued",
+			},
+			update_modified=False,
+		)
+		frappe.db.commit()
+
+
+def retry_appointment_invoices():
+	"""Requeue the appointment invoices still queued, runs hourly to pick up failed attempts
+	and jobs lost from the queue"""
+	if not frappe.db.get_single_value("Healthcare Settings", "invoice_appointments_in_background"):
+		return
+
+	for appointment in frappe.get_all(
+		"Patient Appointment",
+		filters={"invoice_status": "Queued", "invoiced": 0},
+		pluck="name",
+		order_by="modified",
+		limit=APPOINTMENT_INVOICE_RETRY_BATCH_SIZE,
+	):
+		enqueue_appointment_invoice(appointment)
+
+
+@frappe.whitelist()
+def retry_appointment_invoice(appointment):
+	"""Queue the invoice of an appointment whose invoicing failed once again"""
+	frappe.has_permission("Patient Appointment", "write", appointment, throw=True)
+	if frappe.db.get_value("Patient Appointment", appointment, "invoice_status") != "Failed":
+		return
+
+	frappe.db.set_value(
+		"Patient Appointment",
+		appointment,
+		{"invoice_status": "Queued", "invoice_attempts": 0},
+		update_modified=False,
+	)
+	enqueue_appointment_invoice(appointment)
 
 
 def create_sales_invoice(appointment_doc):
@@ -537,10 +684,11 @@ def get_availability_data(date, practitioner, appointment=None, to_tz=None):
 			appointment = json.loads(appointment)
 			appointment = frappe.get_doc(appointment)
 
-		if frappe.db.get_single_value("Healthcare Settings", "enable_free_follow_ups"):
+		ledger = get_fee_validity_ledger(appointment, practitioner)
+		if ledger.settings.enable_free_follow_ups:
 			fee_validity = check_fee_validity(appointment, date, practitioner)
 			if not fee_validity and not appointment.get("__islocal"):
-				fee_validity = get_fee_validity(appointment.get("name"), date) or None
+				fee_validity = ledger.get_free_visit_validity(appointment.get("name"), date) or None
 
 		if appointment.invoiced:
 			fee_validity = "Disabled"
@@ -659,9 +807,17 @@ def get_available_slots(practitioner_doc, date, tz=None):
 				appointments = frappe.get_all(
 					"Patient Appointment",
 					filters=filters,
-					fields=["name", "appointment_time", "duration", "status"],
+					fields=["name", "appointment_date", "appointment_time", "duration", "status"],
 				)
 
+				booked = get_booked_index(appointments)
+				capacity = (service_unit_capacity or 1) if allow_overlap else 1
+				for time_slot in available_slots:
+					slot_date = getdate(time_slot.system_date)
+					slot_start = datetime.datetime.combine(slot_date, get_time(time_slot.from_time))
+					slot_end = datetime.datetime.combine(slot_date, get_time(time_slot.to_time))
+					time_slot.available = max(capacity - booked.count(slot_start, slot_end), 0)
+
 				slot_details.append(
 					{
 						"slot_name": slot_name,
@@ -699,14 +855,312 @@ def validate_practitioner_schedules(schedule_entry, practitioner):
 		)
 
 
+MAX_AVAILABILITY_DAYS = 62
+
+
+@frappe.whitelist()
+def get_availability_for_date_range(
+	from_date, to_date, practitioners=None, department=None, to_tz=None
+):
+	"""
+	Get free slots of multiple practitioners over a date range
+	:param from_date: First date to check in schedules
+	:param to_date: Last date to check in schedules (inclusive)
+	:param practitioners: List (or JSON list) of practitioner names
+	:param department: Medical Department, used when practitioners are not passed
+	:return: dict of practitioner -> practitioner_name, free slots per date and unavailable dates
+	"""
+	from_date, to_date = getdate(from_date), getdate(to_date)
+	if from_date > to_date:
+		frappe.throw(_("From Date cannot be after To Date"))
+
+	if (to_date - from_date).days >= MAX_AVAILABILITY_DAYS:
+		frappe.throw(
+			_("Availability can be fetched for at most {0} days at a time").format(MAX_AVAILABILITY_DAYS)
+		)
+
+	if isinstance(practitioners, str):
+		practitioners = json.loads(practitioners)
+
+	if not practitioners and not department:
+		frappe.throw(_("Please select Practitioners or a Medical Department"))
+
+	filters = {"status": ["!=", "Disabled"]}
+	if practitioners:
+		filters["name"] = ["in", practitioners]
+	else:
+		filters["department"] = department
+
+	practitioner_list = frappe.get_all(
+		"Healthcare Practitioner",
+		filters=filters,
+		fields=["name", "practitioner_name", "employee", "user_id"],
+	)
+	if not practitioner_list:
+		return {}
+
+	schedule_data = get_schedule_data([p.name for p in practitioner_list])
+	unavailable_dates = get_unavailable_dates(practitioner_list, from_date, to_date)
+	appointments = get_booked_appointments(from_date, to_date, list(schedule_data.service_units))
+
+	availability = {}
+	for practitioner in practitioner_list:
+		unavailable = unavailable_dates.get(practitioner.name, {})
+		dates = {}
+		for day in range((to_date - from_date).days + 1):
+			date = frappe.utils.add_days(from_date, day)
+			if date in unavailable:
+				continue
+			slot_details = get_free_slots(
+				practitioner.name, date, schedule_data, appointments, to_tz
+			)
+			if slot_details:
+				dates[str(date)] = slot_details
+
+		availability[practitioner.name] = {
+			"practitioner_name": practitioner.practitioner_name,
+			"dates": dates,
+			"unavailable": {str(date): reason for date, reason in unavailable.items()},
+		}
+
+	return availability
+
+
+def get_schedule_data(practitioners):
+	"""Load schedules, time slots and service unit settings of practitioners in bulk"""
+	schedule_entries = frappe.get_all(
+		"Practitioner Service Unit Schedule",
+		filters={"parenttype": "Healthcare Practitioner", "parent": ["in", practitioners]},
+		fields=["parent", "schedule", "service_unit"],
+		order_by="idx",
+	)
+	schedule_entries = [entry for entry in schedule_entries if entry.schedule and entry.service_unit]
+
+	schedules = {
+		schedule.name: schedule
+		for schedule in frappe.get_all(
+			"Practitioner Schedule",
+			filters={"name": ["in", list({e.schedule for e in schedule_entries}) or [""]], "disabled": 0},
+			fields=["name", "allow_video_conferencing"],
+		)
+	}
+
+	time_slots = {}
+	for time_slot in frappe.get_all(
+		"Healthcare Schedule Time Slot",
+		filters={"parenttype": "Practitioner Schedule", "parent": ["in", list(schedules) or [""]]},
+		fields=["parent", "day", "from_time", "to_time"],
+		order_by="from_time",
+	):
+		time_slots.setdefault((time_slot.parent, time_slot.day), []).append(time_slot)
+
+	service_units = {
+		service_unit.name: service_unit
+		for service_unit in frappe.get_all(
+			"Healthcare Service Unit",
+			filters={"name": ["in", list({e.service_unit for e in schedule_entries}) or [""]]},
+			fields=["name", "overlap_appointments", "service_unit_capacity"],
+		)
+	}
+
+	entries_by_practitioner = {}
+	for entry in schedule_entries:
+		if entry.schedule in schedules:
+			entries_by_practitioner.setdefault(entry.parent, []).append(entry)
+
+	return frappe._dict(
+		{
+			"entries": entries_by_practitioner,
+			"schedules": schedules,
+			"time_slots": time_slots,
+			"service_units": service_units,
+		}
+	)
+
+
+def get_unavailable_dates(practitioner_list, from_date, to_date):
+	"""Return {practitioner: {date: reason}} for holidays and approved leaves in the range"""
+	users = [p.user_id for p in practitioner_list if p.user_id and not p.employee]
+	employee_names = [p.employee for p in practitioner_list if p.employee]
+
+	employees = frappe.get_all(
+		"Employee",
+		or_filters={"name": ["in", employee_names or [""]], "user_id": ["in", users or [""]]},
+		fields=["name", "user_id", "holiday_list", "company"],
+	)
+	employee_by_name = {employee.name: employee for employee in employees}
+	employee_by_user = {employee.user_id: employee for employee in employees if employee.user_id}
+
+	practitioner_employee = {}
+	for practitioner in practitioner_list:
+		employee = employee_by_name.get(practitioner.employee) or employee_by_user.get(
+			practitioner.user_id
+		)
+		if employee:
+			if not employee.holiday_list and employee.company:
+				employee.holiday_list = frappe.get_cached_value(
+					"Company", employee.company, "default_holiday_list"
+				)
+			practitioner_employee[practitioner.name] = employee
+
+	if not practitioner_employee:
+		return {}
+
+	holidays = {}
+	holiday_lists = list({e.holiday_list for e in practitioner_employee.values() if e.holiday_list})
+	if holiday_lists:
+		for holiday in frappe.get_all(
+			"Holiday",
+			filters={"parent": ["in", holiday_lists], "holiday_date": ["between", [from_date, to_date]]},
+			fields=["parent", "holiday_date"],
+		):
+			holidays.setdefault(holiday.parent, set()).add(getdate(holiday.holiday_date))
+
+	leaves = {}
+	if "hrms" in frappe.get_installed_apps():
+		for leave in frappe.get_all(
+			"Leave Application",
+			filters={
+				"employee": ["in", [e.name for e in practitioner_employee.values()]],
+				"docstatus": 1,
+				"from_date": ["<=", to_date],
+				"to_date": [">=", from_date],
+			},
+			fields=["employee", "from_date", "to_date", "half_day"],
+		):
+			leaves.setdefault(leave.employee, []).append(leave)
+
+	unavailable_dates = {}
+	for practitioner, employee in practitioner_employee.items():
+		unavailable = unavailable_dates.setdefault(practitioner, {})
+		for leave in leaves.get(employee.name, []):
+			date = max(getdate(leave.from_date), from_date)
+			while date <= min(getdate(leave.to_date), to_date):
+				unavailable[date] = _("Half Day Leave") if leave.half_day else _("Leave")
+				date = frappe.utils.add_days(date, 1)
+		for date in holidays.get(employee.holiday_list, []):
+			unavailable[date] = _("Holiday")
+
+	return unavailable_dates
+
+
+def get_booked_appointments(from_date, to_date, service_units):
+	"""Return non cancelled appointments booked in the service units, grouped by date"""
+	if not service_units:
+		return {}
+
+	appointment = frappe.qb.DocType("Patient Appointment")
+	appointments = (
+		frappe.qb.from_(appointment)
+		.select(
+			appointment.name,
+			appointment.practitioner,
+			appointment.service_unit,
+			appointment.appointment_date,
+			appointment.appointment_time,
+			appointment.duration,
+		)
+		.where(appointment.appointment_date.between(from_date, to_date))
+		.where(appointment.status != "Cancelled")
+		.where(appointment.service_unit.isin(service_units))
+	).run(as_dict=True)
+
+	appointments_by_date = {}
+	for appointment in appointments:
+		appointments_by_date.setdefault(getdate(appointment.appointment_date), []).append(appointment)
+
+	return appointments_by_date
+
+
+def get_free_slots(practitioner, date, schedule_data, appointments, to_tz=None):
+	"""Compute free slots of a practitioner on a date from preloaded schedule and appointment data"""
+	weekday = date.strftime("%A")
+	now = frappe.utils.now_datetime()
+	day_appointments = appointments.get(date, [])
+	slot_details = []
+
+	for entry in schedule_data.entries.get(practitioner, []):
+		time_slots = schedule_data.time_slots.get((entry.schedule, weekday))
+		if not time_slots:
+			continue
+
+		service_unit = schedule_data.service_units.get(entry.service_unit) or frappe._dict(
+			name=entry.service_unit
+		)
+		allow_overlap = service_unit.overlap_appointments
+		capacity = get_slot_capacity(service_unit)
+		booked = get_booked_index(get_slot_appointments(day_appointments, practitioner, service_unit))
+
+		free_slots = []
+		for time_slot in time_slots:
+			start = datetime.datetime.combine(date, get_time(time_slot.from_time))
+			end = datetime.datetime.combine(date, get_time(time_slot.to_time))
+			if start < now:
+				continue
+
+			available = capacity - booked.count(start, end)
+			if available > 0:
+				free_slot = frappe._dict(
+					{
+						"from_time": time_slot.from_time,
+						"to_time": time_slot.to_time,
+						"available": available,
+					}
+				)
+				if to_tz:
+					free_slot.display_time_slot = convert_to_guest_timezone(to_tz, start)
+				free_slots.append(free_slot)
+
+		if free_slots:
+			slot_details.append(
+				{
+					"slot_name": entry.schedule,
+					"service_unit": entry.service_unit,
+					"free_slots": free_slots,
+					"allow_overlap": allow_overlap,
+					"service_unit_capacity": service_unit.service_unit_capacity,
+					"tele_conf": schedule_data.schedules[entry.schedule].allow_video_conferencing,
+				}
+			)
+
+	return slot_details
+
+
+def get_slot_capacity(service_unit):
+	if service_unit.overlap_appointments:
+		return service_unit.service_unit_capacity or 1
+	return 1
+
+
+def get_slot_appointments(appointments, practitioner, service_unit):
+	# same filters as get_available_slots, for overlapping units only the practitioner's own
+	# appointments count, otherwise every appointment booked in the service unit does
+	return [
+		appointment
+		for appointment in appointments
+		if appointment.service_unit == service_unit.name
+		and (not service_unit.overlap_appointments or appointment.practitioner == practitioner)
+	]
+
+
 @frappe.whitelist()
 def update_status(appointment_id, status):
+	from healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy import (
+		refresh_slot_occupancy,
+	)
+
 	frappe.db.set_value("Patient Appointment", appointment_id, "status", status)
 	appointment_booked = True
 	if status == "Cancelled":
 		appointment_booked = False
 		cancel_appointment(appointment_id)
 
+		service_unit, appointment_date = frappe.db.get_value(
+			"Patient Appointment", appointment_id, ["service_unit", "appointment_date"]
+		)
+		if service_unit:
+			refresh_slot_occupancy(service_unit, appointment_date)
+
 	procedure_prescription = frappe.db.get_value(
 		"Patient Appointment", appointment_id, "procedure_prescription"
 	)
@@ -726,6 +1180,19 @@ def send_confirmation_msg(doc):
 			frappe.msgprint(_("Appointment Confirmation Message Not Sent"), indicator="orange")
 
 
+def send_appointment_notifications(appointments):
+	"""Send confirmations and create calendar events for appointments booked in bulk"""
+	for name in appointments:
+		try:
+			doc = frappe.get_doc("Patient Appointment", name)
+			send_confirmation_msg(doc)
+			doc.insert_calendar_event()
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(frappe.get_traceback(), _("Appointment Notification Failed"))
+
+
 @frappe.whitelist()
 def make_encounter(source_name, target_doc=None):
 	doc = get_mapped_doc(
@@ -751,28 +1218,9 @@ def make_encounter(source_name, target_doc=None):
 
 
 def send_appointment_reminder():
-	if frappe.db.get_single_value("Healthcare Settings", "send_appointment_reminder"):
-		remind_before = datetime.datetime.strptime(
-			frappe.db.get_single_value("Healthcare Settings", "remind_before"), "%H:%M:%S"
-		)
-		reminder_dt = datetime.datetime.now() + datetime.timedelta(
-			hours=remind_before.hour, minutes=remind_before.minute, seconds=remind_before.second
-		)
-
-		appointment_list = frappe.db.get_all(
-			"Patient Appointment",
-			{
-				"appointment_datetime": ["between", (datetime.datetime.now(), reminder_dt)],
-				"reminded": 0,
-				"status": ["!=", "Cancelled"],
-			},
-		)
+	from healthcare.healthcare.appointment_reminder import send_appointment_reminders
 
-		for appointment in appointment_list:
-			doc = frappe.get_doc("Patient Appointment", appointment.name)
-			message = frappe.db.get_single_value("Healthcare Settings", "appointment_reminder_msg")
-			send_message(doc, message)
-			frappe.db.set_value("Patient Appointment", doc.name, "reminded", 1)
+	return send_appointment_reminders()
 
 
 def send_message(doc, message):
@@ -809,27 +1257,262 @@ def get_events(start, end, filters=None):
 		`tabPatient Appointment`.name, `tabPatient Appointment`.patient,
 		`tabPatient Appointment`.practitioner, `tabPatient Appointment`.status,
 		`tabPatient Appointment`.duration,
-		timestamp(`tabPatient Appointment`.appointment_date, `tabPatient Appointment`.appointment_time) as 'start',
+		`tabPatient Appointment`.appointment_datetime as 'start',
+		`tabPatient Appointment`.appointment_end_datetime as 'end',
 		`tabAppointment Type`.color
 		from
 		`tabPatient Appointment`
 		left join `tabAppointment Type` on `tabPatient Appointment`.appointment_type=`tabAppointment Type`.name
 		where
-		(`tabPatient Appointment`.appointment_date between %(start)s and %(end)s)
+		`tabPatient Appointment`.appointment_datetime >= %(lookback)s
+		and `tabPatient Appointment`.appointment_datetime < %(end)s
+		and `tabPatient Appointment`.appointment_end_datetime > %(start)s
 		and `tabPatient Appointment`.status != 'Cancelled' and `tabPatient Appointment`.docstatus < 2 {conditions}""".format(
 			conditions=conditions
 		),
-		{"start": start, "end": end},
+		{
+			"start": get_datetime(start),
+			"end": get_datetime(end),
+			# bounds the index seek, bookings started before this ended before `start`
+			"lookback": get_datetime(start) - MAX_DURATION,
+		},
 		as_dict=True,
 		update={"allDay": 0},
 	)
 
-	for item in data:
-		item.end = item.start + datetime.timedelta(minutes=item.duration)
-
 	return data
 
 
+CALENDAR_FEED_PAGE_LENGTH = 500
+CALENDAR_FEED_MAX_PAGE_LENGTH = 5000
+
+
+@frappe.whitelist()
+def get_calendar_feed(
+	start,
+	end,
+	filters=None,
+	cursor=None,
+	page_length=CALENDAR_FEED_PAGE_LENGTH,
+	group_by=None,
+	counts_only=False,
+	if_none_match=None,
+	if_modified_since=None,
+):
+	"""
+	Get the appointments in the window [start, end) page by page, ordered by start. Over HTTP
+	the ETag and Last-Modified headers are set and an unchanged window is answered with
+	304 Not Modified.
+	:param filters: Filters (JSON) on Patient Appointment
+	:param cursor: `next_cursor` returned with the previous page
+	:param group_by: "practitioner" to group events by practitioner and day
+	:param counts_only: only return the number of appointments per practitioner and day
+	:param if_none_match: `etag` of an earlier response, defaults to the If-None-Match header
+	:param if_modified_since: HTTP date, defaults to the If-Modified-Since header, only used
+	        without `if_none_match`
+	:return: dict with `etag`, `last_modified` and `events`, `groups` or `counts`,
+	        only `not_modified` is set if the window did not change
+	"""
+	return get_calendar_feed_response(
+		build_calendar_feed(
+			start,
+			end,
+			filters,
+			cursor,
+			page_length,
+			group_by,
+			counts_only,
+			if_none_match,
+			if_modified_since,
+		)
+	)
+
+
+def build_calendar_feed(
+	start,
+	end,
+	filters,
+	cursor,
+	page_length,
+	group_by,
+	counts_only,
+	if_none_match,
+	if_modified_since,
+):
+	start, end = get_datetime(start), get_datetime(end)
+	filters = get_calendar_feed_filters(filters)
+	filters += [
+		# bounds the index seek, bookings started before this ended before `start`
+		["appointment_datetime", ">=", start - MAX_DURATION],
+		["appointment_datetime", "<", end],
+		["appointment_end_datetime", ">", start],
+	]
+
+	# cancellations and reschedules touch `modified`, deletions change the count
+	window = frappe.get_list(
+		"Patient Appointment",
+		filters=filters,
+		fields=["count(name) as count", "max(modified) as last_modified"],
+		order_by=None,
+	)[0]
+	etag = hashlib.md5(
+		frappe.as_json(
+			[start, end, filters, cursor, page_length, group_by, counts_only, window],
+			indent=None,
+		).encode()
+	).hexdigest()
+	# deletions leave the latest `modified` of the window as it was
+	last_deleted = frappe.db.get_value(
+		"Deleted Document", {"deleted_doctype": "Patient Appointment"}, "max(creation)"
+	)
+	last_modified = max(filter(None, [window.last_modified, last_deleted]), default=None)
+	feed = frappe._dict(etag=etag, last_modified=last_modified)
+
+	request = getattr(frappe.local, "request", None)
+	if request:
+		if_none_match = if_none_match or request.headers.get("If-None-Match")
+		if_modified_since = if_modified_since or request.headers.get("If-Modified-Since")
+	if is_calendar_feed_not_modified(feed, if_none_match, if_modified_since):
+		feed.not_modified = True
+		return feed
+
+	filters += [["status", "!=", "Cancelled"], ["docstatus", "<", 2]]
+
+	if frappe.utils.cint(counts_only):
+		feed.counts = frappe.get_list(
+			"Patient Appointment",
+			filters=filters,
+			fields=["practitioner", "appointment_date", "count(name) as count"],
+			group_by="practitioner, appointment_date",
+			order_by="appointment_date, practitioner",
+		)
+		return feed
+
+	page_length = min(
+		frappe.utils.cint(page_length) or CALENDAR_FEED_PAGE_LENGTH, CALENDAR_FEED_MAX_PAGE_LENGTH
+	)
+	events = get_calendar_feed_page(filters, cursor, page_length + 1)
+	if len(events) > page_length:
+		events = events[:page_length]
+		feed.next_cursor = frappe.as_json([events[-1].start, events[-1].name], indent=None)
+
+	colors = {}
+	for event in events:
+		if event.appointment_type and event.appointment_type not in colors:
+			colors[event.appointment_type] = frappe.get_cached_value(
+				"Appointment Type", event.appointment_type, "color"
+			)
+		event.color = colors.get(event.appointment_type)
+		event.allDay = 0
+
+	if group_by == "practitioner":
+		groups = {}
+		for event in events:
+			key = (event.practitioner, getdate(event.start))
+			if key not in groups:
+				groups[key] = frappe._dict(
+					practitioner=event.practitioner,
+					practitioner_name=event.practitioner_name,
+					date=key[1],
+					events=[],
+				)
+			groups[key].events.append(event)
+		feed.groups = list(groups.values())
+	else:
+		feed.events = events
+
+	return feed
+
+
+def is_calendar_feed_not_modified(feed, if_none_match, if_modified_since):
+	# If-Modified-Since is ignored when If-None-Match is sent, as in RFC 9110
+	if if_none_match:
+		return if_none_match.removeprefix("W/").strip('"') == feed.etag
+
+	since = parse_date(if_modified_since) if if_modified_since else None
+	if not (since and feed.last_modified):
+		return False
+	return get_http_datetime(feed.last_modified).replace(microsecond=0) <= since
+
+
+def get_calendar_feed_response(feed):
+	"""Serve the feed with its validators when it is the method called over HTTP"""
+	if not getattr(frappe.local, "request", None) or frappe.form_dict.get("cmd") != (
+		f"{__name__}.get_calendar_feed"
+	):
+		return feed
+
+	response = Response(status=304 if feed.not_modified else 200)
+	response.set_etag(feed.etag)
+	if feed.last_modified:
+		response.last_modified = get_http_datetime(feed.last_modified)
+	# clients revalidate every time, the validators keep that cheap
+	response.headers["Cache-Control"] = "private, no-cache"
+	if not feed.not_modified:
+		response.mimetype = "application/json"
+		response.set_data(frappe.as_json({"message": feed}, indent=None))
+	return response
+
+
+def get_http_datetime(value):
+	"""`value` in the system time zone, made aware for HTTP dates"""
+	return get_datetime(value).replace(tzinfo=ZoneInfo(get_system_timezone()))
+
+
+def get_calendar_feed_filters(filters):
+	filters = frappe.parse_json(filters) or []
+	if isinstance(filters, dict):
+		filters = [
+			[field, *value] if isinstance(value, (list, tuple)) else [field, "=", value]
+			for field, value in filters.items()
+		]
+
+	return [list(f) for f in filters]
+
+
+def get_calendar_feed_page(filters, cursor, limit):
+	"""Keyset page on (appointment_datetime, name) after `cursor`, as two seeks on the index"""
+	fields = [
+		"name",
+		"patient",
+		"patient_name",
+		"practitioner",
+		"practitioner_name",
+		"service_unit",
+		"appointment_type",
+		"status",
+		"duration",
+		"appointment_datetime as start",
+		"appointment_end_datetime as end",
+	]
+
+	events = []
+	start_filter = []
+	if cursor:
+		cursor_start, cursor_name = frappe.parse_json(cursor)
+		cursor_start = get_datetime(cursor_start)
+		# rest of the appointments starting with the last one of the previous page
+		events = frappe.get_list(
+			"Patient Appointment",
+			filters=filters + [["appointment_datetime", "=", cursor_start], ["name", ">", cursor_name]],
+			fields=fields,
+			order_by="name asc",
+			limit_page_length=limit,
+		)
+		start_filter = [["appointment_datetime", ">", cursor_start]]
+
+	if len(events) < limit:
+		events += frappe.get_list(
+			"Patient Appointment",
+			filters=filters + start_filter,
+			fields=fields,
+			order_by="appointment_datetime asc, name asc",
+			limit_page_length=limit - len(events),
+		)
+
+	return events
+
+
 @frappe.whitelist()
 def get_procedure_prescribed(patient):
 	return frappe.db.sql(
@@ -867,12 +1550,35 @@ def get_prescribed_therapies(patient):
 
 
 def update_appointment_status():
-	# update the status of appointments daily
-	appointments = frappe.get_all(
-		"Patient Appointment", {"status": ("not in", ["Closed", "Cancelled"])}
+	"""
+	Runs daily, appointments of the days crossed since the last run move from Scheduled to Open
+	:return: number of appointments updated per status
+	"""
+	today = getdate()
+	last_run = frappe.db.get_global("appointment_status_updated_till")
+	from_date = frappe.utils.add_days(getdate(last_run), 1) if last_run else today
+
+	updated = {}
+	if from_date <= today:
+		appointment = frappe.qb.DocType("Patient Appointment")
+		condition = (appointment.status == "Scheduled") & (
+			appointment.appointment_date.between(from_date, today)
+		)
+		count = (
+			frappe.qb.from_(appointment).select(Count(appointment.name)).where(condition)
+		).run()[0][0]
+		if count:
+			(
+				frappe.qb.update(appointment)
+				.set(appointment.status, "Open")
+				.set(appointment.modified, frappe.utils.now())
+				.where(condition)
+			).run()
+		updated["Open"] = count
+
+	frappe.db.set_global("appointment_status_updated_till", today)
+	frappe.logger("healthcare").info(
+		f"Appointment status rollover from {from_date} to {today}, updated: {updated}"
 	)
 
-	for appointment in appointments:
-		appointment_doc = frappe.get_doc("Patient Appointment", appointment.name)
-		appointment_doc.set_status()
-		appointment_doc.save()
\ No newline at end of file
+	return updated
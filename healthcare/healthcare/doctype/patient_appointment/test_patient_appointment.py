@@ -8,14 +8,17 @@ import datetime
 import frappe
 from erpnext.accounts.doctype.pos_profile.test_pos_profile import make_pos_profile
 from frappe.tests.utils import FrappeTestCase
-from frappe.utils import add_days, flt, get_time, getdate, now_datetime, nowdate
+from frappe.utils import add_days, flt, get_datetime, get_time, getdate, now_datetime, nowdate
 
 from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
 	check_is_new_patient,
 	check_payment_fields_reqd,
+	get_availability_for_date_range,
 	make_encounter,
+	process_appointment_invoice,
 	update_status,
 )
+from healthcare.healthcare.utils import clear_billing_rate_cache
 
 
 class TestPatientAppointment(FrappeTestCase):
@@ -24,6 +27,7 @@ class TestPatientAppointment(FrappeTestCase):
 		frappe.db.sql("""delete from `tabFee Validity`""")
 		frappe.db.sql("""delete from `tabPatient Encounter`""")
 		make_pos_profile()
+		clear_billing_rate_cache()
 		frappe.db.sql("""delete from `tabHealthcare Service Unit` where name like '_Test %'""")
 		frappe.db.sql(
 			"""delete from `tabHealthcare Service Unit` where name like '_Test Service Unit Type%'"""
@@ -43,6 +47,28 @@ class TestPatientAppointment(FrappeTestCase):
 		encounter.cancel()
 		self.assertEqual(frappe.db.get_value("Patient Appointment", appointment.name, "status"), "Open")
 
+	def test_appointment_status_rollover(self):
+		from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
+			update_appointment_status,
+		)
+
+		patient, practitioner = create_healthcare_docs()
+		appointment = create_appointment(patient, practitioner, add_days(nowdate(), 2))
+		later_appointment = create_appointment(patient, practitioner, add_days(nowdate(), 3))
+		self.assertEqual(appointment.status, "Scheduled")
+
+		# the appointment date was crossed while the job did not run
+		frappe.db.set_value("Patient Appointment", appointment.name, "appointment_date", nowdate())
+		frappe.db.set_global("appointment_status_updated_till", add_days(nowdate(), -2))
+
+		self.assertEqual(update_appointment_status(), {"Open": 1})
+		self.assertEqual(frappe.db.get_value("Patient Appointment", appointment.name, "status"), "Open")
+		self.assertEqual(
+			frappe.db.get_value("Patient Appointment", later_appointment.name, "status"), "Scheduled"
+		)
+		# nothing left to roll over on the same day
+		self.assertEqual(update_appointment_status(), {})
+
 	def test_start_encounter(self):
 		patient, practitioner = create_healthcare_docs()
 		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 1)
@@ -83,6 +109,35 @@ class TestPatientAppointment(FrappeTestCase):
 			frappe.db.get_value("Sales Invoice", sales_invoice_name, "paid_amount"), appointment.paid_amount
 		)
 
+	def test_auto_invoicing_in_background(self):
+		patient, practitioner = create_healthcare_docs()
+		frappe.db.set_single_value("Healthcare Settings", "enable_free_follow_ups", 0)
+		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 1)
+		frappe.db.set_single_value("Healthcare Settings", "invoice_appointments_in_background", 1)
+
+		appointment = create_appointment(patient, practitioner, add_days(nowdate(), 2), invoice=1)
+		self.assertEqual(
+			frappe.db.get_value("Patient Appointment", appointment.name, ["invoiced", "invoice_status"]),
+			(0, "Queued"),
+		)
+
+		process_appointment_invoice(appointment.name)
+		self.assertEqual(
+			frappe.db.get_value("Patient Appointment", appointment.name, ["invoiced", "invoice_status"]),
+			(1, "Invoiced"),
+		)
+
+		# processing the same appointment again does not invoice it twice
+		process_appointment_invoice(appointment.name)
+		self.assertEqual(
+			frappe.db.count("Sales Invoice Item", {"reference_dn": appointment.name, "docstatus": 1}),
+			1,
+		)
+
+		# the job of an appointment deleted since it was queued is a no-op
+		process_appointment_invoice("_Test Deleted Appointment")
+		frappe.db.set_single_value("Healthcare Settings", "invoice_appointments_in_background", 0)
+
 	def test_auto_invoicing_based_on_practitioner_department(self):
 		patient, practitioner = create_healthcare_docs()
 		frappe.db.set_value(
@@ -93,6 +148,8 @@ class TestPatientAppointment(FrappeTestCase):
 				"inpatient_visit_charge": 0,
 			},
 		)
+		# direct updates skip the hooks clearing cached billing rates
+		clear_billing_rate_cache()
 		medical_department = create_medical_department()
 		frappe.db.set_single_value("Healthcare Settings", "enable_free_follow_ups", 0)
 		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 1)
@@ -214,6 +271,8 @@ class TestPatientAppointment(FrappeTestCase):
 				"inpatient_visit_charge": 0,
 			},
 		)
+		# direct updates skip the hooks clearing cached billing rates
+		clear_billing_rate_cache()
 		frappe.db.set_single_value("Healthcare Settings", "enable_free_follow_ups", 0)
 		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 1)
 
@@ -237,6 +296,22 @@ class TestPatientAppointment(FrappeTestCase):
 		)
 		self.assertTrue(sales_invoice_name)
 
+	def test_appointments_to_invoice(self):
+		from healthcare.healthcare.utils import get_appointments_to_invoice
+
+		frappe.db.set_single_value("Healthcare Settings", "automate_appointment_invoicing", 0)
+		patient, practitioner = create_healthcare_docs()
+		appointments = [
+			create_appointment(patient, practitioner, add_days(nowdate(), days)).name for days in (1, 2)
+		]
+
+		services = get_appointments_to_invoice(frappe.get_doc("Patient", patient), "_Test Company")
+		self.assertEqual([service["reference_name"] for service in services], appointments)
+		for service in services:
+			self.assertEqual(service["service"], "HLC-SI-001")
+			self.assertTrue(service["rate"])
+			self.assertTrue(service["income_account"])
+
 	def test_appointment_cancel(self):
 		patient, practitioner = create_healthcare_docs()
 		frappe.db.set_single_value("Healthcare Settings", "enable_free_follow_ups", 1)
@@ -457,6 +532,167 @@ class TestPatientAppointment(FrappeTestCase):
 		)
 		self.assertRaises(MaximumCapacityError, appointment.save)
 
+	def test_appointment_end_datetime(self):
+		patient, practitioner = create_healthcare_docs()
+		appointment = create_appointment(patient, practitioner, nowdate())
+		self.assertEqual(
+			appointment.appointment_end_datetime,
+			get_datetime(appointment.appointment_datetime)
+			+ datetime.timedelta(minutes=flt(appointment.duration)),
+		)
+
+		appointment.duration = 45
+		appointment.save()
+		self.assertEqual(
+			appointment.appointment_end_datetime,
+			get_datetime(appointment.appointment_datetime) + datetime.timedelta(minutes=45),
+		)
+
+	def test_book_appointments(self):
+		from healthcare.www.book_patient_appointment import book_appointments
+
+		patient, practitioner = create_healthcare_docs()
+		other_patient = create_patient(id=1)
+		args = {
+			"practitioner": practitioner,
+			"company": "_Test Company",
+			"department": create_medical_department(),
+			"date": add_days(nowdate(), 1),
+			"duration": 15,
+			"appointment_type": create_appointment_type().name,
+			"opt_out_vconf": 1,
+		}
+		results = book_appointments(
+			[
+				dict(args, patient=patient, time="10:00:00"),
+				# overlaps the first booking of the batch
+				dict(args, patient=other_patient, time="10:10:00"),
+				dict(args, patient=other_patient, time="10:15:00"),
+				dict(args, time="11:00:00"),
+			]
+		)
+
+		self.assertTrue(results[0].name)
+		self.assertIn("overlap", results[1].error)
+		self.assertTrue(results[2].name)
+		self.assertTrue(results[3].error)
+		self.assertEqual(
+			frappe.db.count("Patient Appointment", {"practitioner": practitioner}),
+			2,
+		)
+
+	def test_calendar_feed(self):
+		from werkzeug.http import http_date
+
+		from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
+			get_calendar_feed,
+			get_http_datetime,
+		)
+
+		appointments = []
+		for id in range(3):
+			patient, practitioner = create_healthcare_docs(id=id)
+			appointments.append(create_appointment(patient, practitioner, nowdate()).name)
+
+		start, end = nowdate(), add_days(nowdate(), 1)
+		first_page = get_calendar_feed(start, end, page_length=2)
+		self.assertEqual(len(first_page.events), 2)
+		self.assertTrue(first_page.next_cursor)
+
+		second_page = get_calendar_feed(start, end, cursor=first_page.next_cursor, page_length=2)
+		self.assertEqual(len(second_page.events), 1)
+		self.assertFalse(second_page.get("next_cursor"))
+		self.assertEqual(
+			sorted(event.name for event in first_page.events + second_page.events), sorted(appointments)
+		)
+
+		counts = get_calendar_feed(start, end, counts_only=1).counts
+		self.assertEqual(sum(row.count for row in counts), 3)
+
+		feed = get_calendar_feed(start, end, group_by="practitioner")
+		self.assertEqual(len(feed.groups), 3)
+		self.assertTrue(
+			get_calendar_feed(start, end, group_by="practitioner", if_none_match=feed.etag).not_modified
+		)
+		self.assertTrue(
+			get_calendar_feed(
+				start, end, group_by="practitioner", if_none_match=f'W/"{feed.etag}"'
+			).not_modified
+		)
+
+		last_modified = get_http_datetime(feed.last_modified)
+		self.assertTrue(
+			get_calendar_feed(
+				start, end, group_by="practitioner", if_modified_since=http_date(last_modified)
+			).not_modified
+		)
+		self.assertFalse(
+			get_calendar_feed(
+				start,
+				end,
+				group_by="practitioner",
+				if_modified_since=http_date(last_modified - datetime.timedelta(hours=1)),
+			).get("not_modified")
+		)
+
+		update_status(appointments[0], "Cancelled")
+		feed = get_calendar_feed(start, end, group_by="practitioner", if_none_match=feed.etag)
+		self.assertFalse(feed.get("not_modified"))
+		self.assertEqual(len(feed.groups), 2)
+
+	def test_appointment_reminders(self):
+		from healthcare.healthcare.appointment_reminder import StubSMSGateway, send_appointment_reminders
+
+		frappe.db.set_single_value(
+			"Healthcare Settings",
+			{
+				"send_appointment_reminder": 1,
+				"remind_before": "02:00:00",
+				"appointment_reminder_msg": "Hello {{doc.patient}}, see you at {{doc.appointment_time}}",
+			},
+		)
+		start = now_datetime() + datetime.timedelta(minutes=30)
+		appointments = []
+		for id, mobile in ((20, "9876543210"), (21, None)):
+			patient = create_patient(id=id, mobile=mobile)
+			appointment = create_appointment(patient, create_practitioner(id=id), start.date(), save=0)
+			appointment.appointment_time = start.time().replace(microsecond=0)
+			appointment.save(ignore_permissions=True)
+			appointments.append(appointment)
+
+		frappe.flags.sms_gateway = gateway = StubSMSGateway()
+		try:
+			self.assertEqual(send_appointment_reminders(), {"sent": 1, "failed": 0, "skipped": 1})
+		finally:
+			frappe.flags.sms_gateway = None
+
+		self.assertEqual(len(gateway.outbox), 1)
+		self.assertIn(appointments[0].patient, gateway.outbox[0][1])
+		for appointment in appointments:
+			self.assertEqual(frappe.db.get_value("Patient Appointment", appointment.name, "reminded"), 1)
+
+		# nothing left to remind
+		self.assertIsNone(send_appointment_reminders())
+
+	def test_interval_index(self):
+		from healthcare.healthcare.overlap_checker import IntervalIndex, make_interval
+
+		start = datetime.datetime.combine(getdate(), get_time("09:00:00"))
+		index = IntervalIndex()
+		for i, minutes in enumerate([30, 15, 0, 60]):
+			slot_start = start + datetime.timedelta(minutes=15 * i)
+			index.add(make_interval(slot_start, slot_start + datetime.timedelta(minutes=minutes), name=i))
+
+		query_start = start + datetime.timedelta(minutes=20)
+		query_end = start + datetime.timedelta(minutes=35)
+		overlaps = index.search(query_start, query_end)
+		self.assertEqual([interval.name for interval in overlaps], [0, 1, 2])
+		self.assertEqual(index.count(query_start, query_end), 3)
+		# half-open, a booking ending at the slot start does not overlap
+		self.assertEqual(
+			index.count(start + datetime.timedelta(minutes=105), start + datetime.timedelta(minutes=120)), 0
+		)
+
 	def test_teleconsultation(self):
 		patient, practitioner = create_healthcare_docs()
 		appointment = create_appointment(patient, practitioner, nowdate())
@@ -464,6 +700,32 @@ class TestPatientAppointment(FrappeTestCase):
 		test_appointment_reschedule(self, appointment)
 		test_appointment_cancel(self, appointment)
 
+	def test_availability_for_date_range(self):
+		patient, practitioner = create_healthcare_docs()
+		service_unit = create_service_unit(id=2)
+		schedule = create_practitioner_schedule(practitioner, service_unit)
+		from_date, to_date = add_days(nowdate(), 1), add_days(nowdate(), 7)
+
+		availability = get_availability_for_date_range(from_date, to_date, [practitioner])
+		dates = availability[practitioner]["dates"]
+		self.assertEqual(len(dates), 7)
+
+		slot_details = dates[str(getdate(from_date))][0]
+		self.assertEqual(slot_details["slot_name"], schedule)
+		self.assertEqual(slot_details["service_unit"], service_unit)
+		free_slots = len(slot_details["free_slots"])
+
+		appointment = create_appointment(patient, practitioner, from_date, service_unit=service_unit, save=0)
+		appointment.appointment_time = "09:00:00"
+		appointment.save(ignore_permissions=True)
+
+		availability = get_availability_for_date_range(from_date, from_date, [practitioner])
+		slot_details = availability[practitioner]["dates"][str(getdate(from_date))][0]
+		self.assertEqual(len(slot_details["free_slots"]), free_slots - 1)
+		self.assertNotIn(
+			"09:00:00", [str(get_time(slot["from_time"])) for slot in slot_details["free_slots"]]
+		)
+
 
 def create_healthcare_docs(id=0):
 	patient = create_patient(id)
@@ -677,6 +939,28 @@ def create_service_unit(id=0, service_unit_type=None, service_unit_capacity=0):
 	return service_unit.name
 
 
+def create_practitioner_schedule(practitioner, service_unit):
+	schedule_name = "_Test Practitioner Schedule"
+	if not frappe.db.exists("Practitioner Schedule", schedule_name):
+		schedule = frappe.new_doc("Practitioner Schedule")
+		schedule.schedule_name = schedule_name
+		for day in ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]:
+			for hour in range(9, 12):
+				schedule.append(
+					"time_slots",
+					{"day": day, "from_time": f"{hour:02}:00:00", "to_time": f"{hour:02}:15:00"},
+				)
+		schedule.save(ignore_permissions=True)
+
+	practitioner = frappe.get_doc("Healthcare Practitioner", practitioner)
+	practitioner.set(
+		"practitioner_schedules", [{"schedule": schedule_name, "service_unit": service_unit}]
+	)
+	practitioner.save(ignore_permissions=True)
+
+	return schedule_name
+
+
 def test_appointment_reschedule(self, appointment):
 	appointment_datetime = datetime.datetime.combine(
 		getdate(appointment.appointment_date), get_time(appointment.appointment_time)
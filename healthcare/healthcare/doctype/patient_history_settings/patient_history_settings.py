@@ -10,7 +10,11 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import cint, cstr
 
-from healthcare.healthcare.page.patient_history.patient_history import get_patient_history_doctypes
+from healthcare.healthcare.doctype.patient_medical_record_event.patient_medical_record_event import (
+	queue_medical_record_event,
+)
+
+PATIENT_HISTORY_REGISTRY_CACHE_KEY = "patient_history_registry"
 
 
 class PatientHistorySettings(Document):
@@ -18,6 +22,9 @@ class PatientHistorySettings(Document):
 		self.validate_submittable_doctypes()
 		self.validate_date_fieldnames()
 
+	def on_update(self):
+		clear_patient_history_registry()
+
 	def validate_submittable_doctypes(self):
 		for entry in self.custom_doctypes:
 			if not cint(frappe.db.get_value("DocType", entry.document_type, "is_submittable")):
@@ -79,6 +86,14 @@ def create_medical_record(doc, method=None):
 	if not medical_record_required:
 		return
 
+	if create_medical_records_in_background():
+		queue_medical_record_event(doc)
+		return
+
+	insert_medical_record(doc)
+
+
+def insert_medical_record(doc):
 	if frappe.db.exists("Patient Medical Record", {"reference_name": doc.name}):
 		return
 
@@ -100,13 +115,20 @@ def update_medical_record(doc, method=None):
 	if not medical_record_required:
 		return
 
+	if create_medical_records_in_background():
+		queue_medical_record_event(doc)
+		return
+
 	medical_record_id = frappe.db.exists("Patient Medical Record", {"reference_name": doc.name})
 
 	if medical_record_id:
-		subject = set_subject_field(doc)
-		frappe.db.set_value("Patient Medical Record", medical_record_id[0][0], "subject", subject)
+		update_medical_record_subject(doc, medical_record_id)
 	else:
-		create_medical_record(doc)
+		insert_medical_record(doc)
+
+
+def update_medical_record_subject(doc, medical_record):
+	frappe.db.set_value("Patient Medical Record", medical_record, "subject", set_subject_field(doc))
 
 
 def delete_medical_record(doc, method=None):
@@ -114,75 +136,135 @@ def delete_medical_record(doc, method=None):
 	if not medical_record_required:
 		return
 
+	if create_medical_records_in_background():
+		queue_medical_record_event(doc)
+		return
+
 	record = frappe.db.exists("Patient Medical Record", {"reference_name": doc.name})
 	if record:
 		frappe.delete_doc("Patient Medical Record", record, force=1)
 
 
+def create_medical_records_in_background():
+	settings = frappe.get_cached_doc("Patient History Settings")
+	return cint(settings.create_medical_records_in_background)
+
+
 def set_subject_field(doc):
-	from frappe.utils.formatters import format_value
+	return SubjectFormatter(doc.doctype).format(doc)
+
+
+class SubjectFormatter:
+	"""
+	Builds the medical record subject of documents of a doctype from its selected fields. The
+	fields, their labels and the list view columns of tables are resolved once, so that one
+	formatter serves any number of documents of the doctype.
+	"""
+
+	def __init__(self, doctype):
+		meta = frappe.get_meta(doctype)
+		self.doctype = doctype
+		self.fields = []
+		self.tables = {}
+
+		for entry in get_patient_history_registry().get(doctype, {}).get("selected_fields") or []:
+			fieldname = entry.get("fieldname")
+			df = meta.get_field(fieldname)
+			is_table = entry.get("fieldtype") == "Table"
+			self.fields.append((fieldname, df, frappe.bold(_(entry.get("label")) + ":"), is_table))
+
+			if is_table:
+				child_meta = frappe.get_meta(df.options)
+				columns = [cdf for cdf in child_meta.fields if cdf.in_list_view]
+				self.tables[fieldname] = frappe._dict(
+					doctype=df.options,
+					columns=[cdf.fieldname for cdf in columns],
+					head="".join("<td>" + cdf.label + "</td>" for cdf in columns),
+				)
 
-	meta = frappe.get_meta(doc.doctype)
-	subject = ""
-	patient_history_fields = get_patient_history_fields(doc)
+	def format(self, doc):
+		from frappe.utils.formatters import format_value
 
-	for entry in patient_history_fields:
-		fieldname = entry.get("fieldname")
-		if entry.get("fieldtype") == "Table" and doc.get(fieldname):
-			formatted_value = get_formatted_value_for_table_field(
-				doc.get(fieldname), meta.get_field(fieldname)
-			)
-			subject += frappe.bold(_(entry.get("label")) + ":") + "<br>" + cstr(formatted_value) + "<br>"
+		subject = ""
+		for fieldname, df, label, is_table in self.fields:
+			value = doc.get(fieldname)
+			if not value:
+				continue
 
-		else:
-			if doc.get(fieldname):
-				formatted_value = format_value(doc.get(fieldname), meta.get_field(fieldname), doc)
-				subject += frappe.bold(_(entry.get("label")) + ":") + cstr(formatted_value) + "<br>"
+			if is_table:
+				subject += label + "<br>" + self.format_table(value, self.tables[fieldname]) + "<br>"
+			else:
+				subject += label + cstr(format_value(value, df, doc)) + "<br>"
 
-	return subject
+		return subject
 
+	def format_table(self, items, table):
+		rows = ""
+		for item in items:
+			rows += "<tr>"
+			for column in table.columns:
+				value = item.get(column)
+				rows += "<td>" + str(value) + "</td>" if value else "<td></td>"
+			rows += "</tr>"
 
-def get_date_field(doctype):
-	dt = get_patient_history_config_dt(doctype)
+		return "<table class='table table-condensed table-bordered'>" + table.head + rows + "</table>"
 
-	return frappe.db.get_value(dt, {"document_type": doctype}, "date_fieldname")
+
+def get_date_field(doctype):
+	return get_patient_history_registry().get(doctype, {}).get("date_fieldname")
 
 
 def get_patient_history_fields(doc):
-	dt = get_patient_history_config_dt(doc.doctype)
-	patient_history_fields = frappe.db.get_value(
-		dt, {"document_type": doc.doctype}, "selected_fields"
+	return get_patient_history_registry().get(doc.doctype, {}).get("selected_fields")
+
+
+def get_patient_history_registry():
+	"""
+	Get the date field and selected fields of each doctype tracked in patient history, cached
+	for the site until Patient History Settings are saved
+	"""
+	return frappe.cache().get_value(
+		PATIENT_HISTORY_REGISTRY_CACHE_KEY, build_patient_history_registry
 	)
 
-	if patient_history_fields:
-		return json.loads(patient_history_fields)
-
-
-def get_formatted_value_for_table_field(items, df):
-	child_meta = frappe.get_meta(df.options)
-
-	table_head = ""
-	table_row = ""
-	html = ""
-	create_head = True
-	for item in items:
-		table_row += "<tr>"
-		for cdf in child_meta.fields:
-			if cdf.in_list_view:
-				if create_head:
-					table_head += "<td>" + cdf.label + "</td>"
-				if item.get(cdf.fieldname):
-					table_row += "<td>" + str(item.get(cdf.fieldname)) + "</td>"
-				else:
-					table_row += "<td></td>"
-		create_head = False
-		table_row += "</tr>"
-
-	html += (
-		"<table class='table table-condensed table-bordered'>" + table_head + table_row + "</table>"
+
+def build_patient_history_registry():
+	rows = {}
+	for dt in ("Patient History Standard Document Type", "Patient History Custom Document Type"):
+		for row in frappe.get_all(
+			dt,
+			filters={"parent": "Patient History Settings"},
+			fields=["document_type", "date_fieldname", "selected_fields"],
+			order_by="idx",
+		):
+			rows.setdefault(row.document_type, {}).setdefault(dt, row)
+
+	if not rows:
+		return {}
+
+	custom_doctypes = set(
+		frappe.get_all("DocType", filters={"name": ["in", list(rows)], "custom": 1}, pluck="name")
 	)
 
-	return html
+	registry = {}
+	for doctype, config in rows.items():
+		# the configuration is read from the table matching the kind of doctype
+		dt = (
+			"Patient History Custom Document Type"
+			if doctype in custom_doctypes
+			else "Patient History Standard Document Type"
+		)
+		row = config.get(dt) or frappe._dict()
+		registry[doctype] = {
+			"date_fieldname": row.date_fieldname,
+			"selected_fields": json.loads(row.selected_fields) if row.selected_fields else None,
+		}
+
+	return registry
+
+
+def clear_patient_history_registry():
+	frappe.cache().delete_value(PATIENT_HISTORY_REGISTRY_CACHE_KEY)
 
 
 def get_patient_history_config_dt(doctype):
@@ -193,15 +275,14 @@ def get_patient_history_config_dt(doctype):
 
 
 def validate_medical_record_required(doc):
-	if (
-		frappe.flags.in_patch
-		or frappe.flags.in_install
-		or frappe.flags.in_setup_wizard
-		or get_module(doc) != "Healthcare"
-	):
+	if frappe.flags.in_patch or frappe.flags.in_install or frappe.flags.in_setup_wizard:
+		return False
+
+	# runs on every submit of the site, doctypes not tracked exit on the cached registry
+	if doc.doctype not in get_patient_history_registry():
 		return False
 
-	if doc.doctype not in get_patient_history_doctypes():
+	if get_module(doc) != "Healthcare":
 		return False
 
 	return True
@@ -12,6 +12,11 @@ from frappe.utils import getdate, strip_html
 from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment import (
 	create_patient,
 )
+from healthcare.healthcare.doctype.patient_history_settings.patient_history_settings import (
+	get_patient_history_registry,
+	validate_medical_record_required,
+)
+from healthcare.healthcare.medical_record_rebuild import get_series_parts, rebuild_medical_records
 
 
 class TestPatientHistorySettings(FrappeTestCase):
@@ -52,6 +57,66 @@ class TestPatientHistorySettings(FrappeTestCase):
 		self.assertEqual(medical_rec.patient, patient)
 		self.assertEqual(medical_rec.communication_date, getdate())
 
+	def test_patient_history_registry(self):
+		registry = get_patient_history_registry()
+		self.assertEqual(registry["Test Patient Feedback"]["date_fieldname"], "date")
+		self.assertEqual(
+			[field["fieldname"] for field in registry["Test Patient Feedback"]["selected_fields"]],
+			["date", "rating", "feedback"],
+		)
+		self.assertFalse(validate_medical_record_required(frappe.new_doc("ToDo")))
+
+		# saving the settings refreshes the registry
+		settings = frappe.get_single("Patient History Settings")
+		for entry in settings.custom_doctypes:
+			if entry.document_type == "Test Patient Feedback":
+				entry.selected_fields = json.dumps(
+					[{"label": "Rating", "fieldname": "rating", "fieldtype": "Rating"}]
+				)
+		settings.save()
+		registry = get_patient_history_registry()
+		self.assertEqual(len(registry["Test Patient Feedback"]["selected_fields"]), 1)
+
+	def test_rebuild_medical_records(self):
+		patient = create_patient()
+		doc = create_doc(patient)
+		medical_rec = frappe.db.exists("Patient Medical Record", {"reference_name": doc.name})
+
+		settings = frappe.get_single("Patient History Settings")
+		for entry in settings.custom_doctypes:
+			if entry.document_type == "Test Patient Feedback":
+				entry.selected_fields = json.dumps(
+					[{"label": "Rating", "fieldname": "rating", "fieldtype": "Rating"}]
+				)
+		settings.save()
+
+		other_doc = create_doc(patient)
+		frappe.delete_doc("Patient Medical Record", medical_rec, force=1)
+		frappe.db.set_value(
+			"Patient Medical Record", {"reference_name": other_doc.name}, "subject", "Stale"
+		)
+
+		stats = rebuild_medical_records("Test Patient Feedback", batch_size=1)
+		self.assertGreaterEqual(stats.documents, 2)
+		self.assertGreaterEqual(stats.created, 1)
+		self.assertGreaterEqual(stats.updated, 1)
+
+		for name in (doc.name, other_doc.name):
+			subject = frappe.db.get_value("Patient Medical Record", {"reference_name": name}, "subject")
+			self.assertEqual(strip_html(subject), "Rating:3")
+
+		# a document cancelled without its controller leaves a record behind
+		frappe.db.set_value("Test Patient Feedback", other_doc.name, "docstatus", 2)
+		stats = rebuild_medical_records("Test Patient Feedback")
+		self.assertGreaterEqual(stats.deleted, 1)
+		self.assertFalse(frappe.db.exists("Patient Medical Record", {"reference_name": other_doc.name}))
+		self.assertTrue(frappe.db.exists("Patient Medical Record", {"reference_name": doc.name}))
+
+	def test_series_parts(self):
+		self.assertEqual(get_series_parts("MAT-PMR-"), ("MAT-PMR-", 5, ""))
+		self.assertEqual(get_series_parts("MAT-PMR-.###"), ("MAT-PMR-", 3, ""))
+		self.assertEqual(get_series_parts("MAT-.####.-PMR"), ("MAT-", 4, "-PMR"))
+
 
 def create_custom_doctype():
 	if not frappe.db.exists("DocType", "Test Patient Feedback"):
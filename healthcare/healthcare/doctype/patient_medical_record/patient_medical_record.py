@@ -6,8 +6,29 @@
 import frappe
 from frappe.model.document import Document
 
+from healthcare.healthcare.doctype.patient_activity_count.patient_activity_count import (
+	update_patient_activity,
+)
+
 
 class PatientMedicalRecord(Document):
 	def after_insert(self):
 		if self.reference_doctype == "Patient Medical Record":
 			frappe.db.set_value("Patient Medical Record", self.name, "reference_name", self.name)
+
+	def on_update(self):
+		changes = [(self.patient, self.communication_date, 1)]
+		doc_before_save = self.get_doc_before_save()
+		if doc_before_save:
+			changes.append((doc_before_save.patient, doc_before_save.communication_date, -1))
+		update_patient_activity(changes)
+
+	def on_trash(self):
+		update_patient_activity([(self.patient, self.communication_date, -1)])
+
+
+def on_doctype_update():
+	# the patient history feed, newest first, the primary key completes its (date, name) cursor
+	frappe.db.add_index(
+		"Patient Medical Record", ["patient", "communication_date", "reference_doctype"]
+	)
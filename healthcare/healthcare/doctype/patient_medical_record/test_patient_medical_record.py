@@ -2,6 +2,7 @@
 # Copyright (c) 2015, ESS LLP and Contributors
 # See license.txt
 
+import json
 
 import frappe
 from erpnext.accounts.doctype.pos_profile.test_pos_profile import make_pos_profile
@@ -13,6 +14,11 @@ from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment
 	create_encounter,
 	create_healthcare_docs,
 	create_medical_department,
+	create_patient,
+)
+from healthcare.healthcare.page.patient_history.patient_history import (
+	get_feed_page,
+	get_feed_subject,
 )
 
 
@@ -61,6 +67,41 @@ class TestPatientMedicalRecord(FrappeTestCase):
 		)
 		self.assertTrue(medical_rec)
 
+	def test_patient_history_feed_pages(self):
+		patient = create_patient()
+		for days in (0, 0, -1, -2, -2):
+			frappe.get_doc(
+				{
+					"doctype": "Patient Medical Record",
+					"patient": patient,
+					"subject": "Test Feed",
+					"communication_date": add_days(nowdate(), days),
+					"reference_doctype": "Patient Medical Record",
+				}
+			).insert(ignore_permissions=True)
+
+		expected = frappe.get_all(
+			"Patient Medical Record",
+			filters={"patient": patient},
+			order_by="communication_date desc, name desc",
+			pluck="name",
+		)
+
+		names, cursor = [], None
+		while True:
+			page = get_feed_page(patient, cursor=cursor and json.dumps(cursor, default=str), page_length=2)
+			self.assertTrue(all("subject" not in record for record in page["records"]))
+			names += [record.name for record in page["records"]]
+			cursor = page["cursor"]
+			if not cursor:
+				break
+
+		self.assertEqual(names, expected)
+		self.assertEqual(get_feed_subject(names[0]), "Test Feed")
+
+		# an empty page length still returns a page
+		self.assertEqual(len(get_feed_page(patient, page_length=0)["records"]), 1)
+
 
 def create_procedure(appointment):
 	if appointment:
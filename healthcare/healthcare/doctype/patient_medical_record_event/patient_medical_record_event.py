@@ -0,0 +1,200 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+from collections import defaultdict
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import add_days, add_to_date, now
+
+MEDICAL_RECORD_EVENT_BATCH_SIZE = 500
+MEDICAL_RECORD_EVENT_MAX_ATTEMPTS = 3
+# minutes before the first retry of a failed event, doubled on each further attempt
+MEDICAL_RECORD_EVENT_RETRY_DELAY = 5
+MEDICAL_RECORD_EVENT_RETENTION_DAYS = 30
+
+
+class PatientMedicalRecordEvent(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Patient Medical Record Event", ["status", "creation"])
+	frappe.db.add_index("Patient Medical Record Event", ["reference_doctype", "reference_name"])
+
+
+def queue_medical_record_event(doc):
+	"""Record that `doc` changed, its medical record is brought up to date by a background job"""
+	# a queued event of the document may already be claimed by a worker that read its previous
+	# state, so every change gets its own event, the events of a document in a batch are
+	# processed once
+	frappe.get_doc(
+		{
+			"doctype": "Patient Medical Record Event",
+			"reference_doctype": doc.doctype,
+			"reference_name": doc.name,
+		}
+	).insert(ignore_permissions=True)
+
+	enqueue_medical_record_events()
+
+
+def enqueue_medical_record_events():
+	frappe.enqueue(
+		process_medical_record_events,
+		job_id="process_medical_record_events",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def process_medical_record_events(batch_size=MEDICAL_RECORD_EVENT_BATCH_SIZE):
+	"""
+	Bring the medical records of the queued events up to date, a batch at a time until the
+	queue is drained. Records are derived from the current state of the documents, so an
+	event can be processed any number of times. Queued every scheduler tick to pick up events
+	queued while a job was already running, always under the same job id so that a single
+	worker materializes the records at a time.
+	"""
+	while True:
+		events = claim_medical_record_events(batch_size)
+		if not events:
+			break
+
+		references = defaultdict(list)
+		for event in events:
+			references[(event.reference_doctype, event.reference_name)].append(event)
+
+		processed, failed = [], []
+		for (reference_doctype, reference_name), reference_events in references.items():
+			frappe.db.savepoint("medical_record_event")
+			try:
+				materialize_medical_record(reference_doctype, reference_name)
+				processed += [event.name for event in reference_events]
+			except Exception:
+				frappe.db.rollback(save_point="medical_record_event")
+				error = frappe.get_traceback()
+				frappe.log_error(error, _("Medical Record Update Failed"))
+				failed += [(event, error) for event in reference_events]
+
+		set_processed(processed)
+		set_failed(failed)
+		frappe.db.commit()
+
+		if len(events) < batch_size:
+			break
+
+
+def claim_medical_record_events(batch_size):
+	event = frappe.qb.DocType("Patient Medical Record Event")
+	return (
+		frappe.qb.from_(event)
+		.select(event.name, event.reference_doctype, event.reference_name, event.attempts)
+		.where(event.status == "Queued")
+		.where(event.retry_after.isnull() | (event.retry_after <= now()))
+		.orderby(event.creation)
+		.limit(batch_size)
+		# overlapping runs skip the events claimed by another worker
+		.for_update(skip_locked=True)
+	).run(as_dict=True)
+
+
+def materialize_medical_record(reference_doctype, reference_name):
+	"""Create, update or delete the medical record of a document to match its current state"""
+	from healthcare.healthcare.doctype.patient_history_settings.patient_history_settings import (
+		get_patient_history_registry,
+		insert_medical_record,
+		update_medical_record_subject,
+	)
+
+	if reference_doctype not in get_patient_history_registry():
+		return
+
+	record = frappe.db.exists(
+		"Patient Medical Record",
+		{"reference_doctype": reference_doctype, "reference_name": reference_name},
+	)
+	doc = None
+	if frappe.db.exists(reference_doctype, reference_name):
+		doc = frappe.get_doc(reference_doctype, reference_name)
+
+	if not doc or doc.docstatus != 1:
+		if record:
+			frappe.delete_doc("Patient Medical Record", record, force=1, ignore_permissions=True)
+	elif record:
+		update_medical_record_subject(doc, record)
+	else:
+		insert_medical_record(doc)
+
+
+def set_processed(events):
+	if not events:
+		return
+
+	event = frappe.qb.DocType("Patient Medical Record Event")
+	(
+		frappe.qb.update(event)
+		.set(event.status, "Processed")
+		.set(event.error, None)
+		.set(event.retry_after, None)
+		.set(event.modified, now())
+		.where(event.name.isin(events))
+	).run()
+
+
+def set_failed(events):
+	"""Queue failed events again after a growing delay, which also keeps the running job from
+	claiming them straight back, or mark them Failed once out of attempts"""
+	for event, error in events:
+		attempts = event.attempts + 1
+		frappe.db.set_value(
+			"Patient Medical Record Event",
+			event.name,
+			{
+				"attempts": attempts,
+				"status": "Failed" if attempts >= MEDICAL_RECORD_EVENT_MAX_ATTEMPTS else "Queued",
+				"error": error,
+				"retry_after": add_to_date(
+					now(), minutes=MEDICAL_RECORD_EVENT_RETRY_DELAY * 2 ** (attempts - 1)
+				),
+			},
+		)
+
+
+def delete_processed_medical_record_events():
+	"""Drop the processed events past the retention period, failed ones are kept for review"""
+	frappe.db.delete(
+		"Patient Medical Record Event",
+		{
+			"status": "Processed",
+			"modified": ["<", add_days(now(), -MEDICAL_RECORD_EVENT_RETENTION_DAYS)],
+		},
+	)
+
+
+@frappe.whitelist()
+def replay_medical_record_events(from_datetime=None, reference_doctype=None):
+	"""
+	Queue processed and failed events again to rebuild the medical records of their documents
+	:param from_datetime: only replay events recorded since
+	:param reference_doctype: only replay events of this document type
+	"""
+	frappe.only_for("System Manager")
+
+	event = frappe.qb.DocType("Patient Medical Record Event")
+	query = (
+		frappe.qb.update(event)
+		.set(event.status, "Queued")
+		.set(event.attempts, 0)
+		.set(event.retry_after, None)
+		.set(event.modified, now())
+		.where(event.status != "Queued")
+	)
+	if from_datetime:
+		query = query.where(event.creation >= from_datetime)
+	if reference_doctype:
+		query = query.where(event.reference_doctype == reference_doctype)
+	query.run()
+
+	enqueue_medical_record_events()
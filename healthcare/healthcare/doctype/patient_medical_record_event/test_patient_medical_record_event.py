@@ -0,0 +1,104 @@
+# Copyright (c) 2026, healthcare and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, add_to_date, now
+
+from healthcare.healthcare.doctype.patient_appointment.test_patient_appointment import (
+	create_patient,
+)
+from healthcare.healthcare.doctype.patient_history_settings.test_patient_history_settings import (
+	create_custom_doctype,
+	create_doc,
+)
+from healthcare.healthcare.doctype.patient_medical_record_event.patient_medical_record_event import (
+	delete_processed_medical_record_events,
+	process_medical_record_events,
+	replay_medical_record_events,
+)
+
+
+class TestPatientMedicalRecordEvent(FrappeTestCase):
+	def setUp(self):
+		frappe.db.delete("Patient Medical Record Event")
+		dt = create_custom_doctype()
+		settings = frappe.get_single("Patient History Settings")
+		settings.create_medical_records_in_background = 1
+		if dt.name not in [entry.document_type for entry in settings.custom_doctypes]:
+			settings.append(
+				"custom_doctypes",
+				{
+					"document_type": dt.name,
+					"date_fieldname": "date",
+					"selected_fields": json.dumps(
+						[{"label": "Rating", "fieldname": "rating", "fieldtype": "Rating"}]
+					),
+				},
+			)
+		settings.save()
+
+	def tearDown(self):
+		frappe.db.set_single_value("Patient History Settings", "create_medical_records_in_background", 0)
+		frappe.clear_document_cache("Patient History Settings", "Patient History Settings")
+
+	def test_medical_record_events(self):
+		doc = create_doc(create_patient())
+		filters = {"reference_doctype": doc.doctype, "reference_name": doc.name}
+		# the record is only materialized by the worker
+		self.assertFalse(frappe.db.exists("Patient Medical Record", filters))
+		self.assertEqual(
+			frappe.db.get_value("Patient Medical Record Event", filters, "status"), "Queued"
+		)
+
+		process_medical_record_events()
+		self.assertEqual(frappe.db.count("Patient Medical Record", filters), 1)
+		self.assertEqual(
+			frappe.db.get_value("Patient Medical Record Event", filters, "status"), "Processed"
+		)
+
+		# replaying the events leaves a single record
+		replay_medical_record_events(reference_doctype=doc.doctype)
+		process_medical_record_events()
+		self.assertEqual(frappe.db.count("Patient Medical Record", filters), 1)
+
+		doc.cancel()
+		# the change gets an event of its own next to the processed one
+		self.assertEqual(frappe.db.count("Patient Medical Record Event", filters), 2)
+		process_medical_record_events()
+		self.assertFalse(frappe.db.exists("Patient Medical Record", filters))
+
+	def test_event_retry_and_retention(self):
+		doc = create_doc(create_patient())
+		filters = {"reference_doctype": doc.doctype, "reference_name": doc.name}
+		event = frappe.db.get_value("Patient Medical Record Event", filters)
+
+		# an event waiting for its retry is left alone until it is due
+		frappe.db.set_value(
+			"Patient Medical Record Event", event, "retry_after", add_to_date(now(), minutes=5)
+		)
+		process_medical_record_events()
+		self.assertEqual(frappe.db.get_value("Patient Medical Record Event", event, "status"), "Queued")
+
+		frappe.db.set_value(
+			"Patient Medical Record Event", event, "retry_after", add_to_date(now(), minutes=-1)
+		)
+		process_medical_record_events()
+		self.assertEqual(
+			frappe.db.get_value("Patient Medical Record Event", event, "status"), "Processed"
+		)
+
+		# processed events are dropped past the retention period
+		delete_processed_medical_record_events()
+		self.assertTrue(frappe.db.exists("Patient Medical Record Event", event))
+		frappe.db.set_value(
+			"Patient Medical Record Event",
+			event,
+			"modified",
+			add_days(now(), -31),
+			update_modified=False,
+		)
+		delete_processed_medical_record_events()
+		self.assertFalse(frappe.db.exists("Patient Medical Record Event", event))
@@ -3,9 +3,24 @@
 # For license information, please see license.txt
 
 
+import frappe
 from frappe.model.document import Document
 
+from healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy import (
+	enqueue_slot_occupancy_build,
+)
+
 
 class PractitionerSchedule(Document):
 	def autoname(self):
 		self.name = self.schedule_name
+
+	def on_update(self):
+		practitioners = frappe.get_all(
+			"Practitioner Service Unit Schedule",
+			filters={"parenttype": "Healthcare Practitioner", "schedule": self.name},
+			pluck="parent",
+			distinct=True,
+		)
+		if practitioners:
+			enqueue_slot_occupancy_build(practitioners)
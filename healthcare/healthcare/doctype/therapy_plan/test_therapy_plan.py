@@ -18,6 +18,10 @@ from healthcare.healthcare.doctype.therapy_plan.therapy_plan import (
 	make_therapy_session,
 )
 from healthcare.healthcare.doctype.therapy_type.test_therapy_type import create_therapy_type
+from healthcare.healthcare.utils import (
+	get_therapy_plans_to_invoice,
+	get_therapy_sessions_to_invoice,
+)
 
 
 class TestTherapyPlan(FrappeTestCase):
@@ -69,6 +73,35 @@ class TestTherapyPlan(FrappeTestCase):
 		)
 		self.assertEqual(si.items[0].amount, therapy_plan_template_amt)
 
+	def test_therapy_services_to_invoice(self):
+		patient = frappe.get_doc("Patient", create_patient())
+		plan = create_therapy_plan(patient=patient.name)
+		session = frappe.get_doc(
+			make_therapy_session(plan.name, plan.patient, "Basic Rehab", "_Test Company")
+		)
+		session.submit()
+
+		template_plan = create_therapy_plan(create_therapy_plan_template(), patient.name)
+		template_session = frappe.get_doc(
+			make_therapy_session(template_plan.name, plan.patient, "Basic Rehab", "_Test Company")
+		)
+		template_session.submit()
+
+		sessions = [
+			service["reference_name"]
+			for service in get_therapy_sessions_to_invoice(patient, "_Test Company")
+		]
+		self.assertIn(session.name, sessions)
+		# sessions of a plan created from a template are billed with the plan
+		self.assertNotIn(template_session.name, sessions)
+
+		plans = {
+			service["reference_name"]: service["service"]
+			for service in get_therapy_plans_to_invoice(patient, "_Test Company")
+		}
+		self.assertEqual(plans.get(template_plan.name), "Complete Rehab")
+		self.assertNotIn(plan.name, plans)
+
 
 def create_therapy_plan(template=None, patient=None):
 	if not patient:
@@ -19,6 +19,7 @@ from healthcare.healthcare.doctype.nursing_task.nursing_task import NursingTask
 from healthcare.healthcare.doctype.service_request.service_request import (
 	update_service_request_status,
 )
+from healthcare.healthcare.overlap_checker import IntervalIndex, make_interval
 from healthcare.healthcare.utils import validate_nursing_tasks
 
 
@@ -47,39 +48,38 @@ class TherapySession(Document):
 		self.update_sessions_count_in_therapy_plan(on_cancel=True)
 
 	def validate_duplicate(self):
-		end_time = datetime.datetime.combine(
-			getdate(self.start_date), get_time(self.start_time)
-		) + datetime.timedelta(minutes=flt(self.duration))
-
-		overlaps = frappe.db.sql(
-			"""
-		select
-			name
-		from
-			`tabTherapy Session`
-		where
-			start_date=%s and name!=%s and docstatus!=2
-			and (practitioner=%s or patient=%s) and
-			((start_time<%s and start_time + INTERVAL duration MINUTE>%s) or
-			(start_time>%s and start_time<%s) or
-			(start_time=%s))
-		""",
-			(
-				self.start_date,
-				self.name,
-				self.practitioner,
-				self.patient,
-				self.start_time,
-				end_time.time(),
-				self.start_time,
-				end_time.time(),
-				self.start_time,
-			),
+		start_time = datetime.datetime.combine(getdate(self.start_date), get_time(self.start_time))
+		end_time = start_time + datetime.timedelta(minutes=flt(self.duration))
+
+		or_filters = {"practitioner": self.practitioner, "patient": self.patient}
+		sessions = frappe.get_all(
+			"Therapy Session",
+			filters={
+				"start_date": self.start_date,
+				"name": ["!=", self.name],
+				"docstatus": ["!=", 2],
+				"start_time": ["is", "set"],
+			},
+			or_filters={field: value for field, value in or_filters.items() if value},
+			fields=["name", "start_date", "start_time", "duration"],
 		)
 
+		booked = IntervalIndex(
+			[
+				make_interval(
+					datetime.datetime.combine(getdate(session.start_date), get_time(session.start_time)),
+					datetime.datetime.combine(getdate(session.start_date), get_time(session.start_time))
+					+ datetime.timedelta(minutes=flt(session.duration)),
+					name=session.name,
+				)
+				for session in sessions
+			]
+		)
+		overlaps = booked.search(start_time, end_time)
+
 		if overlaps:
 			overlapping_details = _("Therapy Session overlaps with {0}").format(
-				get_link_to_form("Therapy Session", overlaps[0][0])
+				get_link_to_form("Therapy Session", overlaps[0].name)
 			)
 			frappe.throw(overlapping_details, title=_("Therapy Sessions Overlapping"))
 
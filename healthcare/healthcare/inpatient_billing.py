@@ -0,0 +1,140 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import cint, getdate
+
+from healthcare.healthcare.utils import get_occupancy_qty
+
+# doctypes billed against an inpatient record and the date they are billed by
+INPATIENT_BILLABLE_DOCTYPES = {
+	"Patient Appointment": "appointment_date",
+	"Patient Encounter": "encounter_date",
+	"Lab Test": "date",
+	"Clinical Procedure": "start_date",
+}
+
+
+class InpatientBilling:
+	"""
+	Unbilled services of an Inpatient Record collected in one pass, occupancies with their
+	billable quantity and documents pending invoicing. In bill to date mode only services since
+	the last invoice raised for the stay are considered. Medication is billed through the drugs
+	dispensed, not here.
+	"""
+
+	def __init__(self, inpatient_record, bill_to_date=False):
+		if isinstance(inpatient_record, str):
+			inpatient_record = frappe.get_doc("Inpatient Record", inpatient_record)
+
+		self.inpatient_record = inpatient_record
+		self.since = self.get_last_invoice_date() if bill_to_date else None
+
+	def get_unbilled_services(self):
+		return frappe._dict(
+			since=self.since,
+			occupancies=self.get_unbilled_occupancies(),
+			documents=self.get_unbilled_documents(),
+		)
+
+	def get_unbilled_occupancies(self):
+		"""Occupancies in billable service units not invoiced yet, with the quantity to bill
+		for the ones the patient left"""
+		occupancies = [
+			occupancy
+			for occupancy in self.inpatient_record.inpatient_occupancies
+			if not occupancy.invoiced
+			and not (self.since and occupancy.check_out and getdate(occupancy.check_out) < self.since)
+		]
+		if not occupancies:
+			return []
+
+		service_unit = frappe.qb.DocType("Healthcare Service Unit")
+		service_unit_type = frappe.qb.DocType("Healthcare Service Unit Type")
+		service_unit_types = {
+			row.name: row
+			for row in (
+				frappe.qb.from_(service_unit)
+				.inner_join(service_unit_type)
+				.on(service_unit.service_unit_type == service_unit_type.name)
+				.select(
+					service_unit.name,
+					service_unit_type.item,
+					service_unit_type.no_of_hours,
+				)
+				.where(service_unit.name.isin({occupancy.service_unit for occupancy in occupancies}))
+				.where(service_unit_type.is_billable == 1)
+			).run(as_dict=True)
+		}
+
+		unbilled = []
+		for occupancy in occupancies:
+			service_unit_type = service_unit_types.get(occupancy.service_unit)
+			if not service_unit_type:
+				continue
+
+			unbilled.append(
+				frappe._dict(
+					name=occupancy.name,
+					service_unit=occupancy.service_unit,
+					left=cint(occupancy.left),
+					service=service_unit_type.item,
+					qty=get_occupancy_qty(
+						occupancy.check_in, occupancy.check_out, service_unit_type.no_of_hours
+					)
+					if occupancy.left
+					else None,
+				)
+			)
+
+		return unbilled
+
+	def get_unbilled_documents(self):
+		"""Submitted documents of the stay not invoiced yet, by doctype"""
+		queries = []
+		for doctype, date_field in INPATIENT_BILLABLE_DOCTYPES.items():
+			since_condition = f"and `{date_field}` >= %(since)s" if self.since else ""
+			queries.append(
+				f"""
+				select %(doctype_{len(queries)})s as doctype, name
+				from `tab{doctype}`
+				where patient=%(patient)s and inpatient_record=%(inpatient_record)s
+				and docstatus=1 and invoiced=0 {since_condition}
+				"""
+			)
+
+		values = {
+			"patient": self.inpatient_record.patient,
+			"inpatient_record": self.inpatient_record.name,
+			"since": self.since,
+		}
+		values.update(
+			{f"doctype_{idx}": doctype for idx, doctype in enumerate(INPATIENT_BILLABLE_DOCTYPES)}
+		)
+
+		documents = {}
+		for row in frappe.db.sql(" union all ".join(queries), values, as_dict=True):
+			documents.setdefault(row.doctype, []).append(row.name)
+		return documents
+
+	def get_last_invoice_date(self):
+		"""Posting date of the latest submitted invoice billing an occupancy of the stay"""
+		occupancies = [occupancy.name for occupancy in self.inpatient_record.inpatient_occupancies]
+		if not occupancies:
+			return None
+
+		invoice = frappe.qb.DocType("Sales Invoice")
+		invoice_item = frappe.qb.DocType("Sales Invoice Item")
+		last_invoice_date = (
+			frappe.qb.from_(invoice_item)
+			.inner_join(invoice)
+			.on(invoice.name == invoice_item.parent)
+			.select(invoice.posting_date)
+			.where(invoice.docstatus == 1)
+			.where(invoice_item.reference_dt == "Inpatient Occupancy")
+			.where(invoice_item.reference_dn.isin(occupancies))
+			.orderby(invoice.posting_date, order=frappe.qb.desc)
+			.limit(1)
+		).run()
+		return getdate(last_invoice_date[0][0]) if last_invoice_date else None
+
@@ -0,0 +1,382 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+from frappe import _
+from frappe.model.naming import parse_naming_series
+from frappe.utils import cint, flt, getdate, now
+
+from healthcare.healthcare.doctype.patient_activity_count.patient_activity_count import (
+	update_patient_activity,
+)
+from healthcare.healthcare.doctype.patient_history_settings.patient_history_settings import (
+	SubjectFormatter,
+	get_patient_history_registry,
+)
+
+MEDICAL_RECORD_REBUILD_BATCH_SIZE = 500
+
+MEDICAL_RECORD_FIELDS = (
+	"name",
+	"naming_series",
+	"owner",
+	"modified_by",
+	"creation",
+	"modified",
+	"docstatus",
+	"patient",
+	"subject",
+	"status",
+	"communication_date",
+	"reference_doctype",
+	"reference_name",
+	"reference_owner",
+	"user",
+)
+
+
+class MedicalRecordRebuild:
+	"""
+	Brings the Patient Medical Records of the submitted documents of a doctype in line with
+	Patient History Settings. Documents are streamed in name order in batches, optionally
+	within a date range and a name range (after, up to], the missing records of a batch are
+	bulk inserted and the stale ones bulk updated, one commit per batch. Records left behind by
+	documents cancelled or deleted since are removed at the end.
+	"""
+
+	def __init__(
+		self,
+		doctype,
+		from_date=None,
+		to_date=None,
+		after=None,
+		up_to=None,
+		batch_size=None,
+		progress=None,
+	):
+		config = get_patient_history_registry().get(doctype)
+		if not config:
+			frappe.throw(_("{0} is not tracked in Patient History Settings").format(frappe.bold(doctype)))
+
+		self.doctype = doctype
+		self.date_field = config.get("date_fieldname")
+		self.from_date = getdate(from_date) if from_date else None
+		self.to_date = getdate(to_date) if to_date else None
+		self.after = after
+		self.up_to = up_to
+		self.batch_size = cint(batch_size) or MEDICAL_RECORD_REBUILD_BATCH_SIZE
+		self.progress = progress
+		self.formatter = SubjectFormatter(doctype)
+		self.naming_series = (
+			frappe.get_meta("Patient Medical Record").get_field("naming_series").options.split("\n")[0]
+		)
+		self.stats = frappe._dict(
+			doctype=doctype, documents=0, created=0, updated=0, deleted=0, elapsed=0, throughput=0
+		)
+
+	def run(self):
+		started = time.monotonic()
+		for docs in self.get_batches():
+			self.rebuild(docs)
+			frappe.db.commit()
+
+			self.stats.documents += len(docs)
+			self.stats.elapsed = flt(time.monotonic() - started, 2)
+			self.stats.throughput = flt(self.stats.documents / max(self.stats.elapsed, 1e-3), 2)
+			if self.progress:
+				self.progress(self.stats)
+
+		self.delete_orphaned_records()
+		frappe.db.commit()
+
+		frappe.logger("healthcare").info(
+			"Rebuilt medical records of {0}: {1} documents, {2} created, {3} updated, {4} deleted "
+			"in {5}s ({6} documents/s)".format(
+				self.doctype,
+				self.stats.documents,
+				self.stats.created,
+				self.stats.updated,
+				self.stats.deleted,
+				self.stats.elapsed,
+				self.stats.throughput,
+			)
+		)
+		return self.stats
+
+	def get_filters(self):
+		filters = [[self.doctype, "docstatus", "=", 1]]
+		if self.from_date:
+			filters.append([self.doctype, self.date_field, ">=", self.from_date])
+		if self.to_date:
+			# datetime fields hold the whole of the last day
+			filters.append([self.doctype, self.date_field, "<", frappe.utils.add_days(self.to_date, 1)])
+		if self.up_to:
+			filters.append([self.doctype, "name", "<=", self.up_to])
+		return filters
+
+	def get_batches(self):
+		"""Documents in name order, a batch at a time, walked by name rather than by offset"""
+		last_name = self.after
+		while True:
+			filters = self.get_filters()
+			if last_name:
+				filters.append([self.doctype, "name", ">", last_name])
+
+			docs = frappe.get_all(
+				self.doctype,
+				filters=filters,
+				fields=["*"],
+				order_by="name asc",
+				limit_page_length=self.batch_size,
+			)
+			if not docs:
+				break
+
+			self.set_tables(docs)
+			yield docs
+
+			if len(docs) < self.batch_size:
+				break
+			last_name = docs[-1].name
+
+	def set_tables(self, docs):
+		"""Load the rows of the tables shown in the subject for the whole batch at once"""
+		docs_by_name = {doc.name: doc for doc in docs}
+		for fieldname, table in self.formatter.tables.items():
+			for doc in docs:
+				doc[fieldname] = []
+
+			columns = [
+				df.fieldname
+				for df in frappe.get_meta(table.doctype).fields
+				if df.fieldname in table.columns and df.fieldtype not in frappe.model.no_value_fields
+			]
+			for row in frappe.get_all(
+				table.doctype,
+				filters={
+					"parenttype": self.doctype,
+					"parentfield": fieldname,
+					"parent": ["in", list(docs_by_name)],
+				},
+				fields=["parent", *columns],
+				order_by="idx asc",
+			):
+				docs_by_name[row.parent][fieldname].append(row)
+
+	def rebuild(self, docs):
+		records = {
+			record.reference_name: record
+			for record in frappe.get_all(
+				"Patient Medical Record",
+				filters={
+					"reference_doctype": self.doctype,
+					"reference_name": ["in", [doc.name for doc in docs]],
+				},
+				fields=["name", "patient", "reference_name", "subject", "communication_date"],
+			)
+		}
+
+		to_insert, to_update, activity = [], {}, []
+		for doc in docs:
+			subject = self.formatter.format(doc)
+			communication_date = doc.get(self.date_field)
+			communication_date = getdate(communication_date) if communication_date else None
+
+			record = records.get(doc.name)
+			if not record:
+				to_insert.append((doc, subject, communication_date))
+				activity.append((doc.patient, communication_date, 1))
+			elif record.subject != subject or record.communication_date != communication_date:
+				to_update[record.name] = {"subject": subject, "communication_date": communication_date}
+				activity.append((record.patient, record.communication_date, -1))
+				activity.append((record.patient, communication_date, 1))
+
+		if to_insert:
+			self.insert_records(to_insert)
+		if to_update:
+			frappe.db.bulk_update("Patient Medical Record", to_update)
+		# records are written without their controller, which keeps the activity counts
+		update_patient_activity(activity)
+
+		self.stats.created += len(to_insert)
+		self.stats.updated += len(to_update)
+
+	def delete_orphaned_records(self):
+		"""Delete the records in range of documents that are no longer submitted"""
+		record = frappe.qb.DocType("Patient Medical Record")
+		document = frappe.qb.DocType(self.doctype)
+		query = (
+			frappe.qb.from_(record)
+			.left_join(document)
+			.on((document.name == record.reference_name) & (document.docstatus == 1))
+			.select(record.name, record.patient, record.communication_date)
+			.where(record.reference_doctype == self.doctype)
+			.where(document.name.isnull())
+		)
+		if self.from_date:
+			query = query.where(record.communication_date >= self.from_date)
+		if self.to_date:
+			query = query.where(record.communication_date <= self.to_date)
+		if self.after:
+			query = query.where(record.reference_name > self.after)
+		if self.up_to:
+			query = query.where(record.reference_name <= self.up_to)
+
+		records = query.run(as_dict=True)
+		for start in range(0, len(records), self.batch_size):
+			batch = records[start : start + self.batch_size]
+			frappe.db.delete("Patient Medical Record", {"name": ["in", [r.name for r in batch]]})
+		update_patient_activity([(r.patient, r.communication_date, -1) for r in records])
+
+		self.stats.deleted += len(records)
+
+	def insert_records(self, rows):
+		timestamp = now()
+		user = frappe.session.user
+		names = reserve_medical_record_names(self.naming_series, len(rows))
+		frappe.db.bulk_insert(
+			"Patient Medical Record",
+			fields=MEDICAL_RECORD_FIELDS,
+			values=[
+				(
+					name,
+					self.naming_series,
+					user,
+					user,
+					timestamp,
+					timestamp,
+					0,
+					doc.patient,
+					subject,
+					"Open",
+					communication_date,
+					self.doctype,
+					doc.name,
+					doc.owner,
+					user,
+				)
+				for name, (doc, subject, communication_date) in zip(names, rows)
+			],
+		)
+
+
+def reserve_medical_record_names(naming_series, count):
+	"""Take `count` consecutive names of the naming series with a single update of its counter"""
+	prefix, digits, suffix = get_series_parts(naming_series)
+	series = frappe.qb.DocType("Series")
+	current = (
+		frappe.qb.from_(series).select(series.current).where(series.name == prefix).for_update()
+	).run()
+
+	if current and current[0][0] is not None:
+		start = cint(current[0][0])
+		(
+			frappe.qb.update(series).set(series.current, start + count).where(series.name == prefix)
+		).run()
+	else:
+		start = 0
+		frappe.qb.into(series).insert(prefix, count).columns("name", "current").run()
+
+	return [
+		f"{prefix}{number:0{digits}d}{suffix}" for number in range(start + 1, start + count + 1)
+	]
+
+
+def get_series_parts(naming_series):
+	"""
+	Split a naming series the way make_autoname numbers it, the counter is keyed by the parts
+	before the hash pattern and padded to its length
+	:return: (prefix, digits, suffix)
+	"""
+	if "#" not in naming_series:
+		naming_series += ".#####"
+
+	parts = naming_series.split(".")
+	idx = next(idx for idx, part in enumerate(parts) if part.startswith("#"))
+	# parsing the parts around the hash pattern never takes a number from the counter
+	return (
+		parse_naming_series(parts[:idx]),
+		len(parts[idx]),
+		parse_naming_series(parts[idx + 1 :]),
+	)
+
+
+def get_medical_record_doctypes(doctype=None):
+	"""Doctypes tracked in Patient History Settings, `doctype` alone when given"""
+	doctypes = list(get_patient_history_registry())
+	if doctype:
+		if doctype not in doctypes:
+			frappe.throw(_("{0} is not tracked in Patient History Settings").format(frappe.bold(doctype)))
+		doctypes = [doctype]
+	return [dt for dt in doctypes if frappe.get_meta(dt).module == "Healthcare"]
+
+
+def rebuild_medical_records(
+	doctype, from_date=None, to_date=None, after=None, up_to=None, batch_size=None, progress=None
+):
+	return MedicalRecordRebuild(
+		doctype, from_date, to_date, after, up_to, batch_size, progress=progress
+	).run()
+
+
+def get_rebuild_chunks(doctype, from_date=None, to_date=None, workers=1):
+	"""
+	Split the documents to rebuild into `workers` name ranges of about the same size
+	:return: list of (after, up to) names, None for an open end
+	"""
+	rebuild = MedicalRecordRebuild(doctype, from_date, to_date)
+	filters = rebuild.get_filters()
+	total = frappe.db.count(doctype, filters=filters)
+	if not total:
+		# a single chunk still removes the records of cancelled or deleted documents
+		return [(None, None)]
+
+	workers = max(min(cint(workers), total), 1)
+	chunk_size = -(-total // workers)
+
+	bounds = [None]
+	for start in range(chunk_size, total, chunk_size):
+		bounds += frappe.get_all(
+			doctype,
+			filters=filters,
+			pluck="name",
+			order_by="name asc",
+			limit_start=start - 1,
+			limit_page_length=1,
+		)
+	bounds.append(None)
+
+	return list(zip(bounds, bounds[1:]))
+
+
+def enqueue_medical_record_rebuild(
+	doctype=None, from_date=None, to_date=None, workers=1, batch_size=None
+):
+	"""
+	Queue the rebuild of the medical records of `doctype`, or of all the tracked doctypes, as
+	`workers` background jobs per doctype each covering a range of documents
+	:return: the ids of the jobs queued
+	"""
+	job_ids = []
+	for dt in get_medical_record_doctypes(doctype):
+		for idx, (after, up_to) in enumerate(get_rebuild_chunks(dt, from_date, to_date, workers)):
+			job_id = f"rebuild_medical_records::{dt}::{from_date}::{to_date}::{idx}"
+			frappe.enqueue(
+				rebuild_medical_records,
+				queue="long",
+				timeout=6000,
+				job_id=job_id,
+				deduplicate=True,
+				enqueue_after_commit=True,
+				doctype=dt,
+				from_date=from_date,
+				to_date=to_date,
+				after=after,
+				up_to=up_to,
+				batch_size=batch_size,
+			)
+			job_ids.append(job_id)
+
+	return job_ids
@@ -0,0 +1,201 @@
+# Copyright (c) 2026, healthcare and contributors
+# For license information, please see license.txt
+
+import datetime
+from bisect import bisect_left, bisect_right, insort
+
+import frappe
+from frappe.utils import flt, get_datetime, get_time, getdate
+
+# zero duration bookings still block the instant they start at
+MIN_DURATION = datetime.timedelta(seconds=1)
+# longest booking looked back for, range queries seek on appointment_datetime from the window
+# start less this
+MAX_DURATION = datetime.timedelta(days=1)
+
+
+def make_interval(start, end, **data):
+	"""Half-open [start, end) interval carrying the booking details in `data`"""
+	interval = frappe._dict(data)
+	interval.start = start
+	interval.end = max(end, start + MIN_DURATION)
+	return interval
+
+
+class IntervalIndex:
+	"""
+	Half-open intervals kept sorted by start, with their ends sorted separately. An interval
+	overlapping a range starts at most the longest interval length before it, so searches
+	bisect to that window instead of walking a tree rebuilt after every insert. Adding an
+	interval and counting overlaps take O(log n) comparisons, listing them O(log n + w) for
+	the w intervals starting in the window.
+	"""
+
+	def __init__(self, intervals=None):
+		self.intervals = sorted(intervals or [], key=lambda interval: interval.start)
+		self.starts = [interval.start for interval in self.intervals]
+		self.ends = sorted(interval.end for interval in self.intervals)
+		self.max_length = max(
+			(interval.end - interval.start for interval in self.intervals), default=MIN_DURATION
+		)
+
+	def __len__(self):
+		return len(self.intervals)
+
+	def add(self, interval):
+		insort(self.intervals, interval, key=lambda interval: interval.start)
+		insort(self.starts, interval.start)
+		insort(self.ends, interval.end)
+		self.max_length = max(self.max_length, interval.end - interval.start)
+
+	def count(self, start, end):
+		"""Number of intervals overlapping [start, end)"""
+		end = max(end, start + MIN_DURATION)
+		# every interval ending before the range also starts before its end
+		return bisect_left(self.starts, end) - bisect_right(self.ends, start)
+
+	def search(self, start, end):
+		"""Intervals overlapping [start, end), ordered by start"""
+		end = max(end, start + MIN_DURATION)
+		low = bisect_right(self.starts, start - self.max_length)
+		high = bisect_left(self.starts, end)
+		return [interval for interval in self.intervals[low:high] if interval.end > start]
+
+
+class AppointmentOverlapChecker:
+	"""
+	Day-wise index of booked appointments by practitioner, patient and service unit,
+	answers overlap and capacity questions without scanning the bookings
+	"""
+
+	def __init__(self, appointments=None):
+		self.indexes = {}
+		self.booked = set()
+		self.loaded = set()
+		for appointment in appointments or []:
+			self.add(appointment)
+
+	@classmethod
+	def for_day(cls, date, practitioner=None, patient=None, service_unit=None):
+		"""Load open appointments on `date` booked with the practitioner, patient or service unit"""
+		return cls().load(date, practitioner=practitioner, patient=patient, service_unit=service_unit)
+
+	def load(self, date, **filters):
+		"""Load the open appointments on `date` for the given practitioner, patient or service
+		unit unless already loaded, so one checker can be shared across a batch of bookings"""
+		date = getdate(date)
+		pending = {
+			key: value
+			for key, value in filters.items()
+			if value and (date, key, value) not in self.loaded
+		}
+		if pending:
+			for appointment in get_open_appointments(date, **pending):
+				self.add(appointment)
+			self.loaded.update((date, key, value) for key, value in pending.items())
+
+		return self
+
+	def add(self, appointment):
+		if appointment.name in self.booked or appointment.appointment_time is None:
+			return
+
+		self.booked.add(appointment.name)
+		interval = get_appointment_interval(appointment)
+		for key in ("practitioner", "patient", "service_unit"):
+			if appointment.get(key):
+				self.indexes.setdefault((key, appointment.get(key)), IntervalIndex()).add(interval)
+
+	def get_overlaps(self, start, end, exclude=None, **filters):
+		"""Appointments overlapping [start, end) booked with any of the given
+		practitioner, patient or service unit, except the appointment `exclude`"""
+		overlaps = {}
+		for key, value in filters.items():
+			index = self.indexes.get((key, value))
+			if not index:
+				continue
+			for interval in index.search(start, end):
+				if interval.name != exclude:
+					overlaps[interval.name] = interval
+
+		return sorted(overlaps.values(), key=lambda interval: interval.start)
+
+	def count_overlaps(self, start, end, **filters):
+		"""Number of appointments overlapping [start, end) for a single practitioner,
+		patient or service unit filter"""
+		((key, value),) = filters.items()
+		index = self.indexes.get((key, value))
+		return index.count(start, end) if index else 0
+
+
+def get_open_appointments(date, practitioner=None, patient=None, service_unit=None):
+	"""Open appointments overlapping `date` booked with the practitioner, patient or service unit,
+	loaded separately per key so that each load seeks on its (key, appointment_datetime) index"""
+	day_start = datetime.datetime.combine(getdate(date), datetime.time.min)
+	day_end = day_start + datetime.timedelta(days=1)
+
+	appointment = frappe.qb.DocType("Patient Appointment")
+	appointments = {}
+	for field, value in (
+		("practitioner", practitioner),
+		("patient", patient),
+		("service_unit", service_unit),
+	):
+		if not value:
+			continue
+
+		rows = (
+			frappe.qb.from_(appointment)
+			.select(
+				appointment.name,
+				appointment.practitioner,
+				appointment.patient,
+				appointment.service_unit,
+				appointment.appointment_date,
+				appointment.appointment_time,
+				appointment.appointment_datetime,
+				appointment.appointment_end_datetime,
+				appointment.duration,
+			)
+			.where(appointment[field] == value)
+			# bookings running past midnight still overlap the start of the day
+			.where(appointment.appointment_datetime >= day_start - MAX_DURATION)
+			.where(appointment.appointment_datetime < day_end)
+			.where(appointment.appointment_end_datetime > day_start)
+			.where(appointment.status.notin(["Closed", "Cancelled"]))
+		).run(as_dict=True)
+		for row in rows:
+			appointments.setdefault(row.name, row)
+
+	return list(appointments.values())
+
+
+def get_appointment_interval(appointment):
+	if appointment.get("appointment_datetime") and appointment.get("appointment_end_datetime"):
+		start = get_datetime(appointment.appointment_datetime)
+		end = get_datetime(appointment.appointment_end_datetime)
+	else:
+		start = datetime.datetime.combine(
+			getdate(appointment.appointment_date), get_time(appointment.appointment_time)
+		)
+		end = start + datetime.timedelta(minutes=flt(appointment.duration))
+
+	return make_interval(
+		start,
+		end,
+		name=appointment.name,
+		practitioner=appointment.get("practitioner"),
+		patient=appointment.get("patient"),
+		service_unit=appointment.get("service_unit"),
+	)
+
+
+def get_booked_index(appointments):
+	"""IntervalIndex over a list of appointment rows"""
+	return IntervalIndex(
+		[
+			get_appointment_interval(appointment)
+			for appointment in appointments
+			if appointment.appointment_time is not None
+		]
+	)
@@ -17,7 +17,7 @@ class PatientHistory {
 		this.page = wrapper.page;
 		this.sidebar = this.wrapper.find('.layout-side-section');
 		this.main_section = this.wrapper.find('.layout-main-section');
-		this.start = 0;
+		this.cursor = null;
 	}
 
 	show() {
@@ -36,7 +36,7 @@ class PatientHistory {
 				change: () => {
 					me.patient_id = '';
 					if (me.patient_id != patient.get_value() && patient.get_value()) {
-						me.start = 0;
+						me.cursor = null;
 						me.patient_id = patient.get_value();
 						me.make_patient_profile();
 					}
@@ -77,7 +77,7 @@ class PatientHistory {
 					fieldname: 'document_type',
 					placeholder: __('Select Document Type'),
 					change: () => {
-						me.start = 0;
+						me.cursor = null;
 						me.page.main.find('.patient_documents_list').html('');
 						this.setup_documents(doctype_filter.get_value(), date_range_field.get_value());
 					},
@@ -103,7 +103,7 @@ class PatientHistory {
 					change: () => {
 						let selected_date_range = date_range_field.get_value();
 						if (selected_date_range && selected_date_range.length === 2) {
-							me.start = 0;
+							me.cursor = null;
 							me.page.main.find('.patient_documents_list').html('');
 							this.setup_documents(doctype_filter.get_value(), date_range_field.get_value());
 						}
@@ -116,11 +116,15 @@ class PatientHistory {
 	}
 
 	setup_documents(document_types="", selected_date_range="") {
+		this.document_types = document_types;
+		this.selected_date_range = selected_date_range;
+
 		let filters = {
 			name: this.patient_id,
-			start: this.start,
 			page_length: 20
 		};
+		if (this.cursor)
+			filters['cursor'] = JSON.stringify(this.cursor);
 		if (document_types)
 			filters['document_types'] = document_types;
 		if (selected_date_range)
@@ -128,10 +132,11 @@ class PatientHistory {
 
 		let me = this;
 		frappe.call({
-			'method': 'healthcare.healthcare.page.patient_history.patient_history.get_feed',
+			'method': 'healthcare.healthcare.page.patient_history.patient_history.get_feed_page',
 			args: filters,
 			callback: function(r) {
-				let data = r.message;
+				let data = r.message.records;
+				me.cursor = r.message.cursor;
 				if (data.length) {
 					me.add_to_records(data);
 				} else {
@@ -150,10 +155,6 @@ class PatientHistory {
 		let i;
 		for (i=0; i<data.length; i++) {
 			if (data[i].reference_doctype) {
-				let label = '';
-				if (data[i].subject) {
-					label += "<br/>" + data[i].subject;
-				}
 				data[i] = this.add_date_separator(data[i]);
 
 				if (frappe.user_info(data[i].owner).image) {
@@ -193,11 +194,13 @@ class PatientHistory {
 								</span>
 						</div>
 						<div class='frappe-card p-5 mt-3'>
-							<span class='${data[i].reference_name} document-id'>${label}
+							<span class='${data[i].reference_name} document-id'>
+								<div class='document-subject' hidden data-fetched='0'></div>
 							<br>
 								<div align='center'>
 									<a class='btn octicon octicon-chevron-down btn-default btn-xs btn-more'
-										data-doctype='${data[i].reference_doctype}' data-docname='${data[i].reference_name}'>
+										data-doctype='${data[i].reference_doctype}' data-docname='${data[i].reference_name}'
+										data-record='${data[i].name}'>
 									</a>
 								</div>
 							</span>
@@ -212,9 +215,8 @@ class PatientHistory {
 		}
 
 		this.page.main.find('.patient_documents_list').append(details);
-		this.start += data.length;
 
-		if (data.length === 20) {
+		if (this.cursor) {
 			this.page.main.find(".btn-get-records").show();
 		} else {
 			this.page.main.find(".btn-get-records").hide();
@@ -309,7 +311,16 @@ class PatientHistory {
 
 		this.page.main.on('click', '.btn-more', function() {
 			let	doctype = $(this).attr('data-doctype'), docname = $(this).attr('data-docname');
-			if (me.page.main.find('.'+docname).parent().find('.document-html').attr('data-fetched') == '1') {
+			let subject = me.page.main.find('.' + docname).find('.document-subject');
+			// the subject is fetched on the first expand, the whole document on the next one
+			if (subject.attr('data-fetched') == '0') {
+				frappe.xcall(
+					'healthcare.healthcare.page.patient_history.patient_history.get_feed_subject',
+					{name: $(this).attr('data-record')}
+				).then(html => {
+					subject.html(html || '').attr('hidden', false).attr('data-fetched', '1');
+				});
+			} else if (me.page.main.find('.'+docname).parent().find('.document-html').attr('data-fetched') == '1') {
 				me.page.main.find('.'+docname).hide();
 				me.page.main.find('.'+docname).parent().find('.document-html').show();
 			} else {
@@ -354,7 +365,7 @@ class PatientHistory {
 		});
 
 		me.page.main.on('click', '.btn-get-records', function() {
-			this.setup_documents();
+			me.setup_documents(me.document_types, me.selected_date_range);
 		});
 	}
 
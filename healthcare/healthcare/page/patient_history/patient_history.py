@@ -26,6 +26,54 @@ def get_feed(name, document_types=None, date_range=None, start=0, page_length=20
 	return result
 
 
+@frappe.whitelist()
+def get_feed_page(name, document_types=None, date_range=None, cursor=None, page_length=20):
+	"""
+	Get a page of the patient's feed, newest first, without the subjects of the records
+	:param cursor: (communication_date, name) of the last record of the previous page
+	:return: the records and the cursor of the next page, None on the last page
+	"""
+	# a page of no records would never advance the cursor
+	page_length = max(cint(page_length), 1)
+	record = frappe.qb.DocType("Patient Medical Record")
+	query = frappe.qb.get_query(
+		"Patient Medical Record",
+		fields=["name", "owner", "communication_date", "reference_doctype", "reference_name"],
+		filters=get_filters(name, document_types, date_range),
+	)
+
+	if cursor:
+		cursor = frappe._dict(json.loads(cursor) if isinstance(cursor, str) else cursor)
+		# records without a date come last in descending order
+		if cursor.communication_date:
+			query = query.where(
+				(record.communication_date < cursor.communication_date)
+				| ((record.communication_date == cursor.communication_date) & (record.name < cursor.name))
+				| record.communication_date.isnull()
+			)
+		else:
+			query = query.where(record.communication_date.isnull() & (record.name < cursor.name))
+
+	records = (
+		query.orderby(record.communication_date, order=frappe.qb.desc)
+		.orderby(record.name, order=frappe.qb.desc)
+		.limit(page_length)
+	).run(as_dict=True)
+
+	next_cursor = None
+	if len(records) == page_length:
+		next_cursor = {"communication_date": records[-1].communication_date, "name": records[-1].name}
+
+	return {"records": records, "cursor": next_cursor}
+
+
+@frappe.whitelist()
+def get_feed_subject(name):
+	"""Get the subject of a Patient Medical Record, loaded when the record is expanded in the feed"""
+	frappe.has_permission("Patient Medical Record", "read", name, throw=True)
+	return frappe.db.get_value("Patient Medical Record", name, "subject")
+
+
 def get_filters(name, document_types=None, date_range=None):
 	filters = {"patient": name}
 	if document_types:
@@ -59,13 +107,8 @@ def get_feed_for_dt(doctype, docname):
 
 @frappe.whitelist()
 def get_patient_history_doctypes():
-	document_types = []
-	settings = frappe.get_single("Patient History Settings")
-
-	for entry in settings.standard_doctypes:
-		document_types.append(entry.document_type)
-
-	for entry in settings.custom_doctypes:
-		document_types.append(entry.document_type)
+	from healthcare.healthcare.doctype.patient_history_settings.patient_history_settings import (
+		get_patient_history_registry,
+	)
 
-	return document_types
+	return list(get_patient_history_registry())
@@ -24,15 +24,14 @@ def get_patient_heatmap_data(patient, date):
 		frappe.db.sql(
 			"""
 		SELECT
-			unix_timestamp(communication_date), count(*)
+			unix_timestamp(activity_date), record_count
 		FROM
-			`tabPatient Medical Record`
+			`tabPatient Activity Count`
 		WHERE
-			communication_date > subdate(%(date)s, interval 1 year) and
-			communication_date < subdate(%(date)s, interval -1 year) and
+			activity_date > subdate(%(date)s, interval 1 year) and
+			activity_date < subdate(%(date)s, interval -1 year) and
 			patient = %(patient)s
-		GROUP BY communication_date
-		ORDER BY communication_date asc""",
+		ORDER BY activity_date asc""",
 			{"date": date, "patient": patient},
 		)
 	)
@@ -9,15 +9,30 @@ import math
 import frappe
 from erpnext.setup.utils import insert_record
 from frappe import _
-from frappe.utils import cstr, get_link_to_form, rounded, time_diff_in_hours
+from frappe.utils import (
+	cint,
+	cstr,
+	flt,
+	get_link_to_form,
+	getdate,
+	now,
+	rounded,
+	time_diff_in_hours,
+)
 from frappe.utils.formatters import format_value
 
+from healthcare.healthcare.doctype.drug_prescription.drug_prescription import get_drug_quantity
 from healthcare.healthcare.doctype.healthcare_settings.healthcare_settings import (
+	get_cached_lookup,
 	get_income_account,
+	set_cached_lookup,
 )
 from healthcare.healthcare.doctype.lab_test.lab_test import create_multiple
 from healthcare.setup import setup_healthcare
 
+BILLING_RATE_CACHE_KEY = "healthcare_billing_rates"
+ITEM_PRICE_CACHE_KEY = "healthcare_item_prices"
+
 
 @frappe.whitelist()
 def get_healthcare_services_to_invoice(patient, company):
@@ -26,17 +41,53 @@ def get_healthcare_services_to_invoice(patient, company):
 	if patient:
 		validate_customer_created(patient)
 		# Customer validated, build a list of billable services
-		items_to_invoice += get_appointments_to_invoice(patient, company)
-		items_to_invoice += get_encounters_to_invoice(patient, company)
-		items_to_invoice += get_lab_tests_to_invoice(patient, company)
-		items_to_invoice += get_clinical_procedures_to_invoice(patient, company)
-		items_to_invoice += get_inpatient_services_to_invoice(patient, company)
-		items_to_invoice += get_therapy_plans_to_invoice(patient, company)
-		items_to_invoice += get_therapy_sessions_to_invoice(patient, company)
+		context = ServicesToInvoiceContext(company)
+		items_to_invoice += get_appointments_to_invoice(patient, company, context)
+		items_to_invoice += get_encounters_to_invoice(patient, company, context)
+		items_to_invoice += get_lab_tests_to_invoice(patient, company, context)
+		items_to_invoice += get_clinical_procedures_to_invoice(patient, company, context)
+		items_to_invoice += get_inpatient_services_to_invoice(patient, company, context)
+		items_to_invoice += get_therapy_plans_to_invoice(patient, company, context)
+		items_to_invoice += get_therapy_sessions_to_invoice(patient, company, context)
 
 		return items_to_invoice
 
 
+class ServicesToInvoiceContext:
+	"""
+	Lookups shared by the collectors of billable services, Healthcare Settings are read once
+	and masters are fetched in bulk for all the candidates of a collector
+	"""
+
+	def __init__(self, company):
+		self.company = company
+		self.settings = frappe.db.get_value(
+			"Healthcare Settings",
+			None,
+			[
+				"enable_free_follow_ups",
+				"do_not_bill_inpatient_encounters",
+				"clinical_procedure_consumable_item",
+			],
+			as_dict=True,
+		)
+		self.masters = {}
+
+	def get_values(self, doctype, names, fields):
+		"""Rows of `doctype` by name for `names`, fetched in one query and kept for the call"""
+		cache = self.masters.setdefault(doctype, {})
+		missing = list({name for name in names if name and name not in cache})
+		if missing:
+			for row in frappe.get_all(
+				doctype, filters={"name": ["in", missing]}, fields=["name", *fields]
+			):
+				cache[row.name] = row
+			for name in missing:
+				cache.setdefault(name, frappe._dict())
+
+		return cache
+
+
 def validate_customer_created(patient):
 	if not frappe.db.get_value("Patient", patient.name, "customer"):
 		msg = _("Please set a Customer linked to the Patient")
@@ -44,11 +95,21 @@ def validate_customer_created(patient):
 		frappe.throw(msg, title=_("Customer Not Found"))
 
 
-def get_appointments_to_invoice(patient, company):
+def get_appointments_to_invoice(patient, company, context=None):
+	context = context or ServicesToInvoiceContext(company)
 	appointments_to_invoice = []
 	patient_appointments = frappe.get_list(
 		"Patient Appointment",
-		fields="*",
+		fields=[
+			"name",
+			"procedure_template",
+			"practitioner",
+			"company",
+			"department",
+			"service_unit",
+			"appointment_type",
+			"inpatient_record",
+		],
 		filters={
 			"patient": patient.name,
 			"company": company,
@@ -58,12 +119,25 @@ def get_appointments_to_invoice(patient, company):
 		order_by="appointment_date",
 	)
 
+	templates = context.get_values(
+		"Clinical Procedure Template",
+		[appointment.procedure_template for appointment in patient_appointments],
+		["is_billable"],
+	)
+	free_visits = set()
+	if context.settings.enable_free_follow_ups and patient_appointments:
+		free_visits = set(
+			frappe.get_all(
+				"Fee Validity Reference",
+				filters={"appointment": ["in", [appointment.name for appointment in patient_appointments]]},
+				pluck="appointment",
+			)
+		)
+
 	for appointment in patient_appointments:
 		# Procedure Appointments
 		if appointment.procedure_template:
-			if frappe.db.get_value(
-				"Clinical Procedure Template", appointment.procedure_template, "is_billable"
-			):
+			if templates[appointment.procedure_template].is_billable:
 				appointments_to_invoice.append(
 					{
 						"reference_type": "Patient Appointment",
@@ -73,9 +147,7 @@ def get_appointments_to_invoice(patient, company):
 				)
 		# Consultation Appointments, should check fee validity
 		else:
-			if frappe.db.get_single_value(
-				"Healthcare Settings", "enable_free_follow_ups"
-			) and frappe.db.exists("Fee Validity Reference", {"appointment": appointment.name}):
+			if appointment.name in free_visits:
 				continue  # Skip invoicing, fee validty present
 			practitioner_charge = 0
 			income_account = None
@@ -84,7 +156,7 @@ def get_appointments_to_invoice(patient, company):
 				details = get_appointment_billing_item_and_rate(appointment)
 				service_item = details.get("service_item")
 				practitioner_charge = details.get("practitioner_charge")
-				income_account = get_income_account(appointment.practitioner, appointment.company)
+				income_account = get_income_account(appointment.practitioner, company)
 			appointments_to_invoice.append(
 				{
 					"reference_type": "Patient Appointment",
@@ -98,60 +170,58 @@ def get_appointments_to_invoice(patient, company):
 	return appointments_to_invoice
 
 
-def get_encounters_to_invoice(patient, company):
+def get_encounters_to_invoice(patient, company, context=None):
 	if not isinstance(patient, str):
 		patient = patient.name
+	context = context or ServicesToInvoiceContext(company)
 	encounters_to_invoice = []
 	encounters = frappe.get_list(
 		"Patient Encounter",
-		fields=["*"],
+		fields=[
+			"name",
+			"appointment",
+			"practitioner",
+			"company",
+			"appointment_type",
+			"inpatient_record",
+		],
 		filters={"patient": patient, "company": company, "invoiced": False, "docstatus": 1},
 	)
-	if encounters:
-		for encounter in encounters:
-			if not encounter.appointment:
-				practitioner_charge = 0
-				income_account = None
-				service_item = None
-				if encounter.practitioner:
-					if encounter.inpatient_record and frappe.db.get_single_value(
-						"Healthcare Settings", "do_not_bill_inpatient_encounters"
-					):
-						continue
-
-					details = get_appointment_billing_item_and_rate(encounter)
-					service_item = details.get("service_item")
-					practitioner_charge = details.get("practitioner_charge")
-					income_account = get_income_account(encounter.practitioner, encounter.company)
-
-				encounters_to_invoice.append(
-					{
-						"reference_type": "Patient Encounter",
-						"reference_name": encounter.name,
-						"service": service_item,
-						"rate": practitioner_charge,
-						"income_account": income_account,
-					}
-				)
+	for encounter in encounters:
+		if not encounter.appointment:
+			practitioner_charge = 0
+			income_account = None
+			service_item = None
+			if encounter.practitioner:
+				if encounter.inpatient_record and context.settings.do_not_bill_inpatient_encounters:
+					continue
+
+				details = get_appointment_billing_item_and_rate(encounter)
+				service_item = details.get("service_item")
+				practitioner_charge = details.get("practitioner_charge")
+				income_account = get_income_account(encounter.practitioner, company)
+
+			encounters_to_invoice.append(
+				{
+					"reference_type": "Patient Encounter",
+					"reference_name": encounter.name,
+					"service": service_item,
+					"rate": practitioner_charge,
+					"income_account": income_account,
+				}
+			)
 
 	return encounters_to_invoice
 
 
-def get_lab_tests_to_invoice(patient, company):
+def get_lab_tests_to_invoice(patient, company, context=None):
+	context = context or ServicesToInvoiceContext(company)
 	lab_tests_to_invoice = []
 	lab_tests = frappe.get_list(
 		"Lab Test",
 		fields=["name", "template"],
 		filters={"patient": patient.name, "company": company, "invoiced": False, "docstatus": 1},
 	)
-	for lab_test in lab_tests:
-		item, is_billable = frappe.get_cached_value(
-			"Lab Test Template", lab_test.template, ["item", "is_billable"]
-		)
-		if is_billable:
-			lab_tests_to_invoice.append(
-				{"reference_type": "Lab Test", "reference_name": lab_test.name, "service": item}
-			)
 
 	lab_prescriptions = frappe.db.sql(
 		"""
@@ -169,33 +239,87 @@ def get_lab_tests_to_invoice(patient, company):
 		as_dict=1,
 	)
 
+	templates = context.get_values(
+		"Lab Test Template",
+		[lab_test.template for lab_test in lab_tests]
+		+ [prescription.lab_test_code for prescription in lab_prescriptions],
+		["item", "is_billable"],
+	)
+
+	for lab_test in lab_tests:
+		template = templates.get(lab_test.template) or frappe._dict()
+		if template.is_billable:
+			lab_tests_to_invoice.append(
+				{"reference_type": "Lab Test", "reference_name": lab_test.name, "service": template.item}
+			)
+
 	for prescription in lab_prescriptions:
-		item, is_billable = frappe.get_cached_value(
-			"Lab Test Template", prescription.lab_test_code, ["item", "is_billable"]
-		)
-		if prescription.lab_test_code and is_billable:
+		template = templates.get(prescription.lab_test_code) or frappe._dict()
+		if prescription.lab_test_code and template.is_billable:
 			lab_tests_to_invoice.append(
-				{"reference_type": "Lab Prescription", "reference_name": prescription.name, "service": item}
+				{
+					"reference_type": "Lab Prescription",
+					"reference_name": prescription.name,
+					"service": template.item,
+				}
 			)
 
 	return lab_tests_to_invoice
 
 
-def get_clinical_procedures_to_invoice(patient, company):
+def get_clinical_procedures_to_invoice(patient, company, context=None):
+	context = context or ServicesToInvoiceContext(company)
 	clinical_procedures_to_invoice = []
 	procedures = frappe.get_list(
 		"Clinical Procedure",
-		fields="*",
+		fields=[
+			"name",
+			"appointment",
+			"procedure_template",
+			"invoice_separately_as_consumables",
+			"consume_stock",
+			"status",
+			"consumption_invoiced",
+			"consumable_total_amount",
+			"consumption_details",
+		],
 		filters={"patient": patient.name, "company": company, "invoiced": False},
 	)
+
+	procedure_prescriptions = frappe.db.sql(
+		"""
+			SELECT
+				pp.name, pp.procedure
+			FROM
+				`tabPatient Encounter` et, `tabProcedure Prescription` pp
+			WHERE
+				et.patient=%s
+				and pp.parent=et.name
+				and pp.procedure_created=0
+				and pp.invoiced=0
+				and pp.appointment_booked=0
+		""",
+		(patient.name),
+		as_dict=1,
+	)
+
+	templates = context.get_values(
+		"Clinical Procedure Template",
+		[procedure.procedure_template for procedure in procedures]
+		+ [prescription.procedure for prescription in procedure_prescriptions],
+		["item", "is_billable"],
+	)
+
 	for procedure in procedures:
 		if not procedure.appointment:
-			item, is_billable = frappe.get_cached_value(
-				"Clinical Procedure Template", procedure.procedure_template, ["item", "is_billable"]
-			)
-			if procedure.procedure_template and is_billable:
+			template = templates.get(procedure.procedure_template) or frappe._dict()
+			if procedure.procedure_template and template.is_billable:
 				clinical_procedures_to_invoice.append(
-					{"reference_type": "Clinical Procedure", "reference_name": procedure.name, "service": item}
+					{
+						"reference_type": "Clinical Procedure",
+						"reference_name": procedure.name,
+						"service": template.item,
+					}
 				)
 
 		# consumables
@@ -205,9 +329,7 @@ def get_clinical_procedures_to_invoice(patient, company):
 			and procedure.status == "Completed"
 			and not procedure.consumption_invoiced
 		):
-			service_item = frappe.db.get_single_value(
-				"Healthcare Settings", "clinical_procedure_consumable_item"
-			)
+			service_item = context.settings.clinical_procedure_consumable_item
 			if not service_item:
 				frappe.throw(
 					_("Please configure Clinical Procedure Consumable Item in {0}").format(
@@ -226,47 +348,30 @@ def get_clinical_procedures_to_invoice(patient, company):
 				}
 			)
 
-	procedure_prescriptions = frappe.db.sql(
-		"""
-			SELECT
-				pp.name, pp.procedure
-			FROM
-				`tabPatient Encounter` et, `tabProcedure Prescription` pp
-			WHERE
-				et.patient=%s
-				and pp.parent=et.name
-				and pp.procedure_created=0
-				and pp.invoiced=0
-				and pp.appointment_booked=0
-		""",
-		(patient.name),
-		as_dict=1,
-	)
-
 	for prescription in procedure_prescriptions:
-		item, is_billable = frappe.get_cached_value(
-			"Clinical Procedure Template", prescription.procedure, ["item", "is_billable"]
-		)
-		if is_billable:
+		template = templates.get(prescription.procedure) or frappe._dict()
+		if template.is_billable:
 			clinical_procedures_to_invoice.append(
 				{
 					"reference_type": "Procedure Prescription",
 					"reference_name": prescription.name,
-					"service": item,
+					"service": template.item,
 				}
 			)
 
 	return clinical_procedures_to_invoice
 
 
-def get_inpatient_services_to_invoice(patient, company):
+def get_inpatient_services_to_invoice(patient, company, context=None):
+	context = context or ServicesToInvoiceContext(company)
 	services_to_invoice = []
 	inpatient_services = frappe.db.sql(
 		"""
 			SELECT
-				io.*
+				io.name, io.check_in, io.check_out, hsu.service_unit_type
 			FROM
 				`tabInpatient Record` ip, `tabInpatient Occupancy` io
+				LEFT JOIN `tabHealthcare Service Unit` hsu on hsu.name=io.service_unit
 			WHERE
 				ip.patient=%s
 				and ip.company=%s
@@ -278,38 +383,50 @@ def get_inpatient_services_to_invoice(patient, company):
 		as_dict=1,
 	)
 
+	service_unit_types = context.get_values(
+		"Healthcare Service Unit Type",
+		[inpatient_occupancy.service_unit_type for inpatient_occupancy in inpatient_services],
+		["is_billable", "no_of_hours", "item"],
+	)
+
 	for inpatient_occupancy in inpatient_services:
-		service_unit_type = frappe.db.get_value(
-			"Healthcare Service Unit", inpatient_occupancy.service_unit, "service_unit_type"
-		)
-		service_unit_type = frappe.get_cached_doc("Healthcare Service Unit Type", service_unit_type)
+		service_unit_type = service_unit_types.get(inpatient_occupancy.service_unit_type)
 		if service_unit_type and service_unit_type.is_billable:
-			hours_occupied = time_diff_in_hours(inpatient_occupancy.check_out, inpatient_occupancy.check_in)
-			qty = 0.5
-			if hours_occupied > 0:
-				actual_qty = hours_occupied / service_unit_type.no_of_hours
-				floor = math.floor(actual_qty)
-				decimal_part = actual_qty - floor
-				if decimal_part > 0.5:
-					qty = rounded(floor + 1, 1)
-				elif decimal_part < 0.5 and decimal_part > 0:
-					qty = rounded(floor + 0.5, 1)
-				if qty <= 0:
-					qty = 0.5
 			services_to_invoice.append(
 				{
 					"reference_type": "Inpatient Occupancy",
 					"reference_name": inpatient_occupancy.name,
 					"service": service_unit_type.item,
-					"qty": qty,
+					"qty": get_occupancy_qty(
+						inpatient_occupancy.check_in,
+						inpatient_occupancy.check_out,
+						service_unit_type.no_of_hours,
+					),
 				}
 			)
 
 	return services_to_invoice
 
 
-def get_therapy_plans_to_invoice(patient, company):
-	therapy_plans_to_invoice = []
+def get_occupancy_qty(check_in, check_out, no_of_hours):
+	"""Billable quantity of an occupancy, rounded up to half units of `no_of_hours`"""
+	hours_occupied = time_diff_in_hours(check_out, check_in)
+	qty = 0.5
+	if hours_occupied > 0:
+		actual_qty = hours_occupied / no_of_hours
+		floor = math.floor(actual_qty)
+		decimal_part = actual_qty - floor
+		if decimal_part > 0.5:
+			qty = rounded(floor + 1, 1)
+		elif decimal_part < 0.5 and decimal_part > 0:
+			qty = rounded(floor + 0.5, 1)
+		if qty <= 0:
+			qty = 0.5
+	return qty
+
+
+def get_therapy_plans_to_invoice(patient, company, context=None):
+	context = context or ServicesToInvoiceContext(company)
 	therapy_plans = frappe.get_list(
 		"Therapy Plan",
 		fields=["therapy_plan_template", "name"],
@@ -317,54 +434,60 @@ def get_therapy_plans_to_invoice(patient, company):
 			"patient": patient.name,
 			"invoiced": 0,
 			"company": company,
-			"therapy_plan_template": ("!=", ""),
+			"therapy_plan_template": ("is", "set"),
 		},
 	)
-	for plan in therapy_plans:
-		therapy_plans_to_invoice.append(
-			{
-				"reference_type": "Therapy Plan",
-				"reference_name": plan.name,
-				"service": frappe.db.get_value(
-					"Therapy Plan Template", plan.therapy_plan_template, "linked_item"
-				),
-			}
-		)
-
-	return therapy_plans_to_invoice
+	templates = context.get_values(
+		"Therapy Plan Template",
+		[plan.therapy_plan_template for plan in therapy_plans],
+		["linked_item"],
+	)
 
+	return [
+		{
+			"reference_type": "Therapy Plan",
+			"reference_name": plan.name,
+			"service": templates[plan.therapy_plan_template].linked_item,
+		}
+		for plan in therapy_plans
+	]
 
-def get_therapy_sessions_to_invoice(patient, company):
-	therapy_sessions_to_invoice = []
-	therapy_plans = frappe.db.get_all("Therapy Plan", {"therapy_plan_template": ("!=", "")})
-	therapy_plans_created_from_template = []
-	for entry in therapy_plans:
-		therapy_plans_created_from_template.append(entry.name)
 
+def get_therapy_sessions_to_invoice(patient, company, context=None):
+	"""Sessions billed on their own, sessions booked through an appointment or of a plan
+	created from a template are billed with the appointment or the plan"""
+	context = context or ServicesToInvoiceContext(company)
 	therapy_sessions = frappe.get_list(
 		"Therapy Session",
-		fields="*",
+		fields=["name", "therapy_plan", "therapy_type"],
 		filters={
 			"patient": patient.name,
 			"invoiced": 0,
 			"company": company,
-			"therapy_plan": ("not in", therapy_plans_created_from_template),
+			"appointment": ("is", "not set"),
 		},
 	)
-	for therapy in therapy_sessions:
-		if not therapy.appointment:
-			if therapy.therapy_type and frappe.db.get_value(
-				"Therapy Type", therapy.therapy_type, "is_billable"
-			):
-				therapy_sessions_to_invoice.append(
-					{
-						"reference_type": "Therapy Session",
-						"reference_name": therapy.name,
-						"service": frappe.db.get_value("Therapy Type", therapy.therapy_type, "item"),
-					}
-				)
+	# only the plans of these sessions are looked up, not every plan created from a template
+	therapy_plans = context.get_values(
+		"Therapy Plan",
+		[therapy.therapy_plan for therapy in therapy_sessions],
+		["therapy_plan_template"],
+	)
+	therapy_types = context.get_values(
+		"Therapy Type", [therapy.therapy_type for therapy in therapy_sessions], ["is_billable", "item"]
+	)
 
-	return therapy_sessions_to_invoice
+	return [
+		{
+			"reference_type": "Therapy Session",
+			"reference_name": therapy.name,
+			"service": therapy_types[therapy.therapy_type].item,
+		}
+		for therapy in therapy_sessions
+		if therapy.therapy_type
+		and therapy_types[therapy.therapy_type].is_billable
+		and not (therapy.therapy_plan and therapy_plans[therapy.therapy_plan].therapy_plan_template)
+	]
 
 
 @frappe.whitelist()
@@ -380,14 +503,52 @@ def get_appointment_billing_item_and_rate(doc):
 
 	is_inpatient = doc.inpatient_record
 
-	if doc.get("practitioner"):
+	service_item, practitioner_charge = get_billing_rate(
+		doc.get("practitioner"),
+		doc.get("appointment_type"),
+		department if department else service_unit,
+		bool(is_inpatient),
+	)
+
+	if not service_item:
+		throw_config_service_item(is_inpatient)
+
+	if not practitioner_charge and doc.get("practitioner"):
+		throw_config_practitioner_charge(is_inpatient, doc.practitioner)
+
+	if not practitioner_charge and not doc.get("practitioner"):
+		throw_config_appointment_type_charge(is_inpatient, doc.appointment_type)
+
+	return {"service_item": service_item, "practitioner_charge": practitioner_charge}
+
+
+def get_billing_rate(practitioner, appointment_type, dep_su, is_inpatient):
+	"""
+	Get the service item and charge of a visit from the practitioner, the appointment type or
+	Healthcare Settings, cached for the site until one of them changes
+	:return: (service_item, practitioner_charge)
+	"""
+	key = frappe.as_json([practitioner, appointment_type, dep_su, is_inpatient], indent=None)
+	billing_rate = get_cached_lookup(BILLING_RATE_CACHE_KEY, key)
+	if billing_rate is None:
+		billing_rate = resolve_billing_rate(practitioner, appointment_type, dep_su, is_inpatient)
+		set_cached_lookup(BILLING_RATE_CACHE_KEY, key, billing_rate)
+
+	return tuple(billing_rate)
+
+
+def resolve_billing_rate(practitioner, appointment_type, dep_su, is_inpatient):
+	service_item = None
+	practitioner_charge = None
+
+	if practitioner:
 		service_item, practitioner_charge = get_practitioner_billing_details(
-			doc.practitioner, is_inpatient
+			practitioner, is_inpatient
 		)
 
-	if not service_item and doc.get("appointment_type"):
+	if not service_item and appointment_type:
 		service_item, appointment_charge = get_appointment_type_billing_details(
-			doc.appointment_type, department if department else service_unit, is_inpatient
+			appointment_type, dep_su, is_inpatient
 		)
 		if not practitioner_charge:
 			practitioner_charge = appointment_charge
@@ -395,16 +556,12 @@ def get_appointment_billing_item_and_rate(doc):
 	if not service_item:
 		service_item = get_healthcare_service_item(is_inpatient)
 
-	if not service_item:
-		throw_config_service_item(is_inpatient)
-
-	if not practitioner_charge and doc.get("practitioner"):
-		throw_config_practitioner_charge(is_inpatient, doc.practitioner)
+	return service_item, practitioner_charge
 
-	if not practitioner_charge and not doc.get("practitioner"):
-		throw_config_appointment_type_charge(is_inpatient, doc.appointment_type)
 
-	return {"service_item": service_item, "practitioner_charge": practitioner_charge}
+def clear_billing_rate_cache(doc=None, method=None):
+	"""Clear the cached billing rates when a practitioner, appointment type or the settings change"""
+	frappe.cache().delete_value(BILLING_RATE_CACHE_KEY)
 
 
 def get_appointment_type_billing_details(appointment_type, dep_su, is_inpatient):
@@ -500,10 +657,7 @@ def manage_invoice_submit_cancel(doc, method):
 		return
 
 	if doc.items:
-		for item in doc.items:
-			if item.get("reference_dt") and item.get("reference_dn"):
-				if frappe.get_meta(item.reference_dt).has_field("invoiced"):
-					set_invoiced(item, method, doc.name)
+		set_invoiced_references(doc.items, method)
 
 	if method == "on_submit":
 		if frappe.db.get_single_value("Healthcare Settings", "create_lab_test_on_si_submit"):
@@ -514,79 +668,116 @@ def manage_invoice_submit_cancel(doc, method):
 			and frappe.db.get_single_value("Healthcare Settings", "enable_free_follow_ups")
 			and doc.items
 		):
-			for item in doc.items:
-				if item.reference_dt == "Patient Appointment":
-					fee_validity = frappe.db.exists("Fee Validity", {"patient_appointment": item.reference_dn})
-					if fee_validity:
-						frappe.db.set_value("Fee Validity", fee_validity, "sales_invoice_ref", doc.name)
+			appointments = [
+				item.reference_dn for item in doc.items if item.reference_dt == "Patient Appointment"
+			]
+			if appointments:
+				fee_validity = frappe.qb.DocType("Fee Validity")
+				(
+					frappe.qb.update(fee_validity)
+					.set(fee_validity.sales_invoice_ref, doc.name)
+					.set(fee_validity.modified, now())
+					.where(fee_validity.patient_appointment.isin(appointments))
+				).run()
 
 
 def set_invoiced(item, method, ref_invoice=None):
-	invoiced = False
-	if method == "on_submit":
-		validate_invoiced_on_submit(item)
-		invoiced = True
+	set_invoiced_references([item], method)
 
-	if item.reference_dt == "Clinical Procedure":
-		service_item = frappe.db.get_single_value(
-			"Healthcare Settings", "clinical_procedure_consumable_item"
-		)
-		if service_item == item.item_code:
-			frappe.db.set_value(item.reference_dt, item.reference_dn, "consumption_invoiced", invoiced)
-		else:
-			frappe.db.set_value(item.reference_dt, item.reference_dn, "invoiced", invoiced)
-	else:
-		frappe.db.set_value(item.reference_dt, item.reference_dn, "invoiced", invoiced)
 
-	if item.reference_dt == "Patient Appointment":
-		if frappe.db.get_value("Patient Appointment", item.reference_dn, "procedure_template"):
-			dt_from_appointment = "Clinical Procedure"
-		else:
-			dt_from_appointment = "Patient Encounter"
-		manage_doc_for_appointment(dt_from_appointment, item.reference_dn, invoiced)
+def set_invoiced_references(items, method):
+	"""
+	Set the invoiced flags of the documents referenced by Sales Invoice `items` and of the
+	documents created from them, with one statement per doctype
+	"""
+	invoiced = method == "on_submit"
+	consumable_item = frappe.db.get_single_value(
+		"Healthcare Settings", "clinical_procedure_consumable_item"
+	)
 
-	elif item.reference_dt == "Lab Prescription":
-		manage_prescriptions(
-			invoiced, item.reference_dt, item.reference_dn, "Lab Test", "lab_test_created"
-		)
+	# (doctype, invoiced field) -> referenced names
+	references = {}
+	for item in items:
+		if not (item.get("reference_dt") and item.get("reference_dn")):
+			continue
+		if not frappe.get_meta(item.reference_dt).has_field("invoiced"):
+			continue
 
-	elif item.reference_dt == "Procedure Prescription":
-		manage_prescriptions(
-			invoiced, item.reference_dt, item.reference_dn, "Clinical Procedure", "procedure_created"
-		)
+		fieldname = "invoiced"
+		if item.reference_dt == "Clinical Procedure" and item.item_code == consumable_item:
+			fieldname = "consumption_invoiced"
+
+		names = references.setdefault((item.reference_dt, fieldname), [])
+		# a document billed by two lines of the invoice is invoiced twice
+		if invoiced and item.reference_dn in names:
+			frappe.throw(
+				_("The item referenced by {0} - {1} is already invoiced").format(
+					item.reference_dt, item.reference_dn
+				)
+			)
+		names.append(item.reference_dn)
 
+	if invoiced:
+		validate_invoiced_on_submit(references)
 
-def validate_invoiced_on_submit(item):
-	if (
-		item.reference_dt == "Clinical Procedure"
-		and frappe.db.get_single_value("Healthcare Settings", "clinical_procedure_consumable_item")
-		== item.item_code
+	for (doctype, fieldname), names in references.items():
+		update_invoiced(doctype, fieldname, invoiced, {"name": names})
+
+	appointments = references.get(("Patient Appointment", "invoiced"))
+	if appointments:
+		procedure_appointments = frappe.get_all(
+			"Patient Appointment",
+			filters={"name": ["in", appointments], "procedure_template": ["is", "set"]},
+			pluck="name",
+		)
+		encounter_appointments = list(set(appointments) - set(procedure_appointments))
+		for doctype, names in (
+			("Clinical Procedure", procedure_appointments),
+			("Patient Encounter", encounter_appointments),
+		):
+			if names:
+				update_invoiced(doctype, "invoiced", invoiced, {"appointment": names})
+
+	for prescription_dt, created_check_field, doctype in (
+		("Lab Prescription", "lab_test_created", "Lab Test"),
+		("Procedure Prescription", "procedure_created", "Clinical Procedure"),
 	):
-		is_invoiced = frappe.db.get_value(item.reference_dt, item.reference_dn, "consumption_invoiced")
-	else:
-		is_invoiced = frappe.db.get_value(item.reference_dt, item.reference_dn, "invoiced")
-	if is_invoiced:
-		frappe.throw(
-			_("The item referenced by {0} - {1} is already invoiced").format(
-				item.reference_dt, item.reference_dn
-			)
+		prescriptions = references.get((prescription_dt, "invoiced"))
+		if not prescriptions:
+			continue
+
+		# documents created for the prescriptions
+		created = frappe.get_all(
+			prescription_dt,
+			filters={"name": ["in", prescriptions], created_check_field: 1},
+			pluck="name",
 		)
+		if created:
+			update_invoiced(doctype, "invoiced", invoiced, {"prescription": created})
 
 
-def manage_prescriptions(invoiced, ref_dt, ref_dn, dt, created_check_field):
-	created = frappe.db.get_value(ref_dt, ref_dn, created_check_field)
-	if created:
-		# Fetch the doc created for the prescription
-		doc_created = frappe.db.get_value(dt, {"prescription": ref_dn})
-		frappe.db.set_value(dt, doc_created, "invoiced", invoiced)
+def validate_invoiced_on_submit(references):
+	for (doctype, fieldname), names in references.items():
+		invoiced = frappe.get_all(
+			doctype, filters={"name": ["in", names], fieldname: 1}, pluck="name", limit=1
+		)
+		if invoiced:
+			frappe.throw(
+				_("The item referenced by {0} - {1} is already invoiced").format(doctype, invoiced[0])
+			)
 
 
-def manage_doc_for_appointment(dt_from_appointment, appointment, invoiced):
-	dn_from_appointment = frappe.db.get_value(
-		dt_from_appointment, filters={"appointment": appointment}
+def update_invoiced(doctype, fieldname, invoiced, filters):
+	table = frappe.qb.DocType(doctype)
+	query = (
+		frappe.qb.update(table)
+		.set(table[fieldname], cint(invoiced))
+		.set(table.modified, now())
+		.set(table.modified_by, frappe.session.user)
 	)
-	if dn_from_appointment:
-		frappe.db.set_value(dt_from_appointment, dn_from_appointment, "invoiced", invoiced)
+	for field, values in filters.items():
+		query = query.where(table[field].isin(values))
+	query.run()
 
 
 @frappe.whitelist()
@@ -596,25 +787,246 @@ def get_drugs_to_invoice(encounter):
 		patient = frappe.get_doc("Patient", encounter.patient)
 		if patient:
 			if patient.customer:
-				items_to_invoice = []
-				for drug_line in encounter.drug_prescription:
-					if drug_line.drug_code:
-						qty = 1
-						if frappe.db.get_value("Item", drug_line.drug_code, "stock_uom") == "Nos":
-							qty = drug_line.get_quantity()
-
-						description = ""
-						if drug_line.dosage and drug_line.period:
-							description = _("{0} for {1}").format(drug_line.dosage, drug_line.period)
-
-						items_to_invoice.append(
-							{"drug_code": drug_line.drug_code, "quantity": qty, "description": description}
-						)
-				return items_to_invoice
+				return [
+					{
+						"drug_code": drug.drug_code,
+						"quantity": drug.quantity,
+						"description": drug.description,
+					}
+					for drug in get_drug_lines_to_invoice([encounter.name]).get(encounter.name, [])
+				]
 			else:
 				validate_customer_created(patient)
 
 
+@frappe.whitelist()
+def get_drugs_to_invoice_for_encounters(encounters, price_list=None):
+	"""
+	Get the drugs prescribed in many submitted encounters grouped into one invoice per patient
+	:param encounters: list of Patient Encounter names, or its JSON
+	:param price_list: selling Price List to rate the drugs with, defaults to the one in Selling Settings
+	:return: dict with the invoice payloads and the patients that have no customer to bill
+	"""
+	if isinstance(encounters, str):
+		encounters = json.loads(encounters)
+
+	encounters = frappe.get_list(
+		"Patient Encounter",
+		filters={"name": ["in", encounters], "docstatus": 1},
+		fields=["name", "patient", "company"],
+		order_by="encounter_date, name",
+	)
+	drug_lines = get_drug_lines_to_invoice([encounter.name for encounter in encounters])
+	customers = dict(
+		frappe.get_all(
+			"Patient",
+			filters={"name": ["in", list({encounter.patient for encounter in encounters})]},
+			fields=["name", "customer"],
+			as_list=True,
+		)
+	)
+	rates = get_item_price_rates(
+		[drug.drug_code for drugs in drug_lines.values() for drug in drugs],
+		get_selling_price_list(price_list),
+	)
+
+	invoices = {}
+	missing_customer = []
+	for encounter in encounters:
+		if not drug_lines.get(encounter.name):
+			continue
+		if not customers.get(encounter.patient):
+			if encounter.patient not in missing_customer:
+				missing_customer.append(encounter.patient)
+			continue
+
+		invoice = invoices.setdefault(
+			(encounter.patient, encounter.company),
+			{
+				"patient": encounter.patient,
+				"customer": customers[encounter.patient],
+				"company": encounter.company,
+				"encounters": [],
+				"items": [],
+			},
+		)
+		invoice["encounters"].append(encounter.name)
+		for drug in drug_lines[encounter.name]:
+			rate = rates.get(drug.drug_code, 0)
+			invoice["items"].append(
+				{
+					"item_code": drug.drug_code,
+					"item_name": drug.item_name,
+					"uom": drug.uom,
+					"qty": drug.quantity,
+					"rate": rate,
+					"amount": flt(rate) * flt(drug.quantity),
+					"description": drug.description,
+					# the prescription rows carry no invoiced flag, billing the drugs leaves the
+					# encounter free to be invoiced for the consultation, or already invoiced
+					"reference_dt": "Drug Prescription",
+					"reference_dn": drug.name,
+				}
+			)
+
+	return {"invoices": list(invoices.values()), "missing_customer": missing_customer}
+
+
+def get_drug_lines_to_invoice(encounters):
+	"""Drug prescription lines of `encounters` with the quantity and description to invoice,
+	dosages, durations and items are fetched once for all the lines"""
+	if not encounters:
+		return {}
+
+	drug_lines = frappe.get_all(
+		"Drug Prescription",
+		filters={
+			"parenttype": "Patient Encounter",
+			"parentfield": "drug_prescription",
+			"parent": ["in", encounters],
+			"drug_code": ["is", "set"],
+		},
+		fields=["name", "parent", "drug_code", "dosage", "period", "interval", "interval_uom"],
+		order_by="parent, idx",
+	)
+	if not drug_lines:
+		return {}
+
+	items = {
+		item.name: item
+		for item in frappe.get_all(
+			"Item",
+			filters={"name": ["in", list({drug.drug_code for drug in drug_lines})]},
+			fields=["name", "item_name", "stock_uom"],
+		)
+	}
+	dosage_strengths = dict(
+		frappe.get_all(
+			"Dosage Strength",
+			filters={
+				"parenttype": "Prescription Dosage",
+				"parent": ["in", list({drug.dosage for drug in drug_lines if drug.dosage})],
+			},
+			fields=["parent", "sum(strength) as strength"],
+			group_by="parent",
+			as_list=True,
+		)
+	)
+	periods = {
+		period.name: frappe.get_doc(dict(period, doctype="Prescription Duration"))
+		for period in frappe.get_all(
+			"Prescription Duration",
+			filters={"name": ["in", list({drug.period for drug in drug_lines if drug.period})]},
+			fields=["name", "number", "period"],
+		)
+	}
+
+	lines = {}
+	for drug in drug_lines:
+		item = items.get(drug.drug_code) or frappe._dict()
+		qty = 1
+		if item.stock_uom == "Nos":
+			qty = get_drug_quantity(drug, dosage_strengths.get(drug.dosage), periods.get(drug.period))
+
+		description = ""
+		if drug.dosage and drug.period:
+			description = _("{0} for {1}").format(drug.dosage, drug.period)
+
+		lines.setdefault(drug.parent, []).append(
+			frappe._dict(
+				name=drug.name,
+				drug_code=drug.drug_code,
+				item_name=item.item_name,
+				uom=item.stock_uom,
+				quantity=qty,
+				description=description,
+			)
+		)
+
+	return lines
+
+
+def get_selling_price_list(price_list=None):
+	return (
+		price_list
+		or frappe.db.get_single_value("Selling Settings", "selling_price_list")
+		or frappe.db.get_value("Price List", {"selling": 1})
+	)
+
+
+def get_item_price_rates(item_codes, price_list):
+	"""
+	Get the rates of `item_codes` from the prices of `price_list` not specific to a customer,
+	in the stock UOM and valid today, cached for the site until an Item Price changes
+	:return: dict of item code and rate, items without a price are left out
+	"""
+	today = getdate()
+	rates = {}
+	missing = []
+	for item_code in dict.fromkeys(filter(None, item_codes)):
+		rate = get_cached_lookup(
+			ITEM_PRICE_CACHE_KEY, get_item_price_cache_key(item_code, price_list, today)
+		)
+		if rate is None:
+			missing.append(item_code)
+		elif rate != "":
+			rates[item_code] = rate
+
+	if missing:
+		resolved = resolve_item_price_rates(missing, price_list, today)
+		for item_code in missing:
+			rate = resolved.get(item_code)
+			set_cached_lookup(
+				ITEM_PRICE_CACHE_KEY,
+				get_item_price_cache_key(item_code, price_list, today),
+				"" if rate is None else rate,
+			)
+			if rate is not None:
+				rates[item_code] = rate
+
+	return rates
+
+
+def get_item_price_cache_key(item_code, price_list, date):
+	# entries of past days are dropped with the hash once it expires
+	return frappe.as_json([item_code, price_list, str(date)], indent=None)
+
+
+def resolve_item_price_rates(item_codes, price_list, date):
+	stock_uoms = dict(
+		frappe.get_all(
+			"Item", filters={"name": ["in", item_codes]}, fields=["name", "stock_uom"], as_list=True
+		)
+	)
+	item_prices = frappe.get_all(
+		"Item Price",
+		filters={
+			"price_list": price_list,
+			"item_code": ["in", item_codes],
+			"customer": ["is", "not set"],
+		},
+		fields=["item_code", "uom", "price_list_rate", "valid_from", "valid_upto"],
+		order_by="valid_from desc",
+	)
+
+	rates = {}
+	for item_price in item_prices:
+		if item_price.valid_from and getdate(item_price.valid_from) > date:
+			continue
+		if item_price.valid_upto and getdate(item_price.valid_upto) < date:
+			continue
+		if item_price.uom and item_price.uom != stock_uoms.get(item_price.item_code):
+			continue
+		rates.setdefault(item_price.item_code, item_price.price_list_rate)
+
+	return rates
+
+
+def clear_item_price_cache(doc=None, method=None):
+	"""Clear the cached item rates when an Item Price changes"""
+	frappe.cache().delete_value(ITEM_PRICE_CACHE_KEY)
+
+
 @frappe.whitelist()
 def get_children(doctype, parent=None, company=None, is_root=False):
 	parent_fieldname = "parent_" + doctype.lower().replace(" ", "_")
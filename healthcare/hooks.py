@@ -120,20 +120,54 @@ doc_events = {
 	},
 	"Company": {
 		"after_insert": "healthcare.healthcare.utils.create_healthcare_service_unit_tree_root",
-		"on_trash": "healthcare.healthcare.utils.company_on_trash",
+		"on_update": "healthcare.healthcare.doctype.healthcare_settings.healthcare_settings.clear_income_account_cache",
+		"on_trash": [
+			"healthcare.healthcare.utils.company_on_trash",
+			"healthcare.healthcare.doctype.healthcare_settings.healthcare_settings.clear_income_account_cache",
+		],
 	},
 	"Patient": {
 		"after_insert": "healthcare.regional.india.abdm.utils.set_consent_attachment_details"
 	},
+	"Healthcare Practitioner": {
+		"on_update": [
+			"healthcare.healthcare.utils.clear_billing_rate_cache",
+			"healthcare.healthcare.doctype.healthcare_settings.healthcare_settings.clear_income_account_cache",
+		],
+		"on_trash": [
+			"healthcare.healthcare.utils.clear_billing_rate_cache",
+			"healthcare.healthcare.doctype.healthcare_settings.healthcare_settings.clear_income_account_cache",
+		],
+	},
+	"Appointment Type": {
+		"on_update": "healthcare.healthcare.utils.clear_billing_rate_cache",
+		"on_trash": "healthcare.healthcare.utils.clear_billing_rate_cache",
+	},
+	"Healthcare Settings": {
+		"on_update": [
+			"healthcare.healthcare.utils.clear_billing_rate_cache",
+			"healthcare.healthcare.doctype.healthcare_settings.healthcare_settings.clear_income_account_cache",
+		],
+	},
+	"Item Price": {
+		"on_update": "healthcare.healthcare.utils.clear_item_price_cache",
+		"on_trash": "healthcare.healthcare.utils.clear_item_price_cache",
+	},
 }
 
 scheduler_events = {
 	"all": [
 		"healthcare.healthcare.doctype.patient_appointment.patient_appointment.send_appointment_reminder",
+		"healthcare.healthcare.doctype.patient_medical_record_event.patient_medical_record_event.enqueue_medical_record_events",
 	],
 	"daily": [
 		"healthcare.healthcare.doctype.patient_appointment.patient_appointment.update_appointment_status",
 		"healthcare.healthcare.doctype.fee_validity.fee_validity.update_validity_status",
+		"healthcare.healthcare.doctype.appointment_slot_occupancy.appointment_slot_occupancy.build_slot_occupancy",
+		"healthcare.healthcare.doctype.patient_medical_record_event.patient_medical_record_event.delete_processed_medical_record_events",
+	],
+	"hourly": [
+		"healthcare.healthcare.doctype.patient_appointment.patient_appointment.retry_appointment_invoices",
 	],
 }
 
@@ -0,0 +1,18 @@
+import frappe
+
+
+def execute():
+	frappe.db.sql(
+		"""
+		update `tabPatient Appointment`
+		set appointment_datetime = timestamp(appointment_date, ifnull(appointment_time, '00:00:00'))
+		where appointment_datetime is null and appointment_date is not null
+		"""
+	)
+	frappe.db.sql(
+		"""
+		update `tabPatient Appointment`
+		set appointment_end_datetime = appointment_datetime + interval ifnull(duration, 0) minute
+		where appointment_datetime is not null
+		"""
+	)
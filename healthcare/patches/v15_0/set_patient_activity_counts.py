@@ -0,0 +1,7 @@
+from healthcare.healthcare.doctype.patient_activity_count.patient_activity_count import (
+	rebuild_patient_activity_counts,
+)
+
+
+def execute():
+	rebuild_patient_activity_counts()
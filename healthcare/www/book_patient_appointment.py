@@ -44,21 +44,83 @@ def get_context(context):
 def book_appointment(args):
 	args = json.loads(args)
 	if args.get("patient"):
-		appointment = frappe.get_doc({
-			'doctype': 'Patient Appointment',
-			'patient': args.get("patient"),
-			'practitioner': args.get("practitioner"),
-			'appointment_date': args.get("date"),
-			'appointment_time': args.get("time"),
-			'duration': args.get("duration"),
-			'service_unit': args.get("service_unit"),
-			'appointment_type': args.get("appointment_type"),
-			'appointment_for': "Practitioner",
-			'add_video_conferencing': 0 if int(args.get("opt_out_vconf"))==1 else 1,
-		})
+		appointment = get_appointment_doc(args)
 		appointment.flags.silent = True
 		appointment.insert(ignore_permissions=True)
 		if appointment:
 			return appointment.name, appointment.practitioner_name
 	else:
-		frappe.msgprint(_("No patient found for {0}").format(frappe.session.user))
\ No newline at end of file
+		frappe.msgprint(_("No patient found for {0}").format(frappe.session.user))
+
+
+@frappe.whitelist()
+def book_appointments(appointments):
+	"""
+	Book a list of appointments in one transaction, validating them against each other and
+	the existing schedule, confirmations and calendar events are sent in the background
+	:param appointments: list of booking args as accepted by book_appointment
+	:return: list of {"idx", "name", "error"} per booking, failed bookings are not inserted
+	"""
+	from healthcare.healthcare.doctype.patient_appointment.patient_appointment import (
+		send_appointment_notifications,
+	)
+	from healthcare.healthcare.overlap_checker import AppointmentOverlapChecker
+
+	frappe.has_permission("Patient Appointment", "create", throw=True)
+
+	if isinstance(appointments, str):
+		appointments = json.loads(appointments)
+
+	overlap_checker = AppointmentOverlapChecker()
+	results, booked = [], []
+	for idx, args in enumerate(appointments):
+		result = frappe._dict(idx=idx, name=None, error=None)
+		results.append(result)
+		if not args.get("patient"):
+			result.error = _("Patient is required")
+			continue
+
+		savepoint = f"book_appointment_{idx}"
+		frappe.db.savepoint(savepoint)
+		try:
+			appointment = get_appointment_doc(args)
+			appointment.flags.overlap_checker = overlap_checker
+			appointment.flags.defer_notifications = True
+			appointment.flags.silent = True
+			appointment.insert()
+		except Exception as e:
+			frappe.db.rollback(save_point=savepoint)
+			frappe.clear_last_message()
+			result.error = str(e)
+			continue
+
+		# later bookings in the batch are validated against this one
+		overlap_checker.add(appointment)
+		result.name = appointment.name
+		booked.append(appointment.name)
+
+	if booked:
+		frappe.enqueue(
+			send_appointment_notifications,
+			appointments=booked,
+			queue="long",
+			enqueue_after_commit=True,
+		)
+
+	return results
+
+
+def get_appointment_doc(args):
+	# department is fetched from the practitioner and company from the defaults, never from the client
+	return frappe.get_doc({
+		'doctype': 'Patient Appointment',
+		'patient': args.get("patient"),
+		'practitioner': args.get("practitioner"),
+		'appointment_date': args.get("date"),
+		'appointment_time': args.get("time"),
+		'duration': args.get("duration"),
+		'service_unit': args.get("service_unit"),
+		'appointment_type': args.get("appointment_type"),
+		'appointment_for': "Practitioner",
+		'add_video_conferencing': 0 if int(args.get("opt_out_vconf") or 0)==1 else 1,
+	})